@@ -0,0 +1,123 @@
+"""
+OrderManager scaling benchmark.
+
+Times the operations that run on every rescan / button press against
+synthetic libraries of 10k .. 1M paths, after a quick check that grid
+jumps keep the shuffle cycle free of skips and repeats:
+
+    python benchmarks/bench_order.py
+    python benchmarks/bench_order.py --sizes 10000 200000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from photo_frame import MediaCatalog, OrderManager  # noqa: E402
+
+
+def synthetic_paths(n: int) -> list[str]:
+    return [f"/mnt/photo-frame/photos/album{i // 500:05d}/IMG_{i:07d}.jpg" for i in range(n)]
+
+
+def timed(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def check_jump_cycle(n: int = 200, cycles: int = 20, seed: int = 1) -> None:
+    """
+    Grid jumps (to played and unplayed slides) while upcoming() draws
+    ahead, as the app does on every slide: each cycle must show every
+    file, and next() must never repeat one within a cycle.
+    """
+    rng = random.Random(seed)
+    random.seed(seed)
+    files = synthetic_paths(n)
+    om = OrderManager(MediaCatalog.from_paths(files), shuffle=True, start_path=files[0])
+    seen = {om.current()}
+    done = 0
+    while done < cycles:
+        om.upcoming(3)
+        if rng.random() < 0.05:
+            p = rng.choice(files)
+            assert om.jump_to(p) and om.current() == p
+            seen.add(p)
+            continue
+        p = om.next()
+        if om.drawn_count() == 1:   # next() started a new cycle
+            assert len(seen) == n, f"cycle {done}: {n - len(seen)} slides never shown"
+            seen = {p}
+            done += 1
+        else:
+            assert p not in seen, f"cycle {done}: {p} shown twice"
+            seen.add(p)
+
+
+def bench(n: int) -> dict:
+    files = synthetic_paths(n)
+    mid = files[n // 2]
+    res: dict = {"n": n}
+
+    cat = None
+
+    def catalog():
+        nonlocal cat
+        cat = MediaCatalog.from_paths(files)
+
+    res["catalog_ms"] = timed(catalog)
+    assert cat is not None
+
+    om = None
+
+    def build():
+        nonlocal om
+        om = OrderManager(cat, shuffle=True, start_path=mid)
+
+    res["init_ms"] = timed(build)
+    assert om is not None and om.current() == mid
+    rescanned = MediaCatalog.from_paths(files)
+    res["set_files_ms"] = timed(lambda: om.set_files(rescanned, current_path=mid))
+    for _ in range(1000):
+        om.next()
+    # Typical sync: 50 deleted, 50 added
+    changed = files[50:] + [f"/mnt/photo-frame/photos/new/IMG_{i:04d}.jpg" for i in range(50)]
+    changed_cat = MediaCatalog.from_paths(changed)
+    res["merge_100_ms"] = timed(lambda: om.set_files(changed_cat, current_path=om.current()))
+    res["toggle_off_ms"] = timed(lambda: om.toggle_shuffle(current_path=mid))
+    res["toggle_on_ms"] = timed(lambda: om.toggle_shuffle(current_path=mid))
+    res["reset_cycle_ms"] = timed(lambda: om.reset_cycle(start_path=mid))
+
+    def steps():
+        for _ in range(10_000):
+            om.next()
+
+    res["next_10k_ms"] = timed(steps)
+    res["bag_bytes"] = om.shuffle_bag.itemsize * len(om.shuffle_bag)
+    res["catalog_bytes"] = (len(cat.names) + sum(a.itemsize * len(a) for a in
+                            (cat.dir_first, cat.name_off, cat.mtimes, cat.sorted_ids, cat.rank_of)))
+    return res
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="OrderManager scaling benchmark")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 200_000, 1_000_000])
+    args = p.parse_args()
+
+    check_jump_cycle()
+    cols = ["n", "catalog_ms", "init_ms", "set_files_ms", "merge_100_ms", "toggle_off_ms", "toggle_on_ms",
+            "reset_cycle_ms", "next_10k_ms", "bag_bytes", "catalog_bytes"]
+    print("  ".join(f"{c:>14}" for c in cols))
+    for n in args.sizes:
+        r = bench(n)
+        print("  ".join(f"{r[c]:>14.1f}" if isinstance(r[c], float) else f"{r[c]:>14}" for c in cols))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Headless benchmark suite (SDL dummy video driver).
+
+Generates (or reuses) a synthetic library with benchmarks/synthlib.py and
+times the hot paths:
+
+    scan      scan_media_catalog() walk + catalog signature + caption index update
+    decode    decode / scale / ImageCache.load_for_display per format, MP/s
+    order     OrderManager at 10k .. 1M entries (bench_order.py)
+    captions  wrap + render of slide captions (build_wrapped_surfaces)
+    draw      steady-state PhotoFrameApp.draw_frame (+ button overlay)
+
+    python benchmarks/bench_suite.py --json before.json
+    python benchmarks/bench_suite.py --json after.json --compare before.json
+    python benchmarks/bench_suite.py --only scan decode --library /tmp/synthlib --count 5000
+
+Results are written as JSON (metadata + one flat dict per benchmark) so
+two versions can be compared with --compare.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import pygame  # noqa: E402
+import photo_frame as pf  # noqa: E402
+import bench_order  # noqa: E402
+import synthlib  # noqa: E402
+
+BENCHES = ("scan", "decode", "order", "captions", "draw")
+SCREEN = (1920, 1200)
+
+
+def timed(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def best_of(fn, repeat: int) -> float:
+    return min(timed(fn) for _ in range(repeat))
+
+
+def dist(samples: list[float], prefix: str) -> dict:
+    """mean / p50 / p95 / max of samples (ms) under prefix_*."""
+    s = sorted(samples)
+    return {f"{prefix}_mean_ms": statistics.fmean(s), f"{prefix}_p50_ms": s[len(s) // 2],
+            f"{prefix}_p95_ms": s[min(len(s) - 1, int(len(s) * 0.95))], f"{prefix}_max_ms": s[-1]}
+
+
+def library_files(root: str) -> list[str]:
+    return list(pf.scan_media_catalog(root))
+
+
+# ---- benchmarks ----
+def bench_scan(root: str, repeat: int) -> dict:
+    res: dict = {}
+    caption_files: list[str] = []
+    cat = None
+
+    def walk():
+        nonlocal cat
+        caption_files.clear()
+        cat = pf.scan_media_catalog(root, caption_files)
+
+    res["walk_ms"] = best_of(walk, repeat)
+    assert cat is not None
+    res["files"] = len(cat)
+    res["caption_files"] = len(caption_files)
+    res["signature_ms"] = best_of(cat.signature, repeat)
+    data = tempfile.mkdtemp(prefix="bench-captions-")
+    try:
+        index = pf.CaptionIndex(root, os.path.join(data, pf.CAPTION_CATALOG_NAME))
+        res["captions_first_update_ms"] = timed(lambda: index.update(caption_files))
+        res["captions_noop_update_ms"] = best_of(lambda: index.update(caption_files), repeat)
+    finally:
+        shutil.rmtree(data, ignore_errors=True)
+    return res
+
+
+def bench_decode(root: str, per_format: int) -> dict:
+    pygame.display.set_mode(SCREEN)
+    files = library_files(root)
+    by_ext: dict = {}
+    for path in files:
+        by_ext.setdefault(os.path.splitext(path)[1].lower(), []).append(path)
+    res: dict = {}
+    for ext, paths in sorted(by_ext.items()):
+        picked = random.Random(7).sample(paths, min(per_format, len(paths)))
+        load_ms, scale_ms, mpix = [], [], 0.0
+        for path in picked:
+            t0 = time.perf_counter()
+            img = pygame.image.load(path).convert()
+            t1 = time.perf_counter()
+            pygame.transform.scale(img, SCREEN)
+            t2 = time.perf_counter()
+            load_ms.append((t1 - t0) * 1000.0)
+            scale_ms.append((t2 - t1) * 1000.0)
+            mpix += img.get_width() * img.get_height() / 1e6
+        name = ext.lstrip(".")
+        res.update(dist(load_ms, f"{name}_decode"))
+        res.update(dist(scale_ms, f"{name}_scale"))
+        res[f"{name}_decode_mpix_s"] = mpix / (sum(load_ms) / 1000.0)
+
+        # End to end through the cache: background decode thread, EXIF, scale
+        cache = pf.ImageCache()
+        try:
+            total = timed(lambda: [cache.load_for_display(p, SCREEN) for p in picked])
+        finally:
+            cache.close()
+        res[f"{name}_cache_ms_per_image"] = total / len(picked)
+        res[f"{name}_cache_images_s"] = len(picked) / (total / 1000.0)
+    return res
+
+
+def bench_order_sizes(sizes: list[int]) -> dict:
+    res: dict = {}
+    for n in sizes:
+        for k, v in bench_order.bench(n).items():
+            if k != "n":
+                res[f"{n}_{k}"] = v
+    return res
+
+
+def bench_captions(root: str, count: int) -> dict:
+    pygame.display.set_mode(SCREEN)
+    cfg = pf.Config(photos_dir=root, data_dir=tempfile.gettempdir())
+    pf.AppPaths.font_file = cfg.font_file
+    pf.AppPaths.font_fallback_name = cfg.font_fallback_name
+    rng = random.Random(3)
+    texts = [" ".join(rng.choice(synthlib.WORDS) for _ in range(rng.randint(3, 60))) for _ in range(count)]
+    max_w = int(SCREEN[0] * cfg.caption_max_width_ratio)
+    samples = []
+    for text in texts:
+        samples.append(timed(lambda: pf.build_wrapped_surfaces(
+            text, cfg.caption_base_size, cfg.caption_min_size, max_w, cfg.caption_max_lines,
+            uppercase=True)))
+    res = dist(samples, "layout")
+    res["texts"] = count
+    return res
+
+
+def bench_draw(root: str, frames: int) -> dict:
+    data = tempfile.mkdtemp(prefix="bench-data-")
+    try:
+        cfg = pf.Config(photos_dir=root, data_dir=data, fullscreen=False, slide_seconds=1e9,
+                        rescan_interval_sec=1e9, dedupe_enabled=False, embedded_captions_enabled=False,
+                        thumbnails_enabled=False, auto_sleep_enabled=False, auto_dim_enabled=False)
+        app = pf.PhotoFrameApp(cfg)
+        app.init_pygame()
+        app.load_files_and_order()
+        sw, sh = app.screen.get_size()
+        buttons = app.load_button_assets(sw, sh)
+        app.sleeping = False
+        app.paused = True
+        # Warm: wait until the full slide (not a preview) is on screen
+        deadline = time.perf_counter() + 15.0
+        while time.perf_counter() < deadline:
+            app.draw_frame()
+            cur = app.order.current()
+            if app._last_full is not None and app._last_full[0] == cur:
+                break
+            time.sleep(0.01)
+
+        def run(overlay: bool, captions: bool) -> list[float]:
+            app.overlay_visible = overlay
+            app.captions_on = captions
+            app.caption_mode = "on" if captions else "off"
+            out = []
+            for _ in range(frames):
+                t0 = time.perf_counter()
+                app.draw_frame()
+                if overlay:
+                    app.draw_overlay(buttons)
+                out.append((time.perf_counter() - t0) * 1000.0)
+            return out
+
+        res: dict = {"screen": f"{sw}x{sh}"}
+        res.update(dist(run(False, False), "slide"))
+        res.update(dist(run(False, True), "slide_captions"))
+        res.update(dist(run(True, True), "slide_captions_overlay"))
+        app.user_brightness = 0.4
+        res.update(dist(run(False, False), "slide_dimmed"))
+        app.running = False
+        app.state_writer.close()
+        app.cache.close()
+        app.readahead.close()
+        app.history.close()
+        pygame.quit()
+        return res
+    finally:
+        shutil.rmtree(data, ignore_errors=True)
+
+
+# ---- driver ----
+def metadata(args, library: dict) -> dict:
+    try:
+        rev = subprocess.run(["git", "-C", os.path.dirname(HERE), "rev-parse", "--short", "HEAD"],
+                             capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        rev = None
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "git": rev, "python": platform.python_version(),
+            "pygame": pygame.version.ver, "sdl": ".".join(map(str, pygame.get_sdl_version())),
+            "machine": platform.machine(), "platform": platform.platform(), "library": library,
+            "args": {k: v for k, v in vars(args).items() if k not in ("json", "compare")}}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> None:
+    """Print metrics that moved by more than threshold (fraction) against a baseline run."""
+    print(f"\nvs {baseline.get('meta', {}).get('git')} ({baseline.get('meta', {}).get('time')}):")
+    for bench, values in results.items():
+        old = baseline.get("results", {}).get(bench, {})
+        for k, v in values.items():
+            o = old.get(k)
+            if not isinstance(v, (int, float)) or not isinstance(o, (int, float)) or not o:
+                continue
+            change = (v - o) / o
+            if abs(change) >= threshold:
+                print(f"  {bench}.{k:<36} {o:>12.3f} -> {v:>12.3f}  {change * 100:+6.1f}%")
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Photo frame headless benchmark suite")
+    p.add_argument("--only", nargs="+", choices=BENCHES, default=list(BENCHES))
+    p.add_argument("--library", default=None, help="Synthetic library folder (generated if missing)")
+    p.add_argument("--count", type=int, default=2000, help="Images to generate")
+    p.add_argument("--repeat", type=int, default=3, help="Repeats for scan timings (best of)")
+    p.add_argument("--decode-per-format", type=int, default=12)
+    p.add_argument("--order-sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    p.add_argument("--caption-texts", type=int, default=200)
+    p.add_argument("--frames", type=int, default=120, help="Frames per draw_frame scenario")
+    p.add_argument("--json", default=None, help="Write results here")
+    p.add_argument("--compare", default=None, help="Baseline JSON from an earlier run")
+    p.add_argument("--threshold", type=float, default=0.10, help="Report changes above this fraction")
+    args = p.parse_args()
+
+    pygame.init()
+    root = args.library
+    temp_root = None
+    library: dict = {}
+    needs_library = set(args.only) - {"order"}
+    if needs_library:
+        if root is None:
+            root = temp_root = tempfile.mkdtemp(prefix="bench-lib-")
+        if not os.path.isdir(root) or not os.listdir(root):
+            print(f"generating {args.count} images in {root} ...", file=sys.stderr, flush=True)
+            library = synthlib.make_library(root, args.count)
+        library["root"] = os.path.abspath(root)
+
+    results: dict = {}
+    try:
+        for name in [b for b in BENCHES if b in args.only]:
+            t0 = time.perf_counter()
+            if name == "scan":
+                results[name] = bench_scan(root, args.repeat)
+            elif name == "decode":
+                results[name] = bench_decode(root, args.decode_per_format)
+            elif name == "order":
+                results[name] = bench_order_sizes(args.order_sizes)
+            elif name == "captions":
+                results[name] = bench_captions(root, args.caption_texts)
+            elif name == "draw":
+                results[name] = bench_draw(root, args.frames)
+            print(f"[{name}] {time.perf_counter() - t0:.1f}s", file=sys.stderr, flush=True)
+            for k, v in results[name].items():
+                print(f"  {k:<40} {v:>14.3f}" if isinstance(v, float) else f"  {k:<40} {v:>14}")
+    finally:
+        if temp_root:
+            shutil.rmtree(temp_root, ignore_errors=True)
+
+    out = {"meta": metadata(args, library), "results": results}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(out, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f), args.threshold)
+
+
+if __name__ == "__main__":
+    main()
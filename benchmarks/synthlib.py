@@ -0,0 +1,176 @@
+"""
+Synthetic photo library generator for the benchmarks.
+
+Writes `count` images (JPEG/PNG/WebP, camera-to-thumbnail sizes) into
+nested year/album[/sub] folders, with .txt sidecar captions and a few
+per-folder captions.json manifests:
+
+    python benchmarks/synthlib.py /tmp/synthlib --count 5000
+
+Each (size, format) pair is rendered and encoded once, then hard-linked
+(--copy: copied, so every file gets its own mtime), so thousands of files
+take seconds and little disk. pygame cannot encode WebP; WebP files
+are made with `cwebp` when it is on PATH, else WebP is left out (the
+summary lists what was skipped).
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import subprocess
+import tempfile
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame  # noqa: E402
+
+SIZE_MIX = [((4032, 3024), 0.20), ((3000, 2000), 0.15), ((1920, 1080), 0.30),
+            ((1280, 960), 0.25), ((640, 480), 0.10)]
+FORMAT_MIX = [(".jpg", 0.80), (".png", 0.12), (".webp", 0.08)]
+PER_FOLDER = 40             # images per album folder
+CAPTION_RATIO = 0.3         # share of images with a .txt sidecar
+MANIFEST_EVERY = 5          # every Nth album also gets a captions.json
+WORDS = ("summer evening lake house grandma birthday cake garden snow hiking trail beach "
+         "sunset first day school road trip mountains picnic wedding dance kitchen puppy "
+         "harbour lights market morning coffee family reunion festival river bridge").split()
+
+
+def _pick(rng: random.Random, mix: list):
+    return rng.choices([v for v, _ in mix], weights=[w for _, w in mix])[0]
+
+
+def render_picture(size: tuple[int, int], seed: int) -> pygame.Surface:
+    """Smooth gradients plus hard-edged shapes: compresses roughly like a photo."""
+    rng = random.Random(seed)
+    small = pygame.Surface((8, 6))
+    for x in range(8):
+        for y in range(6):
+            small.set_at((x, y), [rng.randrange(256) for _ in range(3)])
+    surf = pygame.transform.smoothscale(small, size)
+    w, h = size
+    for _ in range(40):
+        color = [rng.randrange(256) for _ in range(3)]
+        r = pygame.Rect(rng.randrange(w), rng.randrange(h), rng.randrange(w // 8 + 1), rng.randrange(h // 8 + 1))
+        if rng.random() < 0.5:
+            pygame.draw.rect(surf, color, r)
+        else:
+            pygame.draw.circle(surf, color, r.center, max(2, r.w // 2))
+    return surf
+
+
+def _encode(surf: pygame.Surface, path: str) -> bool:
+    """Save surf to path; False if this format cannot be written here."""
+    try:
+        pygame.image.save(surf, path)
+        if not path.endswith(".webp"):
+            return True
+        with open(path, "rb") as f:
+            head = f.read(12)
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            return True
+        os.remove(path)     # unknown extensions fall back to TGA
+    except (pygame.error, ValueError):
+        pass
+    if path.endswith(".webp") and shutil.which("cwebp"):
+        png = path[:-5] + ".png"
+        pygame.image.save(surf, png)
+        ok = subprocess.run(["cwebp", "-quiet", "-q", "80", png, "-o", path]).returncode == 0
+        os.remove(png)
+        return ok and os.path.isfile(path)
+    return False
+
+
+def make_library(root: str, count: int, seed: int = 1, caption_ratio: float = CAPTION_RATIO,
+                 per_folder: int = PER_FOLDER, copy: bool = False) -> dict:
+    """Generate the library under root; returns a summary (counts, bytes, skipped formats)."""
+    rng = random.Random(seed)
+    pygame.init()
+    templates: dict = {}
+    skipped: set = set()
+    # Templates live inside root so they can be hard-linked (same filesystem)
+    os.makedirs(root, exist_ok=True)
+    tmpl_dir = tempfile.mkdtemp(prefix=".synthlib-", dir=root)
+    summary: dict = {"root": os.path.abspath(root), "files": 0, "bytes": 0, "by_format": {}, "captions": 0,
+                     "manifests": 0, "folders": 0}
+    now = time.time()
+    try:
+        folders: set = set()
+        manifest: dict = {}
+        for i in range(count):
+            folder = i // per_folder
+            parts = [str(2000 + folder % 25), f"album-{folder:04d}"]
+            if folder % 3 == 0:
+                parts.append(f"sub-{folder % 7}")
+            d = os.path.join(root, *parts)
+            if d not in folders:
+                os.makedirs(d, exist_ok=True)
+                folders.add(d)
+
+            size = _pick(rng, SIZE_MIX)
+            ext = _pick(rng, [(e, w) for e, w in FORMAT_MIX if e not in skipped] or FORMAT_MIX[:1])
+            key = (size, ext)
+            if key not in templates:
+                tmpl = os.path.join(tmpl_dir, f"{size[0]}x{size[1]}{ext}")
+                if not _encode(render_picture(size, rng.randrange(1 << 30)), tmpl):
+                    skipped.add(ext)
+                    ext = ".jpg"
+                    key = (size, ext)
+                    tmpl = os.path.join(tmpl_dir, f"{size[0]}x{size[1]}{ext}")
+                    if key not in templates:
+                        _encode(render_picture(size, rng.randrange(1 << 30)), tmpl)
+                templates[key] = tmpl
+
+            name = f"IMG_{i:06d}{ext}"
+            path = os.path.join(d, name)
+            try:
+                if copy:
+                    raise OSError
+                os.link(templates[key], path)
+            except OSError:
+                shutil.copyfile(templates[key], path)
+                mtime = now - rng.uniform(0, 3 * 365 * 86400)
+                os.utime(path, (mtime, mtime))
+            summary["files"] += 1
+            summary["bytes"] += os.path.getsize(path)
+            summary["by_format"][ext] = summary["by_format"].get(ext, 0) + 1
+
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 40))).capitalize()
+            if rng.random() < caption_ratio:
+                with open(os.path.splitext(path)[0] + ".txt", "w", encoding="utf-8") as f:
+                    f.write(text + "\n")
+                summary["captions"] += 1
+            elif folder % MANIFEST_EVERY == 0:
+                manifest.setdefault(d, {})[name] = text
+
+        for d, entries in manifest.items():
+            with open(os.path.join(d, "captions.json"), "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            summary["manifests"] += 1
+        summary["folders"] = len(folders)
+    finally:
+        shutil.rmtree(tmpl_dir, ignore_errors=True)
+    summary["skipped_formats"] = sorted(skipped)
+    return summary
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Generate a synthetic photo library")
+    p.add_argument("root", help="Output folder (created)")
+    p.add_argument("--count", type=int, default=2000)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--captions", type=float, default=CAPTION_RATIO, help="Share of images with a .txt sidecar")
+    p.add_argument("--copy", action="store_true", help="Copy files instead of hard-linking (distinct mtimes)")
+    args = p.parse_args()
+    t0 = time.perf_counter()
+    summary = make_library(args.root, args.count, seed=args.seed, caption_ratio=args.captions, copy=args.copy)
+    summary["seconds"] = round(time.perf_counter() - t0, 2)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
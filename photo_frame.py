@@ -1,13 +1,37 @@
-from cProfile import label
 import os
 import sys
 import time
+import io
 import json
+import html
+import re
 import shutil
+import math
 import random
+import bisect
+import hashlib
+import itertools
+import operator
+import struct
 import argparse
+import csv
+import concurrent.futures
+import functools
+import http.server
+import asyncio
+import urllib.parse
+import socket
+import traceback
+import faulthandler
+import cProfile
+import signal
+import multiprocessing
+import queue
+import threading
+from array import array
+from collections import OrderedDict, deque
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from typing import Callable, List, Optional, Sequence, Tuple
 import datetime
 import pygame
 
@@ -17,7 +41,11 @@ import pygame
 # -------------------------
 SUPPORTED_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
 STATE_FILE_NAME = ".photo_frame_state.json"
+ORDER_FILE_NAME = ".photo_frame_order.bin"
 FAVORITES_DIR_NAME = "favorites"
+CAPTION_CATALOG_NAME = "caption_catalog.json"
+CAPTION_CATALOG_VERSION = 1
+CAPTION_MANIFEST_NAMES = ("captions.json", "captions.csv")   # optional, one per folder
 
 DEFAULT_PHOTOS_WINDOWS = r"C:\PhotoFrame\photos"
 DEFAULT_DATA_WINDOWS   = r"C:\PhotoFrame\data"
@@ -117,6 +145,61 @@ class Config:
     clock_format: str = "%H:%M"
     clock_margin: int = 12
 
+    # Smart (weighted) shuffle
+    weight_favorite: float = 3.0        # favorites are picked 3x as often
+    weight_recent: float = 2.0          # boost for recently added files...
+    weight_recent_days: float = 30.0    # ...newer than this
+    weighted_cooldown_ratio: float = 0.5  # share of library shown before a photo may return
+
+    # State persistence (write-behind)
+    state_flush_seconds: float = 15.0     # coalesce state changes for this long
+
+    # View history
+    history_compact_records: int = 5000   # fold the log into aggregates after this many views
+
+    # Duplicate suppression (background hash index)
+    dedupe_enabled: bool = True
+    hash_workers: int = 2                 # hashing processes (low priority)
+    near_dup_distance: int = 6            # dHash bits; closer counts as near-identical
+    near_dup_window: int = 8              # keep near-duplicates this many slides apart
+
+    # Captions embedded in the photos (XMP / IPTC / EXIF); sidecars win
+    embedded_captions_enabled: bool = True
+    caption_workers: int = 2
+
+    # Readahead: encoded bytes of the next slides kept in RAM (slow mounts)
+    readahead_count: int = 3              # 0 disables
+    readahead_max_mb: float = 64.0
+
+    # Decode + scale slides in a worker process (shared-memory handoff)
+    decode_in_worker: bool = False
+
+    # Grid browse view (thumbnail atlas built in the background)
+    thumbnails_enabled: bool = True
+    thumb_workers: int = 1
+
+    # Show a low-res preview while a slide decodes, then swap in the full image
+    progressive_display: bool = True
+
+    # Per-stage frame timing histograms (toggle at runtime with "t")
+    frame_timing: bool = False
+    frame_report_seconds: float = 300.0   # print a p50/p95/p99 table to stderr this often
+
+    # Prometheus text endpoint (GET /metrics) on a background thread
+    metrics_port: int = 0                 # 0 disables; e.g. 9464
+    metrics_bind: str = "127.0.0.1"       # local only; set "0.0.0.0" for a LAN scraper
+
+    # Local control API (next/pause/show/status); either listener may be off
+    control_socket: str = ""              # Unix socket path, e.g. /run/photo-frame/control.sock
+    control_port: int = 0                 # HTTP on control_bind; 0 disables
+    control_bind: str = "127.0.0.1"
+
+    # Main-loop stall detector (systemd watchdog pings come from the loop itself)
+    stall_seconds: float = 10.0           # report a frame stuck this long; 0 disables
+
+    # Profiling: cProfile the main loop in windows, dumped as .pstats (--profile)
+    profile_window_seconds: float = 0.0   # 0 disables
+
 class AppFonts:
     font_file: str = "assets/Inter-Regular.ttf"   # relative to data_dir
     font_fallback_name: str = "DejaVu Sans"
@@ -199,7 +282,7 @@ def worst_case_button_labels() -> list[str]:
         "Pause",                 # Play/Pause toggles - Pause is slightly wider in some fonts
         "Next",
         "Sleep",
-        "Shuffle: Off",          # longer than "Shuffle: On"
+        "Shuffle: Smart",        # longest of Off/On/Smart
         "Captions: FADE",        # longest of OFF/ON/FADE
         "Bright: 100%",          # longest brightness label
         "Reload",
@@ -225,33 +308,32 @@ def render_text_to_fit(text: str, max_w: int, max_h: int) -> pygame.Surface:
     font = load_font(min_size)
     return font.render(text, True, (255, 255, 255))
 
-def list_media_files(folder: str) -> List[str]:
-    files: List[str] = []
+def scan_media_catalog(folder: str, caption_files: Optional[List[str]] = None) -> "MediaCatalog":
+    """
+    Walk folder into a MediaCatalog (names and mtimes). If caption_files is
+    given, .txt sidecars and caption manifests found by the same walk are
+    appended to it.
+    """
+    groups: List[tuple[str, List[tuple[str, float]]]] = []
     if not os.path.isdir(folder):
-        return files
+        return MediaCatalog()
 
     for root, _, fnames in os.walk(folder):
-        pass
-
-
+        entries: List[tuple[str, float]] = []
         for fn in fnames:
             ext = os.path.splitext(fn)[1].lower()
             if ext in SUPPORTED_EXTS:
-                files.append(os.path.join(root, fn))
-
-    files.sort(key=lambda p: p.lower())
-    return files
+                try:
+                    m = os.path.getmtime(os.path.join(root, fn))
+                except OSError:
+                    m = 0.0
+                entries.append((fn, m))
+            elif caption_files is not None and (ext == ".txt" or fn.lower() in CAPTION_MANIFEST_NAMES):
+                caption_files.append(os.path.join(root, fn))
+        if entries:
+            groups.append((root, entries))
 
-
-def file_signature(paths: List[str]) -> Tuple[int, int]:
-    """A cheap signature: (count, sum of mtimes seconds)."""
-    s = 0
-    for p in paths:
-        try:
-            s += int(os.path.getmtime(p))
-        except OSError:
-            pass
-    return (len(paths), s)
+    return MediaCatalog.from_groups(groups)
 
 
 def load_state(state_path: str) -> dict:
@@ -264,45 +346,310 @@ def load_state(state_path: str) -> dict:
         return {}
 
 
-def save_state(state_path: str, state: dict) -> None:
+def save_state(state_path: str, state: dict) -> bool:
     tmp = state_path + ".tmp"
     try:
         with open(tmp, "w", encoding="utf-8") as f:
             json.dump(state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
         os.replace(tmp, state_path)
+        return True
     except Exception:
         # best effort; ignore
-        pass
+        return False
 
 
-def ensure_favorites_dir(folder: str) -> str:
-    fav_dir = os.path.join(folder, FAVORITES_DIR_NAME)
-    os.makedirs(fav_dir, exist_ok=True)
-    return fav_dir
+class StateWriter:
+    """
+    Write-behind for state files. Jobs run in submission order on one
+    daemon thread, so the render loop never waits on the SD card.
+    """
+    def __init__(self):
+        self._q: "queue.Queue[Optional[Callable[[], None]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="state-writer", daemon=True)
+        self._thread.start()
 
+    def submit(self, job: Callable[[], None]) -> None:
+        self._q.put(job)
+
+    def _run(self) -> None:
+        while True:
+            job = self._q.get()
+            try:
+                if job is None:
+                    return
+                job()
+            except Exception:
+                # best effort; ignore
+                pass
+            finally:
+                self._q.task_done()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Finish queued writes and stop the thread."""
+        self._q.put(None)
+        self._thread.join(timeout)
 
-def is_favorited(favorites_dir: str, filepath: str) -> bool:
-    if not filepath:
-        return False
-    base = os.path.basename(filepath)
-    return os.path.isfile(os.path.join(favorites_dir, base))
 
+ORDER_MAGIC = b"PFOB"
+ORDER_VERSION = 1
+ORDER_HEADER = struct.Struct("<4sHHQII")  # magic, version, reserved, generation, count, pos
 
 
-def copy_to_favorites(favorites_dir: str, filepath: str) -> bool:
+def _le_bytes(a: array) -> bytes:
+    if sys.byteorder == "big":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+def save_cycle(path: str, generation: int, ranks: array, pos: int) -> bool:
+    """Full rewrite of the shuffle cycle file (atomic replace)."""
+    tmp = path + ".tmp"
     try:
-        os.makedirs(favorites_dir, exist_ok=True)
-        dst = os.path.join(favorites_dir, os.path.basename(filepath))
-        if os.path.abspath(filepath) == os.path.abspath(dst):
-            return True
-        if os.path.isfile(dst):
-            return True
-        shutil.copy2(filepath, dst)
+        with open(tmp, "wb") as f:
+            f.write(ORDER_HEADER.pack(ORDER_MAGIC, ORDER_VERSION, 0, generation, len(ranks), pos))
+            f.write(_le_bytes(ranks))
+        os.replace(tmp, path)
         return True
     except Exception:
+        # best effort; ignore
+        return False
+
+
+def append_cycle(path: str, generation: int, start: int, ranks: array, pos: int) -> bool:
+    """
+    Append newly drawn entries at index `start` and update count/pos in
+    place. Entries are written before the header, so a torn write leaves the
+    previous (valid) header in charge. Returns False if a full write is needed.
+    """
+    try:
+        with open(path, "r+b") as f:
+            if ranks:
+                f.seek(ORDER_HEADER.size + 4 * start)
+                f.write(_le_bytes(ranks))
+            f.seek(0)
+            f.write(ORDER_HEADER.pack(ORDER_MAGIC, ORDER_VERSION, 0, generation, start + len(ranks), pos))
+        return True
+    except OSError:
         return False
 
 
+def load_cycle(path: str) -> Optional[tuple[int, array, int]]:
+    """Return (generation, ranks, pos) from the cycle file, or None."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(ORDER_HEADER.size)
+            if len(head) != ORDER_HEADER.size:
+                return None
+            magic, version, _, generation, count, pos = ORDER_HEADER.unpack(head)
+            if magic != ORDER_MAGIC or version != ORDER_VERSION:
+                return None
+            ranks = array("I")
+            ranks.frombytes(f.read(4 * count))
+    except (OSError, ValueError):
+        return None
+    if len(ranks) != count:
+        return None
+    if sys.byteorder == "big":
+        ranks.byteswap()
+    return generation, ranks, pos
+
+
+FICLONE = 0x40049409  # Linux ioctl: share extents (btrfs/xfs reflink)
+
+
+def link_or_copy(src: str, dst: str) -> str:
+    """
+    Put src at dst as cheaply as the filesystem allows: hardlink, then
+    reflink, then a full copy. Returns "link", "reflink" or "copy".
+    """
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        pass
+    try:
+        import fcntl
+        with open(src, "rb") as fs, open(dst, "wb") as fd:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+        shutil.copystat(src, dst)
+        return "reflink"
+    except (ImportError, OSError):
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def library_relpath(path: str, root: str) -> str:
+    """Fast relpath for paths under root (falls back to safe_relpath)."""
+    prefix = root.rstrip(os.sep) + os.sep
+    if path.startswith(prefix):
+        return path[len(prefix):]
+    return safe_relpath(path, root)
+
+
+def content_key(path: str) -> str:
+    """
+    Cheap content identity: size plus hashes of the first and last 64 KiB.
+    Tells a favorite copy from a different photo that shares its basename.
+    """
+    h = hashlib.blake2b(digest_size=12)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        h.update(size.to_bytes(8, "little"))
+        h.update(f.read(65536))
+        if size > 131072:
+            f.seek(-65536, os.SEEK_END)
+            h.update(f.read(65536))
+    return h.hexdigest()
+
+
+FAVORITES_INDEX_NAME = "favorites_index.json"
+
+
+class FavoritesIndex:
+    """
+    In-memory index of the favorites folder.
+
+    - sources: library relpaths that were favorited (O(1) check, no I/O,
+      so the overlay can show favorite state every frame)
+    - keys: content keys of everything in the folder, so re-favoriting the
+      same photo is a no-op and two different photos with one basename
+      both survive (the second gets a key suffix)
+
+    Linking/copying, hashing and index writes run on one worker thread.
+    The index is saved as favorites_index.json in data_dir.
+    """
+    def __init__(self, favorites_dir: str, photos_root: str, index_path: str):
+        self.favorites_dir = favorites_dir
+        self.photos_root = photos_root
+        self.index_path = index_path
+        self.sources: set[str] = set()
+        self.keys: set[str] = set()
+        self.entries: dict[str, dict] = {}   # favorite file name -> {key, src, size, mtime_ns}
+        self._lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="favorites")
+
+    def load(self, library: Sequence[str]) -> None:
+        """Read the saved index; hash new/changed favorites in the background."""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                saved = json.load(f).get("entries", {})
+        except Exception:
+            saved = {}
+        try:
+            names = [n for n in os.listdir(self.favorites_dir) if not n.startswith(".")]
+        except OSError:
+            names = []
+        stale = []
+        for name in names:
+            try:
+                st = os.stat(os.path.join(self.favorites_dir, name))
+            except OSError:
+                continue
+            e = saved.get(name)
+            if isinstance(e, dict) and e.get("size") == st.st_size and e.get("mtime_ns") == st.st_mtime_ns:
+                self.entries[name] = e
+            else:
+                stale.append(name)
+        self.keys = {e["key"] for e in self.entries.values() if e.get("key")}
+        self.sources = {e["src"] for e in self.entries.values() if e.get("src")}
+        if stale or len(self.entries) != len(saved):
+            self._pool.submit(self._rescan, stale, library)
+
+    def _rescan(self, stale: List[str], library: Sequence[str]) -> None:
+        """Worker: hash unknown favorites and match them to library photos by content."""
+        for name in stale:
+            fav = os.path.join(self.favorites_dir, name)
+            try:
+                st = os.stat(fav)
+                key = content_key(fav)
+            except OSError:
+                continue
+            with self._lock:
+                self.entries[name] = {"key": key, "src": None, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+                self.keys.add(key)
+        # Favorites copied before this index existed: find their source photos
+        orphans = {e["key"]: e for e in self.entries.values() if not e.get("src")}
+        if orphans:
+            names = {os.path.splitext(n)[0].lower() for n in self.entries}
+            for p in library:
+                if os.path.splitext(os.path.basename(p))[0].lower() not in names:
+                    continue
+                try:
+                    e = orphans.get(content_key(p))
+                except OSError:
+                    continue
+                if e is not None:
+                    e["src"] = library_relpath(p, self.photos_root)
+                    self.sources.add(e["src"])
+        self._save()
+
+    def _save(self) -> None:
+        with self._lock:
+            data = {"version": 1, "entries": dict(self.entries)}
+        tmp = self.index_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.index_path)
+        except Exception:
+            pass
+
+    def contains(self, path: Optional[str]) -> bool:
+        if not path:
+            return False
+        return library_relpath(path, self.photos_root) in self.sources
+
+    def add(self, path: str) -> bool:
+        """
+        Favorite a library photo. Returns at once (the state is visible
+        immediately); the link/copy happens on the worker thread.
+        Returns False if it was already a favorite.
+        """
+        rel = library_relpath(path, self.photos_root)
+        if rel in self.sources:
+            return False
+        self.sources.add(rel)
+        self._pool.submit(self._store, path, rel)
+        return True
+
+    def _store(self, path: str, rel: str) -> None:
+        try:
+            key = content_key(path)
+            if key in self.keys:
+                # Same photo already in favorites (e.g. under another name)
+                with self._lock:
+                    for e in self.entries.values():
+                        if e.get("key") == key and not e.get("src"):
+                            e["src"] = rel
+                self._save()
+                return
+            os.makedirs(self.favorites_dir, exist_ok=True)
+            name = os.path.basename(path)
+            if os.path.exists(os.path.join(self.favorites_dir, name)):
+                stem, ext = os.path.splitext(name)
+                name = f"{stem}-{key[:8]}{ext}"
+            dst = os.path.join(self.favorites_dir, name)
+            link_or_copy(path, dst)
+            st = os.stat(dst)
+            with self._lock:
+                self.entries[name] = {"key": key, "src": rel, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+                self.keys.add(key)
+            self._save()
+        except Exception:
+            self.sources.discard(rel)
+
+    def close(self) -> None:
+        """Wait for pending favorite copies."""
+        self._pool.shutdown(wait=True)
+
+
 def wrap_text_to_width(font: pygame.font.Font, text: str, max_width: int) -> list[str]:
     """Word-wrap text to fit within max_width (pixels)."""
     words = text.split()
@@ -381,27 +728,15 @@ def parse_args() -> argparse.Namespace:
     p.add_argument("--windowed", action="store_true", help="Run in a window (dev mode)")
     p.add_argument("--seconds", type=float, default=10.0, help="Seconds per slide")
     p.add_argument("--rescan", type=float, default=10.0, help="Rescan folder interval seconds")
+    p.add_argument("--report", default=None,
+                   choices=["most-skipped", "most-shown", "least-shown", "never-shown", "longest-dwell"],
+                   help="Print a view-history report and exit")
+    p.add_argument("--report-limit", type=int, default=20, help="Rows in --report output")
+    p.add_argument("--profile", type=float, nargs="?", const=60.0, default=0.0, metavar="SECONDS",
+                   help="Run the main loop under cProfile; dump <data>/profile/*.pstats every SECONDS (60)")
     return p.parse_args()
 
 
-def sidecar_caption_txt(image_path: str) -> Optional[str]:
-    """
-    Looks for a .txt file matching the image path:
-      photo.jpg -> photo.txt
-    Returns stripped text or None.
-    """
-    base, _ = os.path.splitext(image_path)
-    txt_path = base + ".txt"
-    if not os.path.isfile(txt_path):
-        return None
-    try:
-        with open(txt_path, "r", encoding="utf-8") as f:
-            text = f.read().strip()
-        return text if text else None
-    except Exception:
-        return None
-
-
 def folder_caption(image_path: str, photos_root: str) -> str:
     """
     Returns the immediate folder name containing the image.
@@ -419,6 +754,123 @@ def folder_caption(image_path: str, photos_root: str) -> str:
     return name or (os.path.basename(photos_root) or photos_root)
 
 
+def read_caption_text(txt_path: str) -> Optional[str]:
+    """Stripped text of a caption file, or None if empty/unreadable."""
+    try:
+        with open(txt_path, "r", encoding="utf-8") as f:
+            text = f.read().strip()
+        return text if text else None
+    except Exception:
+        return None
+
+
+def read_caption_manifest(path: str) -> dict[str, str]:
+    """
+    Per-folder caption manifest: captions.json ({"IMG_1.jpg": "text", ...})
+    or captions.csv (rows of filename,caption; a header row is skipped).
+    """
+    out: dict[str, str] = {}
+    try:
+        if path.lower().endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                for name, text in data.items():
+                    if isinstance(name, str) and isinstance(text, str) and text.strip():
+                        out[name] = text.strip()
+        else:
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                for row in csv.reader(f):
+                    if len(row) < 2 or row[0].strip().lower() in ("file", "filename", "name"):
+                        continue
+                    if row[1].strip():
+                        out[row[0].strip()] = row[1].strip()
+    except Exception:
+        pass
+    return out
+
+
+class CaptionIndex:
+    """
+    Sidecar captions (photo.jpg -> photo.txt) and per-folder manifests,
+    discovered by the library walk and kept in caption_catalog.json with
+    their mtimes. update() re-reads only files whose mtime changed, so a
+    caption lookup is a dict hit and never touches the filesystem.
+
+    A .txt sidecar wins over a manifest entry for the same photo.
+    """
+    def __init__(self, photos_root: str, catalog_path: str):
+        self.photos_root = photos_root
+        self.catalog_path = catalog_path
+        self.files: dict[str, tuple[float, object]] = {}  # caption file -> (mtime, text | manifest)
+        self.by_stem: dict[str, str] = {}                  # image path minus extension -> text
+        self.by_folder: dict[str, dict[str, str]] = {}     # folder -> {basename: text}
+
+    def load(self) -> None:
+        data = load_state(self.catalog_path)
+        if not isinstance(data, dict) or data.get("version") != CAPTION_CATALOG_VERSION:
+            return
+        files = data.get("files")
+        if not isinstance(files, dict):
+            return
+        for rel, entry in files.items():
+            if isinstance(entry, list) and len(entry) == 2:
+                self.files[os.path.join(self.photos_root, rel)] = (entry[0], entry[1])
+        self._rebuild()
+
+    def to_json(self) -> dict:
+        root = self.photos_root
+        return {"version": CAPTION_CATALOG_VERSION,
+                "files": {library_relpath(p, root): [m, v] for p, (m, v) in self.files.items()}}
+
+    def update(self, caption_files: List[str]) -> bool:
+        """Sync with the caption files found by a scan. True if anything changed."""
+        changed = False
+        seen = set(caption_files)
+        for p in [p for p in self.files if p not in seen]:
+            del self.files[p]
+            changed = True
+        for p in caption_files:
+            try:
+                m = os.path.getmtime(p)
+            except OSError:
+                continue
+            old = self.files.get(p)
+            if old is not None and old[0] == m:
+                continue
+            if os.path.basename(p).lower() in CAPTION_MANIFEST_NAMES:
+                value: object = read_caption_manifest(p)
+            else:
+                value = read_caption_text(p) or ""
+            self.files[p] = (m, value)
+            changed = True
+        if changed:
+            self._rebuild()
+        return changed
+
+    def _rebuild(self) -> None:
+        by_stem: dict[str, str] = {}
+        by_folder: dict[str, dict[str, str]] = {}
+        # json after csv, so a folder's captions.json overrides its captions.csv
+        for p in sorted(self.files, key=lambda q: q.lower().endswith(".json")):
+            value = self.files[p][1]
+            if isinstance(value, dict):
+                by_folder.setdefault(os.path.dirname(p), {}).update(value)
+            elif isinstance(value, str) and value:
+                by_stem[os.path.splitext(p)[0]] = value
+        self.by_stem = by_stem
+        self.by_folder = by_folder
+
+    def caption_for(self, image_path: str) -> Optional[str]:
+        text = self.by_stem.get(os.path.splitext(image_path)[0])
+        if text is not None:
+            return text
+        folder = self.by_folder.get(os.path.dirname(image_path))
+        if folder:
+            return folder.get(os.path.basename(image_path))
+        return None
+
+
 def draw_vertical_gradient_alpha(surface: pygame.Surface, rect: pygame.Rect, alpha_top: int, alpha_bottom: int) -> None:
     """
     Draw a vertical black->black gradient where only alpha changes.
@@ -458,133 +910,1314 @@ def render_text(font: pygame.font.Font, text: str,
     return surf
 
 
+# -------------------------
+# View history (append-only log + compacted aggregates)
+# -------------------------
+HISTORY_LOG_NAME = "view_history.log"
+HISTORY_STATS_NAME = "view_stats.bin"
+HISTORY_MAGIC = b"PFVH"
+HISTORY_VERSION = 1
+HISTORY_HEADER = struct.Struct("<4sHHI")   # magic, version, reserved, generation
+HISTORY_RECORD = struct.Struct("<QdfB3x")  # file key, shown_at epoch, dwell s, flags
+HISTORY_STAT = struct.Struct("<QIIfd")     # file key, shows, skips, dwell sum, last shown
+HISTORY_FLAG_SKIPPED = 1
+
+
+def file_key(path: str, photos_root: str) -> int:
+    """Stable 64-bit id of a photo: hash of its path relative to the library."""
+    rel = library_relpath(path, photos_root).replace(os.sep, "/")
+    digest = hashlib.blake2b(rel.encode("utf-8", "surrogateescape"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class ViewHistory:
+    """
+    What was shown when, as fixed 24-byte records appended to
+    view_history.log (one small sequential write per slide). compact()
+    folds the log into per-file aggregates in view_stats.bin and empties it.
+
+    Both files carry a generation number: a log whose generation differs
+    from the stats file was already folded in (crash mid-compaction) and is
+    ignored on replay.
+
+    Aggregates live in parallel arrays sorted by key (about 28 bytes per
+    file); keys first seen since the last compaction sit in a small dict.
+    """
+    def __init__(self, data_dir: str):
+        self.log_path = os.path.join(data_dir, HISTORY_LOG_NAME)
+        self.stats_path = os.path.join(data_dir, HISTORY_STATS_NAME)
+        self.generation = 0
+        self.keys = array("Q")
+        self.shows = array("I")
+        self.skips = array("I")
+        self.dwell = array("f")
+        self.last = array("d")
+        self.pending: dict[int, list] = {}   # key -> [shows, skips, dwell, last]
+        self.log_records = 0
+        self._fd: Optional[int] = None
+
+    # ---- loading ----
+    def open(self) -> None:
+        self._load_stats()
+        self._replay_log(repair=True)
+        try:
+            self._fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            if os.fstat(self._fd).st_size == 0:
+                os.write(self._fd, HISTORY_HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, 0, self.generation))
+        except OSError:
+            self._fd = None
+
+    def load(self) -> None:
+        """
+        Read-only open for reports: replays the log as it is, never
+        creating, truncating or replacing a file the running frame may be
+        appending to; record() then only updates memory.
+        """
+        self._load_stats()
+        self._replay_log(repair=False)
+
+    def _load_stats(self) -> None:
+        try:
+            with open(self.stats_path, "rb") as f:
+                head = f.read(HISTORY_HEADER.size)
+                body = f.read()
+        except OSError:
+            return
+        if len(head) != HISTORY_HEADER.size:
+            return
+        magic, version, _, generation = HISTORY_HEADER.unpack(head)
+        if magic != HISTORY_MAGIC or version != HISTORY_VERSION:
+            return
+        self.generation = generation
+        n = len(body) // HISTORY_STAT.size
+        for key, shows, skips, dwell, last in HISTORY_STAT.iter_unpack(body[:n * HISTORY_STAT.size]):
+            self.keys.append(key)
+            self.shows.append(shows)
+            self.skips.append(skips)
+            self.dwell.append(dwell)
+            self.last.append(last)
+
+    def _replay_log(self, repair: bool) -> None:
+        """Apply the log; with repair, reset a stale log and cut a torn tail."""
+        try:
+            with open(self.log_path, "rb") as f:
+                head = f.read(HISTORY_HEADER.size)
+                body = f.read()
+        except OSError:
+            return
+        if len(head) != HISTORY_HEADER.size:
+            return
+        magic, version, _, generation = HISTORY_HEADER.unpack(head)
+        if magic != HISTORY_MAGIC or version != HISTORY_VERSION or generation != self.generation:
+            # Already folded into the stats file (or foreign): start over
+            if repair:
+                self._reset_log()
+            return
+        whole = len(body) - len(body) % HISTORY_RECORD.size
+        if whole != len(body) and repair:
+            # Torn final record from a crash: drop it
+            try:
+                os.truncate(self.log_path, HISTORY_HEADER.size + whole)
+            except OSError:
+                pass
+        for key, shown_at, dwell, flags in HISTORY_RECORD.iter_unpack(body[:whole]):
+            self._apply(key, shown_at, dwell, flags)
+            self.log_records += 1
+
+    def _reset_log(self) -> None:
+        tmp = self.log_path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(HISTORY_HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, 0, self.generation))
+            os.replace(tmp, self.log_path)
+        except OSError:
+            pass
+        self.log_records = 0
+
+    # ---- updates ----
+    def _index(self, key: int) -> int:
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return -1
+
+    def _apply(self, key: int, shown_at: float, dwell: float, flags: int) -> None:
+        skipped = 1 if flags & HISTORY_FLAG_SKIPPED else 0
+        i = self._index(key)
+        if i >= 0:
+            self.shows[i] += 1
+            self.skips[i] += skipped
+            self.dwell[i] += dwell
+            if shown_at > self.last[i]:
+                self.last[i] = shown_at
+            return
+        agg = self.pending.get(key)
+        if agg is None:
+            self.pending[key] = [1, skipped, dwell, shown_at]
+        else:
+            agg[0] += 1
+            agg[1] += skipped
+            agg[2] += dwell
+            agg[3] = max(agg[3], shown_at)
+
+    def record(self, key: int, shown_at: float, dwell: float, skipped: bool) -> None:
+        """Log one slide view (written when the slide is left, so dwell is known)."""
+        flags = HISTORY_FLAG_SKIPPED if skipped else 0
+        if self._fd is not None:
+            try:
+                os.write(self._fd, HISTORY_RECORD.pack(key, shown_at, dwell, flags))
+            except OSError:
+                pass
+        self._apply(key, shown_at, dwell, flags)
+        self.log_records += 1
+
+    def compact(self) -> None:
+        """Fold the log into view_stats.bin and start a new, empty log."""
+        if self.pending:
+            merged = sorted(
+                [(self.keys[i], self.shows[i], self.skips[i], self.dwell[i], self.last[i])
+                 for i in range(len(self.keys))]
+                + [(k, v[0], v[1], v[2], v[3]) for k, v in self.pending.items()]
+            )
+            self.keys = array("Q", (r[0] for r in merged))
+            self.shows = array("I", (r[1] for r in merged))
+            self.skips = array("I", (r[2] for r in merged))
+            self.dwell = array("f", (r[3] for r in merged))
+            self.last = array("d", (r[4] for r in merged))
+            self.pending.clear()
+
+        generation = (self.generation + 1) & 0xFFFFFFFF
+        tmp = self.stats_path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(HISTORY_HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, 0, generation))
+                for i in range(len(self.keys)):
+                    f.write(HISTORY_STAT.pack(self.keys[i], self.shows[i], self.skips[i],
+                                              self.dwell[i], self.last[i]))
+            os.replace(tmp, self.stats_path)
+        except OSError:
+            return
+        self.generation = generation
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._reset_log()
+        try:
+            self._fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND)
+        except OSError:
+            self._fd = None
+
+    def close(self) -> None:
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    # ---- queries ----
+    def stats(self, key: int) -> tuple[int, int, float, float]:
+        """(shows, skips, total dwell seconds, last shown epoch); zeros if never shown."""
+        i = self._index(key)
+        if i >= 0:
+            return self.shows[i], self.skips[i], self.dwell[i], self.last[i]
+        agg = self.pending.get(key)
+        if agg is not None:
+            return agg[0], agg[1], agg[2], agg[3]
+        return 0, 0, 0.0, 0.0
+
+    def report(self, kind: str, paths: Sequence[str], photos_root: str, limit: int = 20) -> List[tuple[str, tuple]]:
+        """
+        Rank library paths: "most-skipped", "most-shown", "least-shown",
+        "never-shown" or "longest-dwell". Returns [(path, stats)].
+        """
+        rows = [(p, self.stats(file_key(p, photos_root))) for p in paths]
+        if kind == "never-shown":
+            return [r for r in rows if r[1][0] == 0][:limit]
+        if kind == "most-skipped":
+            rows = [r for r in rows if r[1][1] > 0]
+            rows.sort(key=lambda r: (r[1][1], r[1][1] / r[1][0]), reverse=True)
+        elif kind == "most-shown":
+            rows.sort(key=lambda r: r[1][0], reverse=True)
+        elif kind == "least-shown":
+            rows.sort(key=lambda r: (r[1][0], r[1][3]))
+        elif kind == "longest-dwell":
+            rows = [r for r in rows if r[1][0] > 0]
+            rows.sort(key=lambda r: r[1][2] / r[1][0], reverse=True)
+        else:
+            raise ValueError(f"unknown report: {kind}")
+        return rows[:limit]
+
+
 # -------------------------
 # Slideshow order logic
 # -------------------------
+BAG_DEAD = 0xFFFFFFFF  # tombstone for a played bag entry whose file was deleted
+WEIGHTED_HISTORY_MAX = 1000  # prev() depth in weighted mode
+NEAR_DUP_RETRIES = 8         # redraws before accepting a near-duplicate anyway
+SLOT_COMPACT_MIN = 4096      # renumber OrderManager slots after this many changes ...
+SLOT_COMPACT_RATIO = 8       # ... or 1/8 of the library, whichever is more
+
+
+def remap_ids(ids: array, remap: array, dead_pos: Optional[List[int]] = None) -> array:
+    """
+    Map ids through remap (old id -> new id or BAG_DEAD). Tombstones (at
+    dead_pos if known, else found by a scan) stay dead.
+    """
+    if dead_pos is None:
+        dead_pos = [i for i, f in enumerate(ids) if f == BAG_DEAD]
+    table = remap + array("I", [BAG_DEAD])
+    if dead_pos:
+        ids = array("I", ids)
+        for i in dead_pos:
+            ids[i] = len(remap)
+    return array("I", map(table.__getitem__, ids))
+
+
+class MediaCatalog:
+    """
+    The library in compact form: a table of interned directory paths, and
+    per file only an offset into one packed blob of NUL-terminated basenames
+    plus its mtime (about 30 bytes per file instead of a full path string).
+
+    Files are stored directory-major (directories and names each sorted
+    case-insensitively); a file id is its position in that layout.
+    sorted_ids / rank_of give the sequential (case-insensitive path) order.
+    Paths are only materialized by path(id); len/indexing/iteration work in
+    id order, so a catalog can stand in for a list of paths.
+    """
+    def __init__(self, dirs: Optional[List[str]] = None, dir_first: Optional[array] = None,
+                 names: bytes = b"", name_off: Optional[array] = None,
+                 mtimes: Optional[array] = None, sorted_ids: Optional[array] = None):
+        self.dirs: List[str] = dirs if dirs is not None else []
+        self.dir_first = dir_first if dir_first is not None else array("I", [0])  # dir -> first id
+        self.names = names
+        self.name_off = name_off if name_off is not None else array("I", [0])     # id -> blob offset
+        self.mtimes = mtimes if mtimes is not None else array("d")
+        self._prefix = [d if d.endswith(os.sep) else d + os.sep for d in self.dirs]
+        if sorted_ids is None:
+            lowered = [p.lower() for p in self]
+            sorted_ids = array("I", sorted(range(len(lowered)), key=lowered.__getitem__))
+        self.sorted_ids = sorted_ids
+        rank_of = array("I", bytes(4 * len(sorted_ids)))
+        for rank, fid in enumerate(sorted_ids):
+            rank_of[fid] = rank
+        self.rank_of = rank_of
+        self._dir_index: Optional[dict[str, int]] = None
+        self._labels: dict[str, str] = {}
+
+    @classmethod
+    def from_groups(cls, groups: List[tuple[str, List[tuple[str, float]]]]) -> "MediaCatalog":
+        """Build from (directory, [(basename, mtime), ...]) pairs in any order."""
+        dirs: List[str] = []
+        dir_first = array("I", [0])
+        blob = bytearray()
+        name_off = array("I", [0])
+        mtimes = array("d")
+        lowered: List[str] = []   # sort keys, only while building
+        for d, entries in sorted(groups, key=lambda g: (g[0].lower(), g[0])):
+            if not entries:
+                continue
+            entries.sort(key=lambda e: (e[0].lower(), e[0]))
+            dirs.append(sys.intern(d))
+            prefix = (d if d.endswith(os.sep) else d + os.sep).lower()
+            for name, m in entries:
+                blob += name.encode("utf-8", "surrogateescape") + b"\0"
+                name_off.append(len(blob))
+                mtimes.append(m)
+                lowered.append(prefix + name.lower())
+            dir_first.append(len(mtimes))
+        sorted_ids = array("I", sorted(range(len(lowered)), key=lowered.__getitem__))
+        return cls(dirs, dir_first, bytes(blob), name_off, mtimes, sorted_ids)
+
+    @classmethod
+    def from_paths(cls, paths, mtimes=None) -> "MediaCatalog":
+        groups: dict[str, List[tuple[str, float]]] = {}
+        for i, p in enumerate(paths):
+            head, name = os.path.split(p)
+            groups.setdefault(head, []).append((name, mtimes[i] if mtimes is not None else 0.0))
+        return cls.from_groups(list(groups.items()))
+
+    def __len__(self) -> int:
+        return len(self.mtimes)
+
+    def __getitem__(self, fid: int) -> str:
+        return self.path(fid)
+
+    def __iter__(self):
+        return map(self.path, range(len(self.mtimes)))
+
+    def name(self, fid: int) -> str:
+        off = self.name_off
+        return self.names[off[fid]:off[fid + 1] - 1].decode("utf-8", "surrogateescape")
+
+    def dir_id(self, fid: int) -> int:
+        return bisect.bisect_right(self.dir_first, fid) - 1
+
+    def path(self, fid: int) -> str:
+        return self._prefix[self.dir_id(fid)] + self.name(fid)
+
+    def at_rank(self, rank: int) -> str:
+        return self.path(self.sorted_ids[rank])
+
+    def dir_index(self) -> dict[str, int]:
+        if self._dir_index is None:
+            self._dir_index = {d: i for i, d in enumerate(self.dirs)}
+        return self._dir_index
+
+    def id_of(self, path: str) -> Optional[int]:
+        """File id of path, or None (O(log n), no string table)."""
+        head, name = os.path.split(path)
+        d = self.dir_index().get(head)
+        if d is None:
+            return None
+        a, b = self.dir_first[d], self.dir_first[d + 1]
+        i = a + bisect.bisect_left(range(a, b), (name.lower(), name),
+                                   key=lambda j: (self.name(j).lower(), self.name(j)))
+        return i if i < b and self.name(i) == name else None
+
+    def rank_for(self, path: str) -> int:
+        """Where path would sort in sequential order (it need not exist)."""
+        ids = self.sorted_ids
+        return bisect.bisect_left(range(len(ids)), path.lower(), key=lambda r: self.path(ids[r]).lower())
+
+    def signature(self) -> Tuple[int, int]:
+        """A cheap change signature: (count, sum of mtimes seconds)."""
+        return (len(self.mtimes), sum(map(int, self.mtimes)))
+
+    def generation(self) -> int:
+        """64-bit fingerprint of the file set (keys the persisted cycle)."""
+        h = hashlib.blake2b(digest_size=8)
+        h.update("\0".join(self.dirs).encode("utf-8", "surrogateescape"))
+        h.update(_le_bytes(self.dir_first))
+        h.update(self.names)
+        return int.from_bytes(h.digest(), "little")
+
+    def folder_label(self, path: str, photos_root: str) -> str:
+        """Folder caption for path, computed once per directory."""
+        parent = os.path.dirname(path)
+        label = self._labels.get(parent)
+        if label is None:
+            label = self._labels[parent] = sys.intern(folder_caption(path, photos_root))
+        return label
+
+    def subset(self, keep) -> "MediaCatalog":
+        """Catalog of the ids with keep[id] set (same relative order)."""
+        new_id = array("I", bytes(4 * len(self)))
+        dirs: List[str] = []
+        dir_first = array("I", [0])
+        blob = bytearray()
+        name_off = array("I", [0])
+        mtimes = array("d")
+        off = self.name_off
+        for d, dpath in enumerate(self.dirs):
+            for i in range(self.dir_first[d], self.dir_first[d + 1]):
+                if keep[i]:
+                    new_id[i] = len(mtimes)
+                    blob += self.names[off[i]:off[i + 1]]
+                    name_off.append(len(blob))
+                    mtimes.append(self.mtimes[i])
+            if len(mtimes) > dir_first[-1]:
+                dirs.append(dpath)
+                dir_first.append(len(mtimes))
+        sorted_ids = array("I", (new_id[i] for i in self.sorted_ids if keep[i]))
+        return MediaCatalog(dirs, dir_first, bytes(blob), name_off, mtimes, sorted_ids)
+
+    def diff(self, old: "MediaCatalog") -> Optional[tuple[List[int], List[int]]]:
+        """
+        How old's ids map onto this catalog: (removed old ids, added new
+        ids), both sorted; None if the file sets are identical. Surviving
+        files keep their relative order. Unchanged directories are matched
+        by one bytes compare.
+        """
+        if self.dirs == old.dirs and self.dir_first == old.dir_first and self.names == old.names:
+            return None
+        removed: List[int] = []
+        added: List[int] = []
+        index = self.dir_index()
+        matched = bytearray(len(self.dirs))
+        for od, dpath in enumerate(old.dirs):
+            oa, ob = old.dir_first[od], old.dir_first[od + 1]
+            nd = index.get(dpath)
+            if nd is None:
+                removed.extend(range(oa, ob))
+                continue
+            matched[nd] = 1
+            na, nb = self.dir_first[nd], self.dir_first[nd + 1]
+            if old.names[old.name_off[oa]:old.name_off[ob]] == self.names[self.name_off[na]:self.name_off[nb]]:
+                continue
+            new_ids = {self.name(j): j for j in range(na, nb)}
+            for i in range(oa, ob):
+                if new_ids.pop(old.name(i), None) is None:
+                    removed.append(i)
+            added.extend(new_ids.values())
+        for nd in range(len(self.dirs)):
+            if not matched[nd]:
+                added.extend(range(self.dir_first[nd], self.dir_first[nd + 1]))
+        added.sort()
+        return removed, added
+
+
+class FenwickTree:
+    """
+    Prefix sums over float weights (1-based binary indexed tree).
+    set/prefix/find are O(log n); append is O(log n).
+    """
+    def __init__(self, weights=()):
+        self.weights = array("d", weights)
+        n = len(self.weights)
+        tree = array("d", [0.0])
+        tree.extend(self.weights)
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.tree = tree
+        self.n = n
+
+    def prefix(self, i: int) -> float:
+        """Sum of weights[0:i]."""
+        tree = self.tree
+        s = 0.0
+        while i > 0:
+            s += tree[i]
+            i -= i & -i
+        return s
+
+    def total(self) -> float:
+        return self.prefix(self.n)
+
+    def set(self, i: int, w: float) -> None:
+        delta = w - self.weights[i]
+        if delta == 0.0:
+            return
+        self.weights[i] = w
+        tree, n = self.tree, self.n
+        i += 1
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def append(self, w: float) -> None:
+        self.n += 1
+        i = self.n
+        self.weights.append(w)
+        self.tree.append(w + self.prefix(i - 1) - self.prefix(i - (i & -i)))
+
+    def find(self, u: float) -> int:
+        """Smallest index whose inclusive prefix sum exceeds u."""
+        tree, n = self.tree, self.n
+        pos = 0
+        step = 1 << (n.bit_length() - 1) if n else 0
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= u:
+                pos = nxt
+                u -= tree[nxt]
+            step >>= 1
+        return min(pos, n - 1)
+
+
+class SlotMap:
+    """
+    Stable slot numbers for the file ids of a changing catalog.
+
+    Catalog ids are positions, so one new file shifts every id after it,
+    but surviving files keep their relative order. Slots 0..base-1 are the
+    catalog ids as of the last reset(); later changes are kept as a sorted
+    list of dead base slots plus "extra" slots for files added since, each
+    anchored before a base slot. Translation either way is a few bisects
+    and merge() costs O(changed files), so arrays indexed by slot survive
+    a rescan untouched. Slots are never reused; reset() (or compaction via
+    table()) renumbers them to the catalog ids.
+    """
+    def __init__(self, n: int = 0):
+        self.reset(n)
+
+    def reset(self, n: int) -> None:
+        self.base = n
+        self.size = n                                 # slots handed out
+        self.dead: List[int] = []                     # sorted dead base slots
+        self.extra_keys: List[tuple[int, float]] = []  # sorted (anchor, order)
+        self.extra_slots: List[int] = []              # parallel to extra_keys
+        self._key_of: dict[int, tuple[int, float]] = {}
+
+    def copy(self) -> "SlotMap":
+        other = SlotMap.__new__(SlotMap)
+        other.base, other.size = self.base, self.size
+        other.dead = self.dead[:]
+        other.extra_keys = self.extra_keys[:]
+        other.extra_slots = self.extra_slots[:]
+        other._key_of = dict(self._key_of)
+        return other
+
+    def changes(self) -> int:
+        """Dead and added slots since the last reset."""
+        return len(self.dead) + self.size - self.base
+
+    def _extra_id(self, j: int) -> int:
+        anchor = self.extra_keys[j][0]
+        return anchor - bisect.bisect_left(self.dead, anchor) + j
+
+    def id_of(self, slot: int) -> Optional[int]:
+        """Catalog id of slot, or None if its file was removed."""
+        key = self._key_of.get(slot)
+        if key is not None:
+            return self._extra_id(bisect.bisect_left(self.extra_keys, key))
+        if slot >= self.base:
+            return None
+        d = bisect.bisect_left(self.dead, slot)
+        if d < len(self.dead) and self.dead[d] == slot:
+            return None
+        return slot - d + bisect.bisect_left(self.extra_keys, (slot + 1,))
+
+    def _locate(self, fid: int) -> tuple[int, int]:
+        """(extras before id fid, base slot of fid if it is not an extra)."""
+        j = bisect.bisect_left(range(len(self.extra_keys)), fid, key=self._extra_id)
+        rank = fid - j
+        dead = self.dead
+        return j, rank + bisect.bisect_right(range(len(dead)), rank, key=lambda i: dead[i] - i)
+
+    def slot_of(self, fid: int) -> int:
+        j, slot = self._locate(fid)
+        if j < len(self.extra_keys) and self._extra_id(j) == fid:
+            return self.extra_slots[j]
+        return slot
+
+    def merge(self, removed: List[int], added: List[int]) -> tuple[List[int], List[int]]:
+        """
+        Apply a catalog diff (sorted removed old ids, sorted added new ids).
+        Returns (slots of the removed files, new slots of the added files).
+        """
+        gone = [self.slot_of(f) for f in removed]
+        keys, slots = self.extra_keys, self.extra_slots
+        for s in gone:
+            key = self._key_of.pop(s, None)
+            if key is not None:
+                j = bisect.bisect_left(keys, key)
+                del keys[j], slots[j]
+            else:
+                bisect.insort(self.dead, s)
+        new: List[int] = []
+        for fid in added:   # ascending: everything before fid is in place
+            j, base_slot = self._locate(fid)
+            if j < len(keys) and self._extra_id(j) == fid:
+                anchor = keys[j][0]         # goes right before extra j
+            else:
+                anchor = min(base_slot, self.base)
+            order = self._order_between(j, anchor)
+            if order is None:
+                self._respace(anchor)
+                order = self._order_between(j, anchor)
+            slot = self.size
+            self.size += 1
+            keys.insert(j, (anchor, order))
+            slots.insert(j, slot)
+            self._key_of[slot] = (anchor, order)
+            new.append(slot)
+        return gone, new
+
+    def _order_between(self, j: int, anchor: int) -> Optional[float]:
+        """Order key for a new extra at list position j, None if the gap is used up."""
+        keys = self.extra_keys
+        lo = keys[j - 1][1] if j and keys[j - 1][0] == anchor else 0.0
+        hi = keys[j][1] if j < len(keys) and keys[j][0] == anchor else lo + 2.0
+        order = (lo + hi) / 2
+        return order if lo < order < hi else None
+
+    def _respace(self, anchor: int) -> None:
+        """Renumber the order keys of the extras anchored at anchor."""
+        keys = self.extra_keys
+        a = bisect.bisect_left(keys, (anchor,))
+        b = bisect.bisect_left(keys, (anchor + 1,))
+        for j in range(a, b):
+            keys[j] = (anchor, float(j - a + 1))
+            self._key_of[self.extra_slots[j]] = keys[j]
+
+    def table(self) -> array:
+        """slot -> catalog id (BAG_DEAD for removed files), for compaction."""
+        t = array("I", [BAG_DEAD]) * self.size
+        keys, slots, dead = self.extra_keys, self.extra_slots, self.dead
+        fid = s = d = j = 0
+        while s < self.base or j < len(keys):
+            if j < len(keys) and keys[j][0] <= s:
+                t[slots[j]] = fid
+                fid += 1
+                j += 1
+            elif d < len(dead) and dead[d] == s:
+                s += 1
+                d += 1
+            else:
+                end = min(self.base, dead[d] if d < len(dead) else self.base,
+                          keys[j][0] if j < len(keys) else self.base)
+                t[s:end] = array("I", range(fid, fid + end - s))
+                fid += end - s
+                s = end
+        return t
+
+
+class WeightedSampler:
+    """
+    Pluggable sampler for OrderManager's weighted ("Smart") mode.
+
+    Each file id has a base weight from weight_fn(path, mtime). A picked
+    file sits out a cooldown window (weight 0) until cooldown_ratio of the
+    library has been shown since, which gives least-recently-shown
+    behaviour; its weight is then recomputed, so view counts and favorite
+    changes take effect. Pick and update are O(log n). Entries are
+    indexed by OrderManager's slots (see SlotMap).
+    """
+    def __init__(self, weight_fn, cooldown_ratio: float = 0.5):
+        self.weight_fn = weight_fn
+        self.cooldown_ratio = cooldown_ratio
+        self.catalog: Optional[MediaCatalog] = None
+        self.slots: Optional[SlotMap] = None
+        self.tree = FenwickTree()
+        self.cooling: deque[int] = deque()
+        self.is_cooling = bytearray()
+        self.live = 0
+
+    def rebuild(self, catalog: "MediaCatalog", slots: Optional[SlotMap] = None) -> None:
+        """Weights for every file; slots must be fresh (slot == file id)."""
+        weights = array("d", map(self.weight_fn, catalog, catalog.mtimes))
+        self.catalog = catalog
+        self.slots = slots
+        self.tree = FenwickTree(weights)
+        self.cooling.clear()
+        self.is_cooling = bytearray(len(catalog))
+        self.live = len(catalog)
+
+    def remap(self, catalog: "MediaCatalog", remap: array, added: List[int]) -> None:
+        """Carry weights and cooldowns over to renumbered slots (O(n))."""
+        n = len(catalog)
+        old_w, old_cooling = self.tree.weights, self.is_cooling
+        weights = array("d", bytes(8 * n))
+        is_cooling = bytearray(n)
+        for old, new in enumerate(remap):
+            if new != BAG_DEAD:
+                weights[new] = old_w[old]
+                is_cooling[new] = old_cooling[old]
+        for fid in added:
+            weights[fid] = self.weight_fn(catalog.path(fid), catalog.mtimes[fid])
+        self.cooling = deque(remap[f] for f in self.cooling if remap[f] != BAG_DEAD)
+        self.catalog = catalog
+        self.tree = FenwickTree(weights)
+        self.is_cooling = is_cooling
+        self.live = n
+
+    def merge(self, catalog: "MediaCatalog", gone: List[int], new: List[int]) -> None:
+        """Rescan: removed slots drop to weight 0, new ones are appended (O(changes log n))."""
+        self.catalog = catalog
+        for slot in gone:
+            self.tree.set(slot, 0.0)
+        for slot in new:
+            assert slot == self.tree.n
+            self.tree.append(0.0)
+            self.is_cooling.append(0)
+            self.refresh(slot)
+        self.live += len(new) - len(gone)
+
+    def refresh(self, slot: int) -> None:
+        """Recompute a file's weight (e.g. after it was favorited)."""
+        cat = self.catalog
+        if cat is None or slot >= self.tree.n or self.is_cooling[slot]:
+            return
+        fid = self.slots.id_of(slot) if self.slots is not None else slot
+        if fid is not None:
+            self.tree.set(slot, self.weight_fn(cat.path(fid), cat.mtimes[fid]))
+
+    def reset_cooldown(self) -> None:
+        while self.cooling:
+            self._release(self.cooling.popleft())
+
+    def _release(self, fid: int) -> None:
+        if fid < len(self.is_cooling) and self.is_cooling[fid]:
+            self.is_cooling[fid] = 0
+            self.refresh(fid)
+
+    def pick(self, mark: bool = True) -> Optional[int]:
+        total = self.tree.total()
+        if total <= 0.0:
+            self.reset_cooldown()
+            total = self.tree.total()
+            if total <= 0.0:
+                return None
+        fid = self.tree.find(random.random() * total)
+        if self.tree.weights[fid] <= 0.0:
+            return None   # rounding ran off the end onto a cooling/removed slot
+        if mark:
+            self.mark_shown(fid)
+        return fid
+
+    def mark_shown(self, fid: int) -> None:
+        """Put fid into the cooldown window (also used for a chosen start)."""
+        if fid >= self.tree.n or self.is_cooling[fid]:
+            return
+        self.tree.set(fid, 0.0)
+        self.is_cooling[fid] = 1
+        self.cooling.append(fid)
+        limit = int(self.live * self.cooldown_ratio)
+        while len(self.cooling) > limit:
+            self._release(self.cooling.popleft())
+
+
 class OrderManager:
     """
     Supports:
     - sequential order by sorted file list, with an index
     - shuffle order with no repeats until all seen
+    - weighted ("Smart") shuffle through a pluggable sampler (see
+      WeightedSampler), with a bounded history for prev()
+    - optional near-duplicate spacing in both shuffle modes
+
+    Works on the integer file ids of a MediaCatalog; a path is only
+    materialized for the photo being shown. The shuffle bag is a packed
+    array('I') of slots (stable file numbers, see SlotMap), shuffled
+    lazily (one Fisher-Yates swap per step): positions < _drawn are the
+    cycle so far, the rest is the unplayed pool in arbitrary order.
+    set_files() merges a rescanned catalog into the running cycle in
+    O(changed files); the slots are renumbered only when a cycle starts or
+    after many changes (SLOT_COMPACT_MIN / SLOT_COMPACT_RATIO).
     """
-    def __init__(self, files: List[str], shuffle: bool, start_path: Optional[str] = None):
-        self.files = files[:]  # canonical sorted list
+    def __init__(self, catalog: MediaCatalog, shuffle: bool, start_path: Optional[str] = None,
+                 sampler: Optional[WeightedSampler] = None, weighted: bool = False):
+        self.catalog = catalog
         self.shuffle = shuffle
+        # Bumped whenever the bag is rebuilt/merged (persistence needs a full write)
+        self.bag_version = 0
 
-        self.seq_index = 0
-        if start_path and start_path in self.files:
-            self.seq_index = self.files.index(start_path)
+        self.seq_index = self._seq_position(start_path)  # rank in sorted order
 
-        self.shuffle_bag: List[int] = []
+        self.slots = SlotMap(len(catalog))
+        self.shuffle_bag = array("I")
+        self._bag_pos = array("I")      # slot -> position in bag
+        self._dead_pos: List[int] = []  # sorted tombstone positions
         self.shuffle_pos = 0
+        self._drawn = 0
+
+        # Weighted mode: sampler picks, history remembers (for prev)
+        self.sampler = sampler
+        self.weighted = False
+        self._history = array("I")
+        self._hist_pos = -1
+
+        # Optional near_duplicate(path, recent_paths) -> bool hook: similar
+        # photos are kept at least near_dup_window slides apart (best effort)
+        self.near_duplicate: Optional[Callable[[str, List[str]], bool]] = None
+        self.near_dup_window = 8
+
+        # If shuffle, build initial bag starting at start path if possible.
+        if self.shuffle and weighted and sampler is not None:
+            self._start_weighted(start_path)
+        elif self.shuffle:
+            self._refill_bag(start_path)
+
+    def lookup(self, path: Optional[str]) -> Optional[int]:
+        """File id of path, or None (O(log n))."""
+        if not path:
+            return None
+        return self.catalog.id_of(path)
 
-        # If shuffle, build initial bag and align to start path if possible.
-        if self.shuffle:
-            self._refill_bag()
-            if start_path and start_path in self.files:
-                start_idx = self.files.index(start_path)
-                # Rotate bag so that start_idx is first (if present)
-                if start_idx in self.shuffle_bag:
-                    k = self.shuffle_bag.index(start_idx)
-                    self.shuffle_bag = self.shuffle_bag[k:] + self.shuffle_bag[:k]
-                    self.shuffle_pos = 0
-
-    def _refill_bag(self) -> None:
-        self.shuffle_bag = list(range(len(self.files)))
-        random.shuffle(self.shuffle_bag)
-        self.shuffle_pos = 0
+    def _slot_of(self, path: Optional[str]) -> Optional[int]:
+        fid = self.lookup(path)
+        return self.slots.slot_of(fid) if fid is not None else None
 
-    def set_files(self, new_files: List[str], current_path: Optional[str]) -> None:
-        """Update file list and attempt to keep current position."""
-        self.files = new_files[:]
-        # Reset indexes sensibly
-        self.seq_index = 0
-        if current_path and current_path in self.files:
-            self.seq_index = self.files.index(current_path)
+    def _path(self, slot: int) -> str:
+        return self.catalog.path(self.slots.id_of(slot))
 
-        if self.shuffle:
-            # Rebuild shuffle bag from scratch; try to start at current file
+    def _seq_position(self, path: Optional[str]) -> int:
+        """
+        Rank of path in sequential order. Unknown paths map to where they
+        would sort, so sequential play continues from there.
+        """
+        cat = self.catalog
+        if not path or not cat:
+            return 0
+        fid = cat.id_of(path)
+        if fid is not None:
+            return cat.rank_of[fid]
+        return cat.rank_for(path) % len(cat)
+
+    # ---- shuffle bag primitives ----
+    def _swap(self, i: int, j: int) -> None:
+        bag, inv = self.shuffle_bag, self._bag_pos
+        a, b = bag[i], bag[j]
+        bag[i], bag[j] = b, a
+        inv[a], inv[b] = j, i
+
+    def _move_back(self, src: int, dst: int) -> None:
+        """Move bag entry src to dst < src; entries dst..src-1 shift up by one."""
+        bag, inv, dead = self.shuffle_bag, self._bag_pos, self._dead_pos
+        slot = bag[src]
+        bag[dst + 1:src + 1] = bag[dst:src]
+        bag[dst] = slot
+        for i in range(dst, src + 1):
+            if bag[i] != BAG_DEAD:
+                inv[bag[i]] = i
+        for k in range(bisect.bisect_left(dead, dst), bisect.bisect_left(dead, src)):
+            dead[k] += 1
+
+    def _recent(self, slots) -> List[str]:
+        """Paths of the last near_dup_window live slots in a bag/history slice."""
+        return [self._path(s) for s in slots[-self.near_dup_window:] if s != BAG_DEAD]
+
+    def _draw(self, spaced: bool = True) -> None:
+        """
+        Move a random unplayed slot to the end of the drawn region. With a
+        near_duplicate hook, candidates too similar to the last few slides
+        are redrawn (a few tries); they stay in the pool for later.
+        """
+        bag = self.shuffle_bag
+        pos = self._drawn
+        left = len(bag) - pos
+        j = pos + int(random.random() * left)
+        near = self.near_duplicate
+        if spaced and near is not None and left > 1 and pos:
+            recent = self._recent(bag[max(0, pos - self.near_dup_window):pos])
+            for _ in range(NEAR_DUP_RETRIES):
+                if not near(self._path(bag[j]), recent):
+                    break
+                j = pos + int(random.random() * left)
+        if j != pos:
+            self._swap(pos, j)
+        self._drawn = pos + 1
+
+    def _refill_bag(self, start_path: Optional[str] = None) -> None:
+        """
+        Start a fresh cycle. If start_path is known it is swapped to the
+        front (no rotation/copy); otherwise the first slide is drawn.
+        """
+        self.bag_version += 1
+        n = len(self.catalog)
+        self.slots.reset(n)
+        self.shuffle_bag = array("I", range(n))
+        self._bag_pos = array("I", range(n))
+        self._dead_pos = []
+        self.shuffle_pos = 0
+        self._drawn = 0
+        if not n:
+            return
+        start = self._slot_of(start_path)
+        if start is not None:
+            # Identity array: start lives at position start
+            self._swap(0, start)
+            self._drawn = 1
+        else:
+            self._draw()
+
+    def _advance(self) -> None:
+        """Step to the next live bag entry, drawing or refilling as needed."""
+        bag = self.shuffle_bag
+        pos = self.shuffle_pos + 1
+        while pos < self._drawn and bag[pos] == BAG_DEAD:
+            pos += 1
+        if pos < self._drawn:
+            self.shuffle_pos = pos
+        elif self._drawn < len(bag):
+            self._draw()
+            self.shuffle_pos = self._drawn - 1
+        else:
             self._refill_bag()
-            if current_path and current_path in self.files:
-                start_idx = self.files.index(current_path)
-                if start_idx in self.shuffle_bag:
-                    k = self.shuffle_bag.index(start_idx)
-                    self.shuffle_bag = self.shuffle_bag[k:] + self.shuffle_bag[:k]
-                    self.shuffle_pos = 0
+
+    # ---- weighted mode ----
+    def _start_weighted(self, start_path: Optional[str]) -> None:
+        assert self.sampler is not None
+        self.shuffle = True
+        self.weighted = True
+        self.shuffle_bag = array("I")
+        self._drawn = 0
+        self.bag_version += 1
+        self.slots.reset(len(self.catalog))
+        self.sampler.rebuild(self.catalog, self.slots)
+        self._history = array("I")
+        self._hist_pos = -1
+        start = self._slot_of(start_path)
+        if start is not None:
+            self.sampler.mark_shown(start)
+            self._history.append(start)
+            self._hist_pos = 0
+        elif self.catalog:
+            self._advance_weighted()
+
+    def _advance_weighted(self) -> None:
+        hist = self._history
+        pos = self._hist_pos + 1
+        while pos < len(hist) and hist[pos] == BAG_DEAD:
+            pos += 1
+        if pos < len(hist):
+            self._hist_pos = pos
+            return
+        if self._pick_weighted():
+            self._hist_pos = len(hist) - 1
+
+    def _pick_weighted(self) -> bool:
+        """Append a sampled slot to the history (trimming it if too long)."""
+        assert self.sampler is not None
+        hist = self._history
+        slot = self.sampler.pick(mark=False)
+        if slot is None:
+            return False
+        near = self.near_duplicate
+        if near is not None and len(hist):
+            recent = self._recent(hist)
+            for _ in range(NEAR_DUP_RETRIES):
+                if not near(self._path(slot), recent):
+                    break
+                alt = self.sampler.pick(mark=False)
+                if alt is None:
+                    break
+                slot = alt
+        self.sampler.mark_shown(slot)
+        hist.append(slot)
+        if len(hist) > WEIGHTED_HISTORY_MAX:
+            drop = len(hist) - WEIGHTED_HISTORY_MAX // 2
+            del hist[:drop]
+            self._hist_pos = max(-1, self._hist_pos - drop)
+        return True
+
+    def refresh_weight(self, path: str) -> None:
+        """Recompute path's Smart shuffle weight (e.g. after it was favorited)."""
+        slot = self._slot_of(path)
+        if slot is not None and self.weighted and self.sampler is not None:
+            self.sampler.refresh(slot)
+
+    # ---- incremental library merge ----
+    def _merge_bag(self, gone: List[int], new: List[int]) -> None:
+        """
+        Played entries keep their positions (removed ones become
+        tombstones); removed pool entries are swap-removed and new slots
+        join the pool. Touches only the changed slots.
+        """
+        bag, inv = self.shuffle_bag, self._bag_pos
+        drawn = self._drawn
+        for slot in gone:
+            p = inv[slot]
+            if p < drawn:
+                bag[p] = BAG_DEAD
+                bisect.insort(self._dead_pos, p)
+            else:
+                last = bag.pop()
+                if p < len(bag):
+                    bag[p] = last
+                    inv[last] = p
+        if new:
+            inv.extend(array("I", bytes(4 * (self.slots.size - len(inv)))))
+            for slot in new:
+                inv[slot] = len(bag)
+                bag.append(slot)
+
+    def _compact(self) -> None:
+        """Renumber slots to catalog ids (O(n); after many merges)."""
+        table = self.slots.table()
+        n = len(self.catalog)
+        self.slots.reset(n)
+        if self.weighted:
+            assert self.sampler is not None
+            self._history = remap_ids(self._history, table)
+            self.sampler.remap(self.catalog, table, [])
+        elif self.shuffle:
+            bag = remap_ids(self.shuffle_bag, table, self._dead_pos)
+            inv = array("I", bytes(4 * n))
+            for i, f in enumerate(bag):
+                if f != BAG_DEAD:
+                    inv[f] = i
+            self.shuffle_bag = bag
+            self._bag_pos = inv
+
+    def set_files(self, catalog: MediaCatalog, current_path: Optional[str]) -> None:
+        """
+        Switch to a rescanned catalog and keep position. Deleted files leave
+        the cycle, new files join its unplayed part; unchanged directories
+        are matched in bulk (see MediaCatalog.diff).
+        """
+        delta = catalog.diff(self.catalog)
+        self.catalog = catalog
+        if delta is not None and self.shuffle:
+            gone, new = self.slots.merge(*delta)
+            self.bag_version += 1
+            if self.weighted:
+                assert self.sampler is not None
+                if gone:
+                    dead = set(gone)
+                    hist = self._history
+                    for i, slot in enumerate(hist):
+                        if slot in dead:
+                            hist[i] = BAG_DEAD
+                self.sampler.merge(catalog, gone, new)
+            else:
+                self._merge_bag(gone, new)
+            if self.slots.changes() > max(SLOT_COMPACT_MIN, len(catalog) // SLOT_COMPACT_RATIO):
+                self._compact()
+        elif delta is not None:
+            self.slots.reset(len(catalog))
+
+        self.seq_index = self._seq_position(current_path)
+
+        if self.weighted and catalog:
+            if self._hist_pos < 0 or self._history[self._hist_pos] == BAG_DEAD:
+                self._advance_weighted()
+        elif self.shuffle and catalog:
+            if self._drawn == 0:
+                self._draw()
+                self.shuffle_pos = 0
+            elif self.shuffle_bag[self.shuffle_pos] == BAG_DEAD:
+                # Current file was deleted: move on to the next unseen one
+                self._advance()
 
     def toggle_shuffle(self, current_path: Optional[str]) -> None:
-        self.shuffle = not self.shuffle
-        if self.shuffle:
-            self._refill_bag()
-            if current_path and current_path in self.files:
-                start_idx = self.files.index(current_path)
-                if start_idx in self.shuffle_bag:
-                    k = self.shuffle_bag.index(start_idx)
-                    self.shuffle_bag = self.shuffle_bag[k:] + self.shuffle_bag[:k]
-                    self.shuffle_pos = 0
+        """Cycle Off -> On -> Smart (if a sampler is set) -> Off."""
+        if not self.shuffle:
+            self.shuffle = True
+            self._refill_bag(current_path)
+        elif not self.weighted and self.sampler is not None:
+            self._start_weighted(current_path)
         else:
             # If leaving shuffle, set seq index to current file if possible
-            if current_path and current_path in self.files:
-                self.seq_index = self.files.index(current_path)
+            self.shuffle = False
+            self.weighted = False
+            self.shuffle_bag = array("I")
+            self._bag_pos = array("I")
+            self._dead_pos = []
+            self._drawn = 0
+            self._history = array("I")
+            self._hist_pos = -1
+            self.bag_version += 1
+            if self.lookup(current_path) is not None:
+                self.seq_index = self._seq_position(current_path)
+
+    def mode_label(self) -> str:
+        if self.weighted:
+            return "Smart"
+        return "On" if self.shuffle else "Off"
 
     def reset_cycle(self, start_path: Optional[str] = None) -> None:
         """Start a fresh cycle (reshuffle bag or reset sequential index)."""
-        if not self.files:
+        if not self.catalog:
             return
 
-        if self.shuffle:
-            self._refill_bag()
-            if start_path and start_path in self.files:
-                start_idx = self.files.index(start_path)
-                if start_idx in self.shuffle_bag:
-                    k = self.shuffle_bag.index(start_idx)
-                    self.shuffle_bag = self.shuffle_bag[k:] + self.shuffle_bag[:k]
-                    self.shuffle_pos = 0
+        if self.weighted:
+            assert self.sampler is not None
+            self.sampler.reset_cooldown()
+            self._start_weighted(start_path)
+        elif self.shuffle:
+            self._refill_bag(start_path)
         else:
-            self.seq_index = 0
-            if start_path and start_path in self.files:
-                self.seq_index = self.files.index(start_path)
+            self.seq_index = self._seq_position(start_path) if self.lookup(start_path) is not None else 0
 
 
-    def current(self) -> Optional[str]:
-        if not self.files:
+    # ---- persistence (played part of the cycle, as sorted-order ranks) ----
+    def drawn_count(self) -> int:
+        return self._drawn
+
+    def cycle_ranks(self, start: int, end: int) -> array:
+        """Ranks (sequential positions) of live bag entries start..end-1."""
+        rank_of = self.catalog.rank_of
+        live = filter(BAG_DEAD.__ne__, self.shuffle_bag[start:end])
+        if self.slots.changes():
+            live = map(self.slots.id_of, live)
+        return array("I", map(rank_of.__getitem__, live))
+
+    def cycle_position(self) -> int:
+        """Position in the played part of the cycle, not counting tombstones."""
+        return self.shuffle_pos - bisect.bisect_right(self._dead_pos, self.shuffle_pos)
+
+    def export_cycle(self) -> tuple[Callable[[], array], int, int]:
+        """
+        Played part of the shuffle cycle: (ranks, count, position). ranks()
+        computes the ranks from a snapshot, so the O(n) part can run on the
+        state writer thread.
+        """
+        bag = self.shuffle_bag[:self._drawn]
+        slots = self.slots.copy() if self.slots.changes() else None
+        rank_of = self.catalog.rank_of
+
+        def ranks() -> array:
+            live = filter(BAG_DEAD.__ne__, bag)
+            if slots is not None:
+                live = map(slots.table().__getitem__, live)
+            return array("I", map(rank_of.__getitem__, live))
+
+        return ranks, self._drawn - len(self._dead_pos), self.cycle_position()
+
+    def restore_cycle(self, ranks: array, pos: int) -> bool:
+        """
+        Resume a cycle saved by export_cycle() against the same catalog.
+        The unplayed pool is every rank not in `ranks`.
+        """
+        cat = self.catalog
+        n = len(cat)
+        if not self.shuffle or self.weighted or not (0 <= pos < len(ranks) <= n):
+            return False
+        seen = bytearray(n)
+        for r in ranks:
+            if r >= n or seen[r]:
+                return False
+            seen[r] = 1
+        ids = cat.sorted_ids
+        bag = array("I", map(ids.__getitem__, ranks))
+        bag.extend(map(ids.__getitem__, itertools.compress(range(n), map(operator.not_, seen))))
+        inv = array("I", bytes(4 * n))
+        for i, fid in enumerate(bag):
+            inv[fid] = i
+        self.slots.reset(n)
+        self.shuffle_bag = bag
+        self._bag_pos = inv
+        self._dead_pos = []
+        self._drawn = len(ranks)
+        self.shuffle_pos = pos
+        self.bag_version += 1
+        return True
+
+    def upcoming(self, k: int) -> List[str]:
+        """
+        Paths of the next k slides, without moving. Shuffle modes draw ahead
+        (into forward history), so next() later agrees with this list.
+        """
+        cat = self.catalog
+        if not cat or k <= 0:
+            return []
+        out: List[int] = []
+        if self.weighted:
+            pos = self._hist_pos
+            while len(out) < k:
+                pos += 1
+                while pos < len(self._history) and self._history[pos] == BAG_DEAD:
+                    pos += 1
+                if pos >= len(self._history):
+                    if not self._pick_weighted():
+                        break
+                    pos = len(self._history) - 1
+                out.append(self._history[pos])
+        elif self.shuffle:
+            bag = self.shuffle_bag
+            pos = self.shuffle_pos
+            while len(out) < k:
+                pos += 1
+                while pos < self._drawn and bag[pos] == BAG_DEAD:
+                    pos += 1
+                if pos >= self._drawn:
+                    if self._drawn >= len(bag):
+                        break   # cycle ends here; the next one is not drawn yet
+                    self._draw()
+                    pos = self._drawn - 1
+                out.append(bag[pos])
+        else:
+            n = len(cat)
+            return [cat.at_rank((self.seq_index + i) % n) for i in range(1, min(k, n - 1) + 1)]
+        return [self._path(s) for s in out]
+
+    def jump_to(self, path: str) -> bool:
+        """
+        Make path the current slide (picked in the grid). Shuffle modes
+        count it as played: it becomes the next bag entry (ahead of slides
+        upcoming() drew), or appended to the weighted history. A slide
+        already played this cycle trades places with the current one, so
+        nothing after it plays again.
+        """
+        fid = self.lookup(path)
+        if fid is None:
+            return False
+        if self.weighted:
+            assert self.sampler is not None
+            slot = self.slots.slot_of(fid)
+            self.sampler.mark_shown(slot)
+            hist = self._history
+            hist.append(slot)
+            if len(hist) > WEIGHTED_HISTORY_MAX:
+                del hist[:len(hist) - WEIGHTED_HISTORY_MAX // 2]
+            self._hist_pos = len(hist) - 1
+        elif self.shuffle:
+            pos = self._bag_pos[self.slots.slot_of(fid)]
+            cur = self.shuffle_pos
+            if pos <= cur:
+                if pos != cur:
+                    self._swap(pos, cur)
+                    self.bag_version += 1
+                return True
+            if pos >= self._drawn:
+                if pos != self._drawn:
+                    self._swap(self._drawn, pos)
+                pos = self._drawn
+                self._drawn += 1
+            if pos != cur + 1:
+                self._move_back(pos, cur + 1)
+                self.bag_version += 1
+            self.shuffle_pos = cur + 1
+        else:
+            self.seq_index = self.catalog.rank_of[fid]
+        return True
+
+    def current_id(self) -> Optional[int]:
+        if not self.catalog:
             return None
+        if self.weighted:
+            if self._hist_pos < 0:
+                return None
+            return self.slots.id_of(self._history[self._hist_pos])
         if self.shuffle:
-            idx = self.shuffle_bag[self.shuffle_pos]
-            return self.files[idx]
-        return self.files[self.seq_index]
+            return self.slots.id_of(self.shuffle_bag[self.shuffle_pos])
+        return self.catalog.sorted_ids[self.seq_index]
+
+    def current(self) -> Optional[str]:
+        fid = self.current_id()
+        return self.catalog.path(fid) if fid is not None else None
 
     def next(self) -> Optional[str]:
-        if not self.files:
+        if not self.catalog:
             return None
+        if self.weighted:
+            self._advance_weighted()
+            return self.current()
         if self.shuffle:
-            self.shuffle_pos += 1
-            if self.shuffle_pos >= len(self.shuffle_bag):
-                self._refill_bag()
+            self._advance()
             return self.current()
-        self.seq_index = (self.seq_index + 1) % len(self.files)
+        self.seq_index = (self.seq_index + 1) % len(self.catalog)
         return self.current()
 
     def prev(self) -> Optional[str]:
-        if not self.files:
+        if not self.catalog:
             return None
+        if self.weighted:
+            hist = self._history
+            pos = self._hist_pos - 1
+            while pos >= 0 and hist[pos] == BAG_DEAD:
+                pos -= 1
+            if pos >= 0:
+                self._hist_pos = pos
+            return self.current()
         if self.shuffle:
-            self.shuffle_pos -= 1
-            if self.shuffle_pos < 0:
+            bag = self.shuffle_bag
+            pos = self.shuffle_pos - 1
+            while pos >= 0 and bag[pos] == BAG_DEAD:
+                pos -= 1
+            if pos >= 0:
+                self.shuffle_pos = pos
+            else:
                 # If user goes "back" past start, refill and jump to last
+                # (rare: draw the whole new bag eagerly)
                 self._refill_bag()
+                while self._drawn < len(self.shuffle_bag):
+                    self._draw(spaced=False)
                 self.shuffle_pos = len(self.shuffle_bag) - 1
             return self.current()
-        self.seq_index = (self.seq_index - 1) % len(self.files)
+        self.seq_index = (self.seq_index - 1) % len(self.catalog)
         return self.current()
 
     def position_text(self) -> str:
-        if not self.files:
+        n = len(self.catalog)
+        if not n:
             return "0/0"
+        if self.weighted:
+            # No cycle to count through: show the photo's place in the library
+            fid = self.current_id()
+            rank = self.catalog.rank_of[fid] if fid is not None else 0
+            return f"{rank + 1}/{n}"
         if self.shuffle:
-            # Show position inside current shuffle cycle
-            return f"{self.shuffle_pos + 1}/{len(self.shuffle_bag)}"
-        return f"{self.seq_index + 1}/{len(self.files)}"
+            # Show position inside current shuffle cycle (tombstones excluded)
+            dead_before = bisect.bisect_right(self._dead_pos, self.shuffle_pos)
+            live = len(self.shuffle_bag) - len(self._dead_pos)
+            return f"{self.shuffle_pos + 1 - dead_before}/{live}"
+        return f"{self.seq_index + 1}/{n}"
 
 
 # -------------------------
@@ -597,106 +2230,2522 @@ class Button:
     action: str
 
 
+BUTTON_BAR = [
+    ("Prev", "prev"),
+    ("Play/Pause", "toggle_pause"),
+    ("Next", "next"),
+    ("Interval", "toggle_interval"),
+    ("Fav", "favorite"),
+    ("Captions", "toggle_captions"),
+    ("Brightness", "toggle_brightness"),
+    ("Shuffle", "toggle_shuffle"),
+    ("Reload", "reload_reset"),
+    ("Browse", "browse"),
+    ("Sleep", "sleep"),
+    #("Exit", "exit"),
+]
+
+
 def make_buttons(screen_w: int, screen_h: int, cfg: Config) -> List[Button]:
     """
     Bottom bar layout constrained to cfg.overlay_width_ratio of screen.
-    [Prev] [Play/Pause] [Next] [Sleep] [Shuffle] [Fav] [Reload] [Exit]
-    """
-    labels_actions = [
-        ("Prev", "prev"),
-        ("Play/Pause", "toggle_pause"),
-        ("Next", "next"),
-        ("Interval", "toggle_interval"),
-        ("Fav", "favorite"),
-        ("Captions", "toggle_captions"),
-        ("Brightness", "toggle_brightness"),
-        ("Shuffle", "toggle_shuffle"),
-        ("Reload", "reload_reset"),
-        ("Sleep", "sleep"),
-        #("Exit", "exit"),
-    ]
+    [Prev] [Play/Pause] [Next] ... [Reload] [Browse] [Sleep]
+    """
+    labels_actions = BUTTON_BAR
+
+    n = len(labels_actions)
+    overlay_w = int(screen_w * cfg.overlay_width_ratio)
+
+    # Compute button width to fit inside overlay_w
+    total_gaps = (n - 1) * cfg.button_gap
+    raw_w = (overlay_w - total_gaps) // n
+    btn_w = clamp(raw_w, cfg.min_button_width, cfg.max_button_width)
+
+    # If clamped width causes overflow, shrink further (guaranteed fit)
+    needed_w = n * btn_w + total_gaps
+    if needed_w > overlay_w:
+        btn_w = max(cfg.min_button_width, (overlay_w - total_gaps) // n)
+
+    total_w = n * btn_w + total_gaps
+    start_x = (screen_w - total_w) // 2
+    overlay_h = cfg.button_height + cfg.ui_padding * 2
+    y = screen_h - overlay_h + cfg.ui_padding
+
+
+    buttons: List[Button] = []
+    x = start_x
+    for label, action in labels_actions:
+        rect = pygame.Rect(x, y, btn_w, cfg.button_height)
+        buttons.append(Button(label=label, rect=rect, action=action))
+        x += btn_w + cfg.button_gap
+
+    return buttons
+
+
+# -------------------------
+# UI asset bundle (cached button layout + label glyphs)
+# -------------------------
+UI_BUNDLE_NAME = "ui_bundle.bin"
+UI_BUNDLE_MAGIC = b"PFUI"
+UI_BUNDLE_VERSION = 1
+UI_BUNDLE_HEADER = struct.Struct("<4sH20sHHH")  # magic, version, inputs digest, font size, buttons, labels
+UI_BUNDLE_RECT = struct.Struct("<hhhh")
+UI_BUNDLE_GLYPH = struct.Struct("<HHH")         # label utf-8 length, w, h; label + RGBA pixels follow
+
+
+def fixed_button_labels(cfg: Config) -> list[str]:
+    """Every label the bar can show for the configured steps (arbitrary saved brightness aside)."""
+    labels = ["Prev", "Play", "Pause", "Next", "Fav", "Reload", "Browse", "Sleep"]
+    labels += [f"Shuffle: {m}" for m in ("Off", "On", "Smart")]
+    labels += [f"Captions: {m}" for m in ("OFF", "ON", "FADE")]
+    labels += [f"{int(s)}s" for s in cfg.interval_steps]
+    labels += [f"Bright: {int(b * 100)}%" for b in cfg.brightness_steps]
+    return list(dict.fromkeys(labels))
+
+
+def ui_bundle_key(screen_size: tuple[int, int], cfg: Config, labels: list[str]) -> bytes:
+    """Digest of everything the button layout, font size and glyphs depend on."""
+    font_path = os.path.join(AppPaths.data_dir, AppPaths.font_file)
+    try:
+        st = os.stat(font_path)
+        font_id = f"{font_path}:{st.st_size}:{st.st_mtime_ns}"
+    except OSError:
+        font_id = f"sys:{AppPaths.font_fallback_name}"
+    inputs = (font_id, pygame.version.ver, tuple(screen_size), BUTTON_BAR, worst_case_button_labels(), labels,
+              cfg.overlay_width_ratio, cfg.button_gap, cfg.min_button_width, cfg.max_button_width,
+              cfg.button_height, cfg.ui_padding)
+    return hashlib.sha1(repr(inputs).encode("utf-8")).digest()
+
+
+def save_ui_bundle(path: str, key: bytes, font_size: int, buttons: List[Button],
+                   glyphs: dict[str, pygame.Surface]) -> None:
+    """Write the computed bar (rects, font size, rendered labels) with an atomic replace."""
+    parts = [UI_BUNDLE_HEADER.pack(UI_BUNDLE_MAGIC, UI_BUNDLE_VERSION, key, font_size, len(buttons), len(glyphs))]
+    for b in buttons:
+        parts.append(UI_BUNDLE_RECT.pack(b.rect.x, b.rect.y, b.rect.w, b.rect.h))
+    for label, surf in glyphs.items():
+        name = label.encode("utf-8")
+        parts.append(UI_BUNDLE_GLYPH.pack(len(name), surf.get_width(), surf.get_height()))
+        parts.append(name)
+        parts.append(pygame.image.tobytes(surf, "RGBA"))
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(b"".join(parts))
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def load_ui_bundle(path: str, key: bytes) -> Optional[tuple[int, List[Button], dict[str, pygame.Surface]]]:
+    """(font size, buttons, label glyphs) if the bundle was built from the same inputs, else None."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, digest, font_size, n_buttons, n_glyphs = UI_BUNDLE_HEADER.unpack_from(data, 0)
+        if magic != UI_BUNDLE_MAGIC or version != UI_BUNDLE_VERSION or digest != key \
+                or n_buttons != len(BUTTON_BAR):
+            return None
+        off = UI_BUNDLE_HEADER.size
+        buttons: List[Button] = []
+        for label, action in BUTTON_BAR:
+            rect = pygame.Rect(UI_BUNDLE_RECT.unpack_from(data, off))
+            buttons.append(Button(label=label, rect=rect, action=action))
+            off += UI_BUNDLE_RECT.size
+        glyphs: dict[str, pygame.Surface] = {}
+        view = memoryview(data)
+        for _ in range(n_glyphs):
+            n, w, h = UI_BUNDLE_GLYPH.unpack_from(data, off)
+            off += UI_BUNDLE_GLYPH.size
+            label = data[off:off + n].decode("utf-8")
+            off += n
+            if off + w * h * 4 > len(data):
+                return None
+            surf = pygame.image.frombuffer(view[off:off + w * h * 4], (w, h), "RGBA")
+            glyphs[label] = surf.convert_alpha() if pygame.display.get_surface() else surf
+            off += w * h * 4
+        return font_size, buttons, glyphs
+    except (OSError, struct.error, ValueError, pygame.error):
+        return None
+
+
+
+
+# -------------------------
+# EXIF orientation
+# -------------------------
+EXIF_ORIENTATION_TAG = 0x0112
+EXIF_THUMB_OFFSET_TAG = 0x0201   # IFD1 JPEGInterchangeFormat
+EXIF_THUMB_LENGTH_TAG = 0x0202   # IFD1 JPEGInterchangeFormatLength
+JPEG_EXTS = {".jpg", ".jpeg"}
+
+
+def _iter_jpeg_app_segments(f):
+    """
+    Yield (marker, payload) for the APPn/COM header segments of a JPEG.
+    Stops at start-of-scan, so pixel data is never read.
+    """
+    if f.read(2) != b"\xff\xd8":
+        return
+    while True:
+        b = f.read(1)
+        while b and b != b"\xff":
+            b = f.read(1)
+        while b == b"\xff":          # skip fill bytes
+            b = f.read(1)
+        if not b:
+            return
+        marker = b[0]
+        if marker in (0xD9, 0xDA):   # EOI / SOS
+            return
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            continue                 # standalone markers, no length
+        raw_len = f.read(2)
+        if len(raw_len) != 2:
+            return
+        seg_len = int.from_bytes(raw_len, "big") - 2
+        if seg_len < 0:
+            return
+        if 0xE0 <= marker <= 0xEF or marker == 0xFE:
+            yield marker, f.read(seg_len)
+        else:
+            f.seek(seg_len, os.SEEK_CUR)
+
+
+def _tiff_byteorder(tiff: bytes) -> Optional[str]:
+    order = tiff[:2]
+    if order == b"II":
+        return "little"
+    if order == b"MM":
+        return "big"
+    return None
+
+
+def _parse_tiff_ifd(tiff: bytes, ifd: int, bo: str) -> tuple[dict[int, tuple[int, int, bytes]], int]:
+    """
+    Parse one IFD of an EXIF TIFF block at offset ifd.
+    Returns ({tag: (type, count, value_or_offset_bytes)}, next IFD offset or 0).
+    """
+    if ifd <= 0 or ifd + 2 > len(tiff):
+        return {}, 0
+    n = int.from_bytes(tiff[ifd:ifd + 2], bo)
+    tags: dict[int, tuple[int, int, bytes]] = {}
+    for i in range(n):
+        off = ifd + 2 + i * 12
+        entry = tiff[off:off + 12]
+        if len(entry) < 12:
+            return tags, 0
+        tag = int.from_bytes(entry[0:2], bo)
+        typ = int.from_bytes(entry[2:4], bo)
+        count = int.from_bytes(entry[4:8], bo)
+        tags[tag] = (typ, count, entry[8:12])
+    nxt = tiff[ifd + 2 + n * 12:ifd + 6 + n * 12]
+    return tags, int.from_bytes(nxt, bo) if len(nxt) == 4 else 0
+
+
+def _parse_tiff_ifd0(tiff: bytes) -> dict[int, tuple[int, int, bytes]]:
+    """
+    Parse IFD0 of an EXIF TIFF block.
+    Returns {tag: (type, count, value_or_offset_bytes)}; values are left raw.
+    """
+    bo = _tiff_byteorder(tiff)
+    if len(tiff) < 8 or bo is None:
+        return {}
+    return _parse_tiff_ifd(tiff, int.from_bytes(tiff[4:8], bo), bo)[0]
+
+
+def read_exif_orientation(path: str, data: Optional[bytes] = None) -> int:
+    """
+    Return the EXIF orientation (1..8) of a JPEG, or 1 if absent/unknown.
+    Only the header segments are read (from `data` if the bytes are at hand).
+    """
+    if os.path.splitext(path)[1].lower() not in JPEG_EXTS:
+        return 1
+    try:
+        with (io.BytesIO(data) if data is not None else open(path, "rb")) as f:
+            for marker, payload in _iter_jpeg_app_segments(f):
+                if marker != 0xE1 or not payload.startswith(b"Exif\x00\x00"):
+                    continue
+                tiff = payload[6:]
+                entry = _parse_tiff_ifd0(tiff).get(EXIF_ORIENTATION_TAG)
+                if entry is None:
+                    return 1
+                bo = "little" if tiff[:2] == b"II" else "big"
+                value = int.from_bytes(entry[2][:2], bo)
+                return value if 1 <= value <= 8 else 1
+    except OSError:
+        pass
+    return 1
+
+
+def read_exif_thumbnail(path: str) -> Optional[bytes]:
+    """
+    Return the embedded EXIF thumbnail of a JPEG (IFD1, usually ~160x120),
+    or None. Only the header segments are read.
+    """
+    if os.path.splitext(path)[1].lower() not in JPEG_EXTS:
+        return None
+    try:
+        with open(path, "rb") as f:
+            for marker, payload in _iter_jpeg_app_segments(f):
+                if marker != 0xE1 or not payload.startswith(b"Exif\x00\x00"):
+                    continue
+                tiff = payload[6:]
+                bo = _tiff_byteorder(tiff)
+                if len(tiff) < 8 or bo is None:
+                    return None
+                _, ifd1 = _parse_tiff_ifd(tiff, int.from_bytes(tiff[4:8], bo), bo)
+                tags, _ = _parse_tiff_ifd(tiff, ifd1, bo)
+                start = tags.get(EXIF_THUMB_OFFSET_TAG)
+                length = tags.get(EXIF_THUMB_LENGTH_TAG)
+                if start is None or length is None:
+                    return None
+                off = int.from_bytes(start[2], bo)
+                n = int.from_bytes(length[2], bo)
+                data = tiff[off:off + n]
+                return data if n and len(data) == n and data.startswith(b"\xff\xd8") else None
+    except OSError:
+        pass
+    return None
+
+
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def read_image_size(path: str) -> Optional[tuple[int, int]]:
+    """
+    (width, height) of a JPEG, PNG or WebP from its header, or None.
+    Pixel data is never read.
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(32)
+            if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+            if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                chunk = head[12:16]
+                if chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+                    w, h = struct.unpack("<HH", head[26:30])
+                    return w & 0x3FFF, h & 0x3FFF
+                if chunk == b"VP8L" and head[20] == 0x2F:
+                    bits = int.from_bytes(head[21:25], "little")
+                    return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+                if chunk == b"VP8X":
+                    return 1 + int.from_bytes(head[24:27], "little"), 1 + int.from_bytes(head[27:30], "little")
+                return None
+            if head[:2] != b"\xff\xd8":
+                return None
+            f.seek(2)
+            while True:
+                b = f.read(1)
+                while b and b != b"\xff":
+                    b = f.read(1)
+                while b == b"\xff":
+                    b = f.read(1)
+                if not b or b[0] in (0xD9, 0xDA):
+                    return None
+                marker = b[0]
+                if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+                    continue
+                raw_len = f.read(2)
+                if len(raw_len) != 2 or int.from_bytes(raw_len, "big") < 2:
+                    return None
+                if marker in JPEG_SOF_MARKERS:
+                    frame = f.read(5)   # precision, height, width
+                    if len(frame) != 5:
+                        return None
+                    h, w = struct.unpack(">HH", frame[1:5])
+                    return w, h
+                f.seek(int.from_bytes(raw_len, "big") - 2, os.SEEK_CUR)
+    except OSError:
+        return None
+
+
+def apply_exif_orientation(surf: pygame.Surface, orientation: int) -> pygame.Surface:
+    """Rotate/flip a decoded surface so it displays upright."""
+    if orientation == 2:
+        return pygame.transform.flip(surf, True, False)
+    if orientation == 3:
+        return pygame.transform.rotate(surf, 180)
+    if orientation == 4:
+        return pygame.transform.flip(surf, False, True)
+    if orientation == 5:   # transpose
+        return pygame.transform.flip(pygame.transform.rotate(surf, 90), False, True)
+    if orientation == 6:
+        return pygame.transform.rotate(surf, -90)
+    if orientation == 7:   # transverse
+        return pygame.transform.flip(pygame.transform.rotate(surf, -90), False, True)
+    if orientation == 8:
+        return pygame.transform.rotate(surf, 90)
+    return surf
+
+
+# -------------------------
+# Duplicate index (content + perceptual hashes, computed in a process pool)
+# -------------------------
+HASH_INDEX_NAME = "media_hashes.bin"
+HASH_DUPLICATES_NAME = "media_duplicates.json"
+HASH_MAGIC = b"PFMH"
+HASH_VERSION = 2                        # 2: dHash of large images fixed (staged shrink)
+HASH_HEADER = struct.Struct("<4sHHI")   # magic, version, reserved, count
+HASH_RECORD = struct.Struct("<QdQQ")    # file key, mtime, content hash, dHash
+HASH_SAVE_EVERY = 500                   # checkpoint while a big backlog is hashed
+HASH_CHUNK = 4                          # files per worker round-trip
+HASH_DECODE_SIZE = 64                   # reduced decode for the dHash (Pillow)
+HASH_MAX_DECODE_PIXELS = 16_000_000     # full-size pygame decode limit without Pillow
+
+
+def dhash_surface(img: pygame.Surface) -> int:
+    """64-bit difference hash: brightness gradients of a 9x8 grey thumbnail."""
+    if img.get_bitsize() < 24:
+        tmp = pygame.Surface(img.get_size(), 0, 32)
+        tmp.blit(img, (0, 0))
+        img = tmp
+    # smoothscale overflows on very large shrink factors: go down in steps
+    w, h = img.get_size()
+    while w > 1024 or h > 1024:
+        w, h = max(9, w // 8), max(8, h // 8)
+        img = pygame.transform.smoothscale(img, (w, h))
+    small = pygame.transform.smoothscale(img, (9, 8))
+    raw = pygame.image.tobytes(small, "RGB")
+    lum = [raw[i] * 299 + raw[i + 1] * 587 + raw[i + 2] * 114 for i in range(0, len(raw), 3)]
+    bits = 0
+    for y in range(8):
+        row = lum[y * 9:y * 9 + 9]
+        for x in range(8):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return bits
+
+
+def _hash_worker_init() -> None:
+    """Pool initializer: stay out of the way of the slideshow."""
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+def load_reduced(path: str, size: int) -> Optional[pygame.Surface]:
+    """
+    Decode path to roughly size x size with Pillow, if it is installed:
+    JPEGs are scaled down by the decoder itself (draft(), 1/2..1/8 DCT
+    scaling), so a 24 MP photo never exists at full size. Other formats
+    are decoded fully but reduced before they reach pygame. None without
+    Pillow or if the file cannot be read.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(path) as im:
+            im.draft("RGB", (size, size))
+            im.thumbnail((size, size))
+            im = im.convert("RGB")
+            return pygame.image.frombytes(im.tobytes(), im.size, "RGB")
+    except Exception:
+        return None
+
+
+def hash_media_file(path: str) -> Optional[tuple[int, int]]:
+    """
+    Worker: (content hash, dHash) of one file, or None if unreadable.
+    The dHash comes from the embedded EXIF thumbnail when there is one,
+    else from a reduced decode (load_reduced). Without Pillow, files up to
+    HASH_MAX_DECODE_PIXELS are decoded at full size with pygame; larger ones
+    get no dHash (0: exact-duplicate detection only).
+    """
+    try:
+        h = hashlib.blake2b(digest_size=8)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        content = int.from_bytes(h.digest(), "little")
+        img = None
+        thumb = read_exif_thumbnail(path)
+        if thumb:
+            try:
+                img = pygame.image.load(io.BytesIO(thumb), "thumb.jpg")
+            except (pygame.error, ValueError):
+                img = None
+        if img is None:
+            img = load_reduced(path, HASH_DECODE_SIZE)
+        if img is None:
+            size = read_image_size(path)
+            if size is not None and size[0] * size[1] > HASH_MAX_DECODE_PIXELS:
+                return content, 0
+            img = pygame.image.load(path)
+        return content, dhash_surface(img)
+    except Exception:
+        return None
+
+
+class MediaHashIndex:
+    """
+    Content and perceptual (dHash) hashes for every library file, kept in
+    media_hashes.bin (32 bytes per file) and recomputed only for files whose
+    mtime changed. Hashing runs in a low-priority process pool driven by a
+    background thread; update() just hands over the latest scan.
+
+    Exact duplicates (same content hash) are published as `hidden`: every
+    copy but the first in catalog order. too_similar() is the near-duplicate
+    test used by OrderManager to keep burst shots apart.
+
+    Entries live in parallel arrays sorted by key; keys added since the last
+    checkpoint sit in a small dict.
+    """
+    def __init__(self, data_dir: str, photos_root: str, workers: int = 2, near_distance: int = 6):
+        self.path = os.path.join(data_dir, HASH_INDEX_NAME)
+        self.dups_path = os.path.join(data_dir, HASH_DUPLICATES_NAME)
+        self.photos_root = photos_root
+        self.workers = max(1, workers)
+        self.near_distance = near_distance
+        self._lock = threading.Lock()
+        self.keys = array("Q")
+        self.mtimes = array("d")
+        self.chash = array("Q")
+        self.dhash = array("Q")
+        self.pending: dict[int, tuple[float, int, int]] = {}
+        # Paths suppressed as exact duplicates; version bumps on every change
+        self.hidden: frozenset[str] = frozenset()
+        self.hidden_version = 0
+        self._wanted: Optional[tuple[Sequence[str], array]] = None
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    def load(self) -> None:
+        """Read the persisted index and duplicate list (best effort)."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            magic, version, _, count = HASH_HEADER.unpack_from(data, 0)
+            if magic == HASH_MAGIC and version == HASH_VERSION and \
+                    len(data) >= HASH_HEADER.size + count * HASH_RECORD.size:
+                for key, mtime, c, d in HASH_RECORD.iter_unpack(
+                        data[HASH_HEADER.size:HASH_HEADER.size + count * HASH_RECORD.size]):
+                    self.keys.append(key)
+                    self.mtimes.append(mtime)
+                    self.chash.append(c)
+                    self.dhash.append(d)
+        except (OSError, struct.error):
+            pass
+        try:
+            with open(self.dups_path, "r", encoding="utf-8") as f:
+                rels = json.load(f)
+            if isinstance(rels, list):
+                self.hidden = frozenset(os.path.join(self.photos_root, r) for r in rels if isinstance(r, str))
+        except (OSError, ValueError):
+            pass
+
+    def _get(self, key: int) -> Optional[tuple[float, int, int]]:
+        """(mtime, content hash, dHash) of key; caller holds the lock."""
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.mtimes[i], self.chash[i], self.dhash[i]
+        return self.pending.get(key)
+
+    def _put(self, key: int, mtime: float, c: int, d: int) -> None:
+        with self._lock:
+            i = bisect.bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                self.mtimes[i], self.chash[i], self.dhash[i] = mtime, c, d
+            else:
+                self.pending[key] = (mtime, c, d)
+
+    def dhash_of(self, path: str) -> int:
+        """dHash of path, or 0 if not hashed yet."""
+        key = file_key(path, self.photos_root)
+        with self._lock:
+            e = self._get(key)
+        return e[2] if e is not None else 0
+
+    def too_similar(self, path: str, recent: List[str]) -> bool:
+        """True if path is within near_distance bits of a recently shown photo."""
+        d = self.dhash_of(path)
+        if not d:
+            return False
+        for r in recent:
+            e = self.dhash_of(r)
+            if e and (d ^ e).bit_count() <= self.near_distance:
+                return True
+        return False
+
+    # ---- background indexing ----
+    def update(self, files: Sequence[str], mtimes: array) -> None:
+        """Index a new scan in the background (supersedes a running one)."""
+        self._wanted = (files, mtimes)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="media-hash-index", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop:
+            self._wake.wait()
+            self._wake.clear()
+            job = self._wanted
+            if job is None or self._stop:
+                continue
+            try:
+                self._index(job)
+            except Exception:
+                pass
+
+    def _index(self, job: tuple[Sequence[str], array]) -> None:
+        files, mtimes = job
+        root = self.photos_root
+        keys = [file_key(p, root) for p in files]
+        with self._lock:
+            todo = []
+            for i, k in enumerate(keys):
+                e = self._get(k)
+                if e is None or e[0] != mtimes[i]:
+                    todo.append(i)
+        if todo:
+            ctx = multiprocessing.get_context("spawn")   # never fork a process holding SDL
+            with concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=ctx,
+                                                        initializer=_hash_worker_init) as pool:
+                self._pool = pool
+                try:
+                    results = pool.map(hash_media_file, [files[i] for i in todo], chunksize=HASH_CHUNK)
+                    for done, (i, res) in enumerate(zip(todo, results), 1):
+                        if self._stop or self._wanted is not job:
+                            pool.shutdown(wait=False, cancel_futures=True)
+                            break
+                        if res is not None:
+                            self._put(keys[i], mtimes[i], *res)
+                        if done % HASH_SAVE_EVERY == 0:
+                            self._publish(files, keys)
+                            self._save(None)
+                    else:
+                        todo = []
+                finally:
+                    self._pool = None
+                    if todo:
+                        # Stopped or superseded (close() may have cancelled
+                        # the map mid-iteration): keep the hashes done so far
+                        self._save(None)
+            if todo:
+                return
+        self._publish(files, keys)
+        self._save(set(keys))
+
+    def _publish(self, files: Sequence[str], keys: List[int]) -> None:
+        """Recompute the exact-duplicate set for this scan."""
+        first: dict[int, int] = {}
+        hidden = []
+        with self._lock:
+            for i, k in enumerate(keys):
+                e = self._get(k)
+                if e is not None and first.setdefault(e[1], i) != i:
+                    hidden.append(files[i])
+        new = frozenset(hidden)
+        if new == self.hidden:
+            return
+        self.hidden = new
+        self.hidden_version += 1
+        try:
+            tmp = self.dups_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(sorted(library_relpath(p, self.photos_root) for p in new), f)
+            os.replace(tmp, self.dups_path)
+        except OSError:
+            pass
+
+    def _save(self, alive: Optional[set[int]]) -> None:
+        """Fold pending entries in and write the index (dropping keys not in alive)."""
+        with self._lock:
+            if self.pending or alive is not None:
+                rows = sorted(itertools.chain(
+                    zip(self.keys, zip(self.mtimes, self.chash, self.dhash)), self.pending.items()))
+                if alive is not None:
+                    rows = [r for r in rows if r[0] in alive]
+                self.keys = array("Q", (k for k, _ in rows))
+                self.mtimes = array("d", (v[0] for _, v in rows))
+                self.chash = array("Q", (v[1] for _, v in rows))
+                self.dhash = array("Q", (v[2] for _, v in rows))
+                self.pending = {}
+            buf = bytearray(HASH_HEADER.pack(HASH_MAGIC, HASH_VERSION, 0, len(self.keys)))
+            for row in zip(self.keys, self.mtimes, self.chash, self.dhash):
+                buf += HASH_RECORD.pack(*row)
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(buf)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        self._stop = True
+        self._wake.set()
+        pool = self._pool
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+
+# -------------------------
+# Embedded captions (EXIF / IPTC / XMP, extracted in the background)
+# -------------------------
+EMBEDDED_CAPTIONS_NAME = "embedded_captions.bin"
+EMBEDDED_MAGIC = b"PFEC"
+EMBEDDED_VERSION = 2                       # 2: XMP parsing fixed, re-read cached captions
+EMBEDDED_HEADER = struct.Struct("<4sHHI")  # magic, version, reserved, count
+EMBEDDED_RECORD = struct.Struct("<QdH")    # file key, mtime, caption bytes (UTF-8 follows)
+EMBEDDED_BATCH = 64                        # files per pool round; urgent requests go first
+EXIF_IMAGE_DESCRIPTION_TAG = 0x010E
+XMP_SIGNATURE = b"http://ns.adobe.com/xap/1.0/\x00"
+PHOTOSHOP_SIGNATURE = b"Photoshop 3.0\x00"
+IPTC_RESOURCE_ID = 0x0404
+# Placeholders cameras write into ImageDescription
+EXIF_JUNK_DESCRIPTIONS = {"", "OLYMPUS DIGITAL CAMERA", "SONY DSC", "DIGITAL CAMERA",
+                          "SAMSUNG", "DEFAULT", "EXIF_JPEG_422"}
+# Element form (body up to its own closing tag; empty when self-closing)
+# and attribute form (dc:description="..." on rdf:Description)
+_XMP_DESCRIPTION_RE = re.compile(
+    rb"<dc:description\b[^>]*?(?:/>|>(.*?)</dc:description\s*>)", re.DOTALL)
+_XMP_DESCRIPTION_ATTR_RE = re.compile(rb"""\sdc:description\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+_XMP_LI_RE = re.compile(rb"<rdf:li\b[^>]*>(.*?)</rdf:li\s*>", re.DOTALL)
+
+
+def _exif_description(tiff: bytes) -> Optional[str]:
+    entry = _parse_tiff_ifd0(tiff).get(EXIF_IMAGE_DESCRIPTION_TAG)
+    bo = _tiff_byteorder(tiff)
+    if entry is None or bo is None or entry[0] != 2:   # ASCII
+        return None
+    typ, count, value = entry
+    raw = value[:count] if count <= 4 else tiff[int.from_bytes(value, bo):int.from_bytes(value, bo) + count]
+    text = raw.split(b"\x00", 1)[0].decode("utf-8", "replace").strip()
+    return None if text.upper() in EXIF_JUNK_DESCRIPTIONS else text
+
+
+def _decode_legacy(value: bytes) -> str:
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+
+def _iptc_caption(payload: bytes) -> Optional[str]:
+    """IPTC 2:120 (Caption-Abstract) from a Photoshop APP13 segment."""
+    i = len(PHOTOSHOP_SIGNATURE)
+    while i + 12 <= len(payload) and payload[i:i + 4] == b"8BIM":
+        rid = int.from_bytes(payload[i + 4:i + 6], "big")
+        name_len = payload[i + 6]
+        i += 7 + name_len + ((name_len + 1) & 1)   # Pascal name, padded to even
+        size = int.from_bytes(payload[i:i + 4], "big")
+        data = payload[i + 4:i + 4 + size]
+        i += 4 + size + (size & 1)
+        if rid != IPTC_RESOURCE_ID:
+            continue
+        j = 0
+        utf8 = False
+        while j + 5 <= len(data) and data[j] == 0x1C:
+            rec, ds = data[j + 1], data[j + 2]
+            n = int.from_bytes(data[j + 3:j + 5], "big")
+            value = data[j + 5:j + 5 + n]
+            j += 5 + n
+            if rec == 1 and ds == 90:
+                utf8 = value == b"\x1b%G"
+            elif rec == 2 and ds == 120:
+                text = value.decode("utf-8", "replace") if utf8 else _decode_legacy(value)
+                return text.strip() or None
+    return None
+
+
+def _xmp_description(payload: bytes) -> Optional[str]:
+    raw = None
+    m = _XMP_DESCRIPTION_RE.search(payload, len(XMP_SIGNATURE))
+    if m is not None and m.group(1):
+        body = m.group(1)
+        li = _XMP_LI_RE.search(body)
+        if li is not None:
+            raw = li.group(1)
+        elif b"<" not in body:
+            raw = body
+    if raw is None:
+        a = _XMP_DESCRIPTION_ATTR_RE.search(payload, len(XMP_SIGNATURE))
+        if a is None:
+            return None
+        raw = a.group(1) if a.group(1) is not None else a.group(2)
+    return html.unescape(raw.decode("utf-8", "replace")).strip() or None
+
+
+def read_embedded_caption(path: str) -> Optional[str]:
+    """
+    Description embedded in a JPEG's header segments, or None.
+    Precedence: XMP dc:description, then IPTC Caption, then EXIF
+    ImageDescription (often a camera placeholder). Pixel data is never read.
+    """
+    if os.path.splitext(path)[1].lower() not in JPEG_EXTS:
+        return None
+    xmp = iptc = exif = None
+    try:
+        with open(path, "rb") as f:
+            for marker, payload in _iter_jpeg_app_segments(f):
+                if marker == 0xE1 and xmp is None and payload.startswith(XMP_SIGNATURE):
+                    xmp = _xmp_description(payload)
+                elif marker == 0xE1 and exif is None and payload.startswith(b"Exif\x00\x00"):
+                    exif = _exif_description(payload[6:])
+                elif marker == 0xED and iptc is None and payload.startswith(PHOTOSHOP_SIGNATURE):
+                    iptc = _iptc_caption(payload)
+    except (OSError, ValueError):
+        pass
+    return xmp or iptc or exif
+
+
+class EmbeddedCaptionIndex:
+    """
+    Embedded captions for the library, cached by (path, mtime) in
+    embedded_captions.bin. A background thread feeds files whose mtime
+    changed to a small thread pool (header reads are I/O bound); photos
+    asked for by caption_for() before they were indexed jump the queue.
+
+    Checked files live in parallel arrays sorted by key; only files that
+    actually have a caption keep a string. `version` bumps whenever new
+    captions become visible.
+    """
+    def __init__(self, data_dir: str, photos_root: str, workers: int = 2):
+        self.path = os.path.join(data_dir, EMBEDDED_CAPTIONS_NAME)
+        self.photos_root = photos_root
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self.keys = array("Q")
+        self.mtimes = array("d")
+        self.pending: dict[int, float] = {}
+        self.texts: dict[int, str] = {}
+        self.version = 0
+        self._wanted: Optional[tuple[Sequence[str], array]] = None
+        self._urgent: deque[str] = deque()
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+        # Per-scan work list, kept so urgent requests don't redo it
+        self._job: Optional[tuple[Sequence[str], array]] = None
+        self._keys: List[int] = []
+        self._mtime_of: dict[int, float] = {}
+        self._todo: deque[str] = deque()
+
+    def load(self) -> None:
+        """Read the persisted cache (best effort)."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            magic, version, _, count = EMBEDDED_HEADER.unpack_from(data, 0)
+            if magic != EMBEDDED_MAGIC or version != EMBEDDED_VERSION:
+                return
+            off = EMBEDDED_HEADER.size
+            for _ in range(count):
+                key, mtime, n = EMBEDDED_RECORD.unpack_from(data, off)
+                off += EMBEDDED_RECORD.size
+                self.keys.append(key)
+                self.mtimes.append(mtime)
+                if n:
+                    self.texts[key] = data[off:off + n].decode("utf-8", "replace")
+                    off += n
+        except (OSError, struct.error):
+            pass
+
+    def _mtime(self, key: int) -> Optional[float]:
+        """mtime the key was indexed at; caller holds the lock."""
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.mtimes[i]
+        return self.pending.get(key)
+
+    def caption_for(self, path: str) -> Optional[str]:
+        key = file_key(path, self.photos_root)
+        text = self.texts.get(key)
+        if text is None and self._thread is not None:
+            with self._lock:
+                known = self._mtime(key) is not None
+            if not known:
+                self._urgent.append(path)
+                self._wake.set()
+        return text
+
+    # ---- background indexing ----
+    def update(self, files: Sequence[str], mtimes: array) -> None:
+        """Index a new scan in the background (supersedes a running one)."""
+        self._wanted = (files, mtimes)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="embedded-captions", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def _run(self) -> None:
+        with concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="caption") as pool:
+            while not self._stop:
+                self._wake.wait()
+                self._wake.clear()
+                job = self._wanted
+                if job is None:
+                    continue
+                try:
+                    self._index(job, pool)
+                except Exception:
+                    pass
+
+    def _index(self, job: tuple[Sequence[str], array], pool: concurrent.futures.Executor) -> None:
+        files, mtimes = job
+        root = self.photos_root
+        if job is not self._job:
+            keys = [file_key(p, root) for p in files]
+            with self._lock:
+                self._todo = deque(p for p, k, m in zip(files, keys, mtimes) if self._mtime(k) != m)
+            self._job, self._keys, self._mtime_of = job, keys, dict(zip(keys, mtimes))
+        keys, mtime_of, todo = self._keys, self._mtime_of, self._todo
+        dirty = False
+        while (todo or self._urgent) and not self._stop and self._wanted is job:
+            batch: List[str] = []
+            while self._urgent and len(batch) < EMBEDDED_BATCH:
+                batch.append(self._urgent.popleft())
+            while todo and len(batch) < EMBEDDED_BATCH:
+                batch.append(todo.popleft())
+            changed = False
+            for p, text in zip(batch, pool.map(read_embedded_caption, batch)):
+                text = text or None
+                key = file_key(p, root)
+                m = mtime_of.get(key)
+                if m is None:
+                    continue
+                with self._lock:
+                    i = bisect.bisect_left(self.keys, key)
+                    if i < len(self.keys) and self.keys[i] == key:
+                        self.mtimes[i] = m
+                    else:
+                        self.pending[key] = m
+                if self.texts.get(key) != text:
+                    if text:
+                        self.texts[key] = text
+                    else:
+                        del self.texts[key]
+                    changed = True
+                dirty = True
+            if changed:
+                self.version += 1
+        complete = self._wanted is job and not todo
+        if dirty or (complete and len(self.keys) + len(self.pending) != len(keys)):
+            self._save(set(keys) if complete else None)
+
+    def _save(self, alive: Optional[set[int]]) -> None:
+        """Fold pending entries in and write the cache (dropping keys not in alive)."""
+        with self._lock:
+            rows = sorted(itertools.chain(zip(self.keys, self.mtimes), self.pending.items()))
+            if alive is not None:
+                rows = [r for r in rows if r[0] in alive]
+                for k in [k for k in self.texts if k not in alive]:
+                    del self.texts[k]
+            self.keys = array("Q", (k for k, _ in rows))
+            self.mtimes = array("d", (m for _, m in rows))
+            self.pending = {}
+        buf = bytearray(EMBEDDED_HEADER.pack(EMBEDDED_MAGIC, EMBEDDED_VERSION, 0, len(rows)))
+        for key, mtime in rows:
+            text = self.texts.get(key, "").encode("utf-8")[:0xFFFF]
+            buf += EMBEDDED_RECORD.pack(key, mtime, len(text))
+            buf += text
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(buf)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+
+# -------------------------
+# Thumbnail atlas (grid browse)
+# -------------------------
+THUMB_STORE_DIR = "thumbs"
+THUMB_INDEX_NAME = "index.bin"
+THUMB_MAGIC = b"PFTH"
+THUMB_VERSION = 2
+THUMB_HEADER = struct.Struct("<4sHHI")   # magic, version, reserved, count
+THUMB_RECORD = struct.Struct("<QdIHH")   # file key, mtime, atlas slot, thumbnail w, h
+THUMB_W, THUMB_H = 224, 168              # one atlas cell
+ATLAS_COLS, ATLAS_ROWS = 8, 8            # cells per sheet (1792x1344 JPEG)
+ATLAS_PER_SHEET = ATLAS_COLS * ATLAS_ROWS
+THUMB_NONE = 0xFFFFFFFF                  # slot of an unreadable file (not retried)
+THUMB_BATCH = 16                         # thumbnails per sheet write; urgent ones go first
+THUMB_SAVE_EVERY = 512                   # index checkpoint while a big backlog is processed
+THUMB_SHEETS_CACHED = 4                  # decoded sheets kept for the grid
+
+
+def make_thumbnail(path: str) -> Optional[tuple[tuple[int, int], bytes]]:
+    """
+    Worker: upright thumbnail of one file fitted into a THUMB_W x THUMB_H
+    cell, as (size, RGB bytes), or None if unreadable. Uses the embedded
+    EXIF thumbnail when it is big enough, like hash_media_file().
+    """
+    try:
+        img = None
+        thumb = read_exif_thumbnail(path)
+        if thumb:
+            try:
+                img = pygame.image.load(io.BytesIO(thumb), "thumb.jpg")
+            except (pygame.error, ValueError):
+                img = None
+            if img is not None and max(img.get_size()) < THUMB_W // 2:
+                img = None
+        if img is None:
+            img = pygame.image.load(path)
+        img = apply_exif_orientation(img, read_exif_orientation(path))
+        if img.get_bitsize() < 24:
+            tmp = pygame.Surface(img.get_size(), 0, 32)
+            tmp.blit(img, (0, 0))
+            img = tmp
+        w, h = img.get_size()
+        s = min(THUMB_W / w, THUMB_H / h)
+        size = (max(1, min(THUMB_W, round(w * s))), max(1, min(THUMB_H, round(h * s))))
+        small = pygame.transform.smoothscale(img, size)
+        return size, pygame.image.tobytes(small, "RGB")
+    except Exception:
+        return None
+
+
+class ThumbnailStore:
+    """
+    On-disk thumbnails for the grid view, packed ATLAS_COLS x ATLAS_ROWS to
+    a JPEG sheet (thumbs/sheet_00000.jpg, ...), so a page of the grid costs
+    a few sheet loads and area blits instead of one decode per photo.
+    thumbs/index.bin maps file key -> (mtime, slot, w, h); slot // ATLAS_PER_SHEET
+    is the sheet, the thumbnail sits centred in its cell. New and changed files are thumbnailed in a low-priority
+    process pool driven by a background thread, a batch at a time; want()
+    moves files the grid is waiting for to the front.
+
+    Cells of changed or deleted photos are freed whenever the index is
+    saved and reused (lowest first, so a batch stays on few sheets) before
+    new cells are appended. `version` bumps whenever new thumbnails hit
+    the disk.
+    """
+    def __init__(self, data_dir: str, photos_root: str, workers: int = 1):
+        self.dir = os.path.join(data_dir, THUMB_STORE_DIR)
+        self.path = os.path.join(self.dir, THUMB_INDEX_NAME)
+        self.photos_root = photos_root
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self.keys = array("Q")
+        self.mtimes = array("d")
+        self.slots = array("I")
+        self.widths = array("H")
+        self.heights = array("H")
+        self.pending: dict[int, tuple[float, int, int, int]] = {}
+        self.version = 0
+        self._next_slot = 0
+        self._free: List[int] = []      # dead cells below _next_slot, highest first
+        self._wanted: Optional[tuple[Sequence[str], array]] = None
+        self._urgent: deque[str] = deque()
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        # Per-scan work list, kept so urgent requests don't redo it
+        self._job: Optional[tuple[Sequence[str], array]] = None
+        self._mtime_of: dict[int, float] = {}
+        self._alive: set[int] = set()
+        self._todo: deque[str] = deque()
+        # Sheet being filled (generator thread only)
+        self._sheet_no = -1
+        self._sheet: Optional[pygame.Surface] = None
+        self._fresh: List[tuple[int, float, int, int, int]] = []
+        # Sheets decoded for the grid (main thread): n -> (file mtime_ns, surface)
+        self._sheets: OrderedDict = OrderedDict()
+
+    def load(self) -> None:
+        """Read the persisted index (best effort)."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            magic, version, _, count = THUMB_HEADER.unpack_from(data, 0)
+            if magic != THUMB_MAGIC or version != THUMB_VERSION:
+                return
+            for key, mtime, slot, w, h in THUMB_RECORD.iter_unpack(
+                    data[THUMB_HEADER.size:THUMB_HEADER.size + count * THUMB_RECORD.size]):
+                self.keys.append(key)
+                self.mtimes.append(mtime)
+                self.slots.append(slot)
+                self.widths.append(w)
+                self.heights.append(h)
+        except (OSError, struct.error):
+            pass
+        self._reclaim()
+
+    def _reclaim(self) -> None:
+        """Rebuild the free list from the cells the index still uses."""
+        used = set(self.slots)
+        used.update(e[1] for e in self.pending.values())
+        used.discard(THUMB_NONE)
+        self._next_slot = max(used, default=-1) + 1
+        self._free = [s for s in range(self._next_slot - 1, -1, -1) if s not in used]
+
+    def _get(self, key: int) -> Optional[tuple[float, int, int, int]]:
+        """(mtime, slot, w, h) of key; caller holds the lock."""
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.mtimes[i], self.slots[i], self.widths[i], self.heights[i]
+        return self.pending.get(key)
+
+    # ---- grid side (main thread) ----
+    def slot_for(self, path: str) -> Optional[int]:
+        """Atlas slot of path's thumbnail, or None if there is none (yet)."""
+        with self._lock:
+            e = self._get(file_key(path, self.photos_root))
+        if e is None or e[1] == THUMB_NONE:
+            return None
+        return e[1]
+
+    def thumbnail(self, path: str) -> Optional[pygame.Surface]:
+        """path's thumbnail (without the cell's letterbox), or None."""
+        with self._lock:
+            e = self._get(file_key(path, self.photos_root))
+        if e is None or e[1] == THUMB_NONE:
+            return None
+        _, slot, w, h = e
+        sheet = self.sheet(slot // ATLAS_PER_SHEET)
+        if sheet is None:
+            return None
+        cell = self.cell_rect(slot)
+        return sheet.subsurface((cell.x + (THUMB_W - w) // 2, cell.y + (THUMB_H - h) // 2, w, h))
+
+    def want(self, paths: Sequence[str]) -> None:
+        """Thumbnail these (visible in the grid, not done yet) before the backlog."""
+        if self._thread is None or not paths:
+            return
+        self._urgent.clear()
+        self._urgent.extend(paths)
+        self._wake.set()
+
+    @staticmethod
+    def cell_rect(slot: int) -> pygame.Rect:
+        cell = slot % ATLAS_PER_SHEET
+        return pygame.Rect((cell % ATLAS_COLS) * THUMB_W, (cell // ATLAS_COLS) * THUMB_H, THUMB_W, THUMB_H)
+
+    def _sheet_path(self, n: int) -> str:
+        return os.path.join(self.dir, f"sheet_{n:05d}.jpg")
+
+    def sheet(self, n: int) -> Optional[pygame.Surface]:
+        """Decoded sheet n (LRU; reloaded when the file was rewritten)."""
+        path = self._sheet_path(n)
+        try:
+            stamp = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        hit = self._sheets.get(n)
+        if hit is not None and hit[0] == stamp:
+            self._sheets.move_to_end(n)
+            return hit[1]
+        try:
+            surf = pygame.image.load(path)
+            if pygame.display.get_surface() is not None:
+                surf = surf.convert()
+        except Exception:
+            return None
+        self._sheets[n] = (stamp, surf)
+        self._sheets.move_to_end(n)
+        while len(self._sheets) > THUMB_SHEETS_CACHED:
+            self._sheets.popitem(last=False)
+        return surf
+
+    # ---- background generation ----
+    def update(self, files: Sequence[str], mtimes: array) -> None:
+        """Thumbnail a new scan in the background (supersedes a running one)."""
+        self._wanted = (files, mtimes)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="thumbnails", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop:
+            self._wake.wait()
+            self._wake.clear()
+            job = self._wanted
+            if job is None or self._stop:
+                continue
+            try:
+                self._index(job)
+            except Exception:
+                pass
+
+    def _index(self, job: tuple[Sequence[str], array]) -> None:
+        files, mtimes = job
+        root = self.photos_root
+        if job is not self._job:
+            keys = [file_key(p, root) for p in files]
+            with self._lock:
+                self._todo = deque(p for p, k, m in zip(files, keys, mtimes)
+                                   if (e := self._get(k)) is None or e[0] != m)
+            self._job, self._mtime_of = job, dict(zip(keys, mtimes))
+            self._alive = set(keys)
+        mtime_of, todo = self._mtime_of, self._todo
+        if not todo:
+            # Everything in this scan is done; urgent requests are stale
+            self._urgent.clear()
+            if len(self.keys) + len(self.pending) != len(mtime_of):
+                self._save(self._alive)
+            return
+        done = 0
+        ctx = multiprocessing.get_context("spawn")   # never fork a process holding SDL
+        try:
+            with concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=ctx,
+                                                        initializer=_hash_worker_init) as pool:
+                self._pool = pool
+                try:
+                    while (todo or self._urgent) and not self._stop and self._wanted is job:
+                        batch: List[str] = []
+                        with self._lock:
+                            while self._urgent and len(batch) < THUMB_BATCH:
+                                p = self._urgent.popleft()
+                                if self._get(file_key(p, root)) is None and p not in batch:
+                                    batch.append(p)
+                        while todo and len(batch) < THUMB_BATCH:
+                            batch.append(todo.popleft())
+                        for p, res in zip(batch, pool.map(make_thumbnail, batch)):
+                            m = mtime_of.get(file_key(p, root))
+                            if m is not None:
+                                self._place(file_key(p, root), m, res)
+                        self._flush()
+                        done += len(batch)
+                        if done >= THUMB_SAVE_EVERY:
+                            done = 0
+                            self._save(None)
+                finally:
+                    self._pool = None
+        finally:
+            # Also when close() cancelled the batch (pool.map raises): the
+            # sheets written so far must not lose their index rows
+            self._flush()
+            self._save(self._alive if self._wanted is job and not todo and not self._stop else None)
+
+    def _place(self, key: int, mtime: float, res) -> None:
+        """Put one generated thumbnail into the sheet being filled."""
+        if res is None:
+            self._fresh.append((key, mtime, THUMB_NONE, 0, 0))
+            return
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = self._next_slot
+            self._next_slot += 1
+        n = slot // ATLAS_PER_SHEET
+        if n != self._sheet_no:
+            self._flush()
+            self._open_sheet(n)
+        assert self._sheet is not None
+        size, raw = res
+        rect = self.cell_rect(slot)
+        self._sheet.fill((0, 0, 0), rect)
+        self._sheet.blit(pygame.image.frombuffer(raw, size, "RGB"),
+                         (rect.x + (THUMB_W - size[0]) // 2, rect.y + (THUMB_H - size[1]) // 2))
+        self._fresh.append((key, mtime, slot, size[0], size[1]))
+
+    def _open_sheet(self, n: int) -> None:
+        sheet = pygame.Surface((ATLAS_COLS * THUMB_W, ATLAS_ROWS * THUMB_H))
+        try:
+            sheet.blit(pygame.image.load(self._sheet_path(n)), (0, 0))
+        except Exception:
+            pass
+        self._sheet_no, self._sheet = n, sheet
+
+    def _flush(self) -> None:
+        """Write the sheet being filled, then publish its new entries."""
+        if not self._fresh:
+            return
+        if self._sheet is not None and any(e[2] != THUMB_NONE for e in self._fresh):
+            try:
+                os.makedirs(self.dir, exist_ok=True)
+                final = self._sheet_path(self._sheet_no)
+                tmp = final[:-4] + ".tmp.jpg"   # pygame picks the codec by extension
+                pygame.image.save(self._sheet, tmp)
+                os.replace(tmp, final)
+            except (OSError, pygame.error):
+                self._fresh = []
+                return
+        with self._lock:
+            for key, *entry in self._fresh:
+                self.pending[key] = tuple(entry)
+            self.version += 1
+        self._fresh = []
+
+    def _save(self, alive: Optional[set[int]]) -> None:
+        """Fold pending entries in and write the index (dropping keys not in alive)."""
+        with self._lock:
+            if self.pending or alive is not None:
+                # dict: a re-thumbnailed file's pending entry replaces its old row
+                merged = dict(zip(self.keys, zip(self.mtimes, self.slots, self.widths, self.heights)))
+                merged.update(self.pending)
+                rows = sorted(merged.items())
+                if alive is not None:
+                    rows = [r for r in rows if r[0] in alive]
+                self.keys = array("Q", (k for k, _ in rows))
+                self.mtimes = array("d", (v[0] for _, v in rows))
+                self.slots = array("I", (v[1] for _, v in rows))
+                self.widths = array("H", (v[2] for _, v in rows))
+                self.heights = array("H", (v[3] for _, v in rows))
+                self.pending = {}
+                self._reclaim()
+            buf = bytearray(THUMB_HEADER.pack(THUMB_MAGIC, THUMB_VERSION, 0, len(self.keys)))
+            for row in zip(self.keys, self.mtimes, self.slots, self.widths, self.heights):
+                buf += THUMB_RECORD.pack(*row)
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(buf)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        self._stop = True
+        self._wake.set()
+        pool = self._pool
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+
+# -------------------------
+# Readahead (encoded bytes of upcoming slides)
+# -------------------------
+class Readahead:
+    """
+    Pulls the encoded file bytes of the next few slides into a bounded RAM
+    buffer on a background thread, so a slide change decodes from memory
+    instead of waiting on a slow SD card, USB stick or network mount.
+    posix_fadvise(WILLNEED) is issued first (where available) so the kernel
+    starts its own readahead for every file, including ones too big to buffer.
+
+    want() replaces the wanted list (latest call wins); take() hands the
+    bytes over once and frees them.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._buf: dict[str, bytes] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._wanted: List[str] = []
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    def want(self, paths: List[str]) -> None:
+        with self._lock:
+            if paths == self._wanted:
+                return
+            self._wanted = list(paths)
+            # Drop buffered files that are no longer coming up
+            for p in [p for p in self._buf if p not in self._wanted]:
+                self._size -= len(self._buf.pop(p))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="readahead", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    @property
+    def nbytes(self) -> int:
+        """Encoded bytes currently buffered."""
+        return self._size
+
+    def take(self, path: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._buf.pop(path, None)
+            if data is not None:
+                self._size -= len(data)
+            return data
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buf.clear()
+            self._size = 0
+            self._wanted = []
+
+    def _run(self) -> None:
+        while not self._stop:
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                wanted = [p for p in self._wanted if p not in self._buf]
+            for i, path in enumerate(wanted):
+                if self._stop or self._wake.is_set():
+                    break   # a newer list arrived
+                self._fetch(path, hint_rest=wanted[i + 1:] if i == 0 else ())
+
+    def _fetch(self, path: str, hint_rest=()) -> None:
+        fadvise = getattr(os, "posix_fadvise", None)
+        # Let the kernel start on the later files while we read this one
+        for p in hint_rest if fadvise else ():
+            try:
+                fd = os.open(p, os.O_RDONLY)
+                try:
+                    fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if fadvise:
+                    fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                with self._lock:
+                    if size > self.max_bytes - self._size or path not in self._wanted:
+                        return
+                data = f.read()
+        except OSError:
+            return
+        with self._lock:
+            if path in self._wanted and path not in self._buf and self._size + len(data) <= self.max_bytes:
+                self._buf[path] = data
+                self._size += len(data)
+
+    def close(self) -> None:
+        self._stop = True
+        self._wake.set()
+
+
+# -------------------------
+# Process decoder (shared-memory pixel handoff)
+# -------------------------
+DECODE_SLOTS = 3            # on screen, previous, next
+DECODE_TIMEOUT = 10.0       # seconds to wait for the worker before decoding in-process
+# Byte order matching the usual XRGB8888 display surface (blits without conversion)
+DECODE_FORMAT = "BGRA" if sys.byteorder == "little" else "ARGB"
+
+
+def _decode_worker(conn) -> None:
+    """Worker loop: decode, orient and scale a slide straight into a shared-memory slot."""
+    from multiprocessing import shared_memory
+    slots: dict = {}
+    queued: deque = deque()
+    try:
+        while True:
+            while not queued or conn.poll():
+                msg = conn.recv()
+                if msg is None:
+                    return
+                if msg[4]:
+                    # Urgent (the slide on screen): drop what is still queued
+                    for old in queued:
+                        conn.send((old[0], None, 0.0))
+                    queued.clear()
+                queued.append(msg)
+            job, path, size, name, _ = queued.popleft()
+            ok = False
+            t0 = time.perf_counter()
+            try:
+                shm = slots.get(name)
+                if shm is None:
+                    shm = slots[name] = shared_memory.SharedMemory(name=name)
+                img = pygame.image.load(path)
+                img = apply_exif_orientation(img, read_exif_orientation(path))
+                if img.get_size() != size:
+                    img = pygame.transform.scale(img, size)
+                dest = pygame.image.frombuffer(shm.buf[:size[0] * size[1] * 4], size, DECODE_FORMAT)
+                dest.blit(img, (0, 0))
+                del dest
+                ok = True
+            except Exception:
+                pass
+            conn.send((job, ok, (time.perf_counter() - t0) * 1000.0))
+    except (EOFError, OSError, KeyboardInterrupt):
+        pass
+    finally:
+        for shm in slots.values():
+            try:
+                shm.close()
+            except Exception:
+                pass
+
+
+class ProcessDecoder:
+    """
+    Decodes and scales slides in a separate process, so pixel conversion and
+    scaling never hold the render loop's GIL. The worker writes display-ready
+    pixels into one of a few shared-memory slots; the main process wraps the
+    slot with pygame.image.frombuffer (no copy). A slot is only reused once it
+    is neither pending nor on screen.
+
+    Bound to one target size (the screen); anything else is left to the
+    in-process path, as is everything after the worker dies.
+    """
+    def __init__(self, size: tuple[int, int], slots: int = DECODE_SLOTS):
+        from multiprocessing import shared_memory
+        self.size = size
+        self._nbytes = size[0] * size[1] * 4
+        self._shm = [shared_memory.SharedMemory(create=True, size=self._nbytes) for _ in range(slots)]
+        self._key: List[Optional[str]] = [None] * slots     # path held (or being written)
+        self._ready = [False] * slots
+        self._surf: List[Optional[pygame.Surface]] = [None] * slots
+        self._used = [0] * slots                            # LRU ticks
+        self._tick = 0
+        self._pending: dict[int, int] = {}                  # job -> slot
+        self._job = 0
+        self._shown = -1                                    # slot returned by the last get()
+        self._failed_path: Optional[str] = None             # last file the worker could not decode
+        self.failed = False
+        self.decode_ms = Histogram()                        # worker decode+scale time per slide
+        ctx = multiprocessing.get_context("spawn")
+        self._conn, child = ctx.Pipe()
+        self._proc = ctx.Process(target=_decode_worker, args=(child,), name="decoder", daemon=True)
+        self._proc.start()
+        child.close()
+
+    def _slot_of(self, path: str) -> Optional[int]:
+        for i, key in enumerate(self._key):
+            if key == path:
+                return i
+        return None
+
+    def _submit(self, path: str, urgent: bool) -> Optional[int]:
+        busy = set(self._pending.values())
+        free = [i for i in range(len(self._shm)) if i not in busy and i != self._shown]
+        if free:
+            slot = min(free, key=self._used.__getitem__)
+        elif urgent and self._pending:
+            # Take over the oldest pending job's slot; its late reply is ignored
+            # (the worker writes slots in order, so ours lands last)
+            slot = self._pending[min(self._pending)]
+            for job in [j for j, s in self._pending.items() if s == slot]:
+                del self._pending[job]
+        else:
+            return None
+        self._surf[slot] = None     # drop the old wrapper before its pixels change
+        self._key[slot] = path
+        self._ready[slot] = False
+        self._job += 1
+        try:
+            self._conn.send((self._job, path, self.size, self._shm[slot].name, urgent))
+        except OSError:
+            self.failed = True
+            return None
+        self._pending[self._job] = slot
+        return slot
+
+    def _drain(self, timeout: float = 0.0) -> None:
+        try:
+            while self._pending and self._conn.poll(timeout):
+                job, ok, ms = self._conn.recv()
+                if ok:
+                    self.decode_ms.add(ms)
+                slot = self._pending.pop(job, None)
+                if slot is None:
+                    continue
+                self._ready[slot] = bool(ok)
+                if not ok:
+                    if ok is not None:      # None: cancelled, False: undecodable
+                        self._failed_path = self._key[slot]
+                    self._key[slot] = None
+                timeout = 0.0
+        except (EOFError, OSError):
+            self.failed = True
+
+    def pending(self, path: str) -> bool:
+        """True while path is queued or being decoded."""
+        slot = self._slot_of(path)
+        return slot is not None and not self._ready[slot]
+
+    def ready(self, path: str) -> bool:
+        """True if path's pixels are already in a slot."""
+        self._drain()
+        slot = self._slot_of(path)
+        return slot is not None and self._ready[slot]
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes * len(self._shm)
+
+    def prefetch(self, path: str) -> None:
+        """Start decoding a slide that is coming up (no-op if already there)."""
+        if self.failed:
+            return
+        self._drain()
+        if self._slot_of(path) is None:
+            self._submit(path, urgent=False)
+
+    def get(self, path: str, wait: bool = True) -> Optional[pygame.Surface]:
+        """
+        Display-ready surface for path, waiting for the worker if needed.
+        A new request cancels jobs still queued in the worker.
+        """
+        if self.failed:
+            return None
+        self._drain()
+        if path == self._failed_path:
+            self._failed_path = None    # report once; a later request retries
+            return None
+        slot = self._slot_of(path)
+        if slot is None:
+            slot = self._submit(path, urgent=True)
+            if slot is None:
+                return None
+        if not wait and not self._ready[slot]:
+            return None
+        deadline = now_monotonic() + DECODE_TIMEOUT
+        while not self._ready[slot] and self._key[slot] == path and not self.failed:
+            left = deadline - now_monotonic()
+            if left <= 0:
+                return None
+            self._drain(left)
+        if not self._ready[slot] or self._key[slot] != path:
+            return None
+        surf = self._surf[slot]
+        if surf is None:
+            surf = pygame.image.frombuffer(self._shm[slot].buf[:self._nbytes], self.size, DECODE_FORMAT)
+            surf.set_alpha(None)    # opaque: plain copy blits
+            self._surf[slot] = surf
+        self._tick += 1
+        self._used[slot] = self._tick
+        self._shown = slot
+        return surf
+
+    def close(self) -> None:
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._proc.join(timeout=2.0)
+        if self._proc.is_alive():
+            self._proc.terminate()
+        self._surf = [None] * len(self._shm)
+        for shm in self._shm:
+            try:
+                shm.unlink()
+                shm.close()     # fails while a wrapped surface is still alive
+            except Exception:
+                pass
+
+
+# -------------------------
+# Image Cache (display-ready surfaces, background decode)
+# -------------------------
+DISPLAY_CACHE_MAX = 3       # screen-sized surfaces kept (~9 MB each at 1920x1200)
+THUMB_CACHE_MAX = 256       # low-res scrub previews kept
+THUMB_SCALE = 8             # previews are 1/8 of the screen per side
+SCRUB_WINDOW = 0.6          # prev/next presses closer than this count as scrubbing
+
+# Grid browse view
+GRID_COLS, GRID_ROWS = 8, 6
+GRID_PER_PAGE = GRID_COLS * GRID_ROWS
+GRID_FOOTER_H = 64
+
+
+class ImageCache:
+    """
+    Screen-sized surfaces for the slideshow. Decoding runs on a background
+    thread (or the worker-process decoder) as prioritised jobs: a request
+    for the slide on screen supersedes everything still queued, so a burst
+    of swipes only decodes the slide the user lands on. A job already being
+    decoded cannot be interrupted; its result is kept in case the user comes
+    back. Every decoded slide leaves a small thumbnail for scrubbing.
+    """
+    def __init__(self, readahead: Optional[Readahead] = None):
+        self.path: Optional[str] = None
+        # Worker-process decoder for screen-sized surfaces (optional)
+        self.decoder: Optional[ProcessDecoder] = None
+        self.surface: Optional[pygame.Surface] = None
+        # Per-file metadata: EXIF orientation probed once per path
+        self.orientations: dict[str, int] = {}
+        # Encoded bytes prefetched for upcoming slides (optional)
+        self.readahead = readahead
+        self._display_cache: OrderedDict = OrderedDict()   # (path, size) -> Surface (LRU)
+        self.thumbs: OrderedDict = OrderedDict()           # path -> small Surface (LRU)
+        # Optional on-disk thumbnail atlas, a preview source besides self.thumbs
+        self.atlas: Optional[ThumbnailStore] = None
+        self._preview_key: Optional[tuple] = None
+        self._preview: Optional[pygame.Surface] = None
+        # Decode jobs: (path, size) keys; results (None = failed) until collected
+        self._cv = threading.Condition()
+        self._jobs: deque = deque()
+        self._busy: Optional[tuple] = None
+        self._done: dict = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = False
+        # Stats: first lookup of each slide was ready (hit) or had to decode (miss)
+        self._lookup_key: Optional[tuple] = None
+        self.hits = 0
+        self.misses = 0
+        self.decode_ms = Histogram()        # in-process decode+scale time per slide
+
+    def orientation_for(self, path: str, data: Optional[bytes] = None) -> int:
+        o = self.orientations.get(path)
+        if o is None:
+            o = read_exif_orientation(path, data)
+            self.orientations[path] = o
+        return o
+
+    def load(self, path: str) -> Optional[pygame.Surface]:
+        if self.path == path and self.surface is not None:
+            return self.surface
+        try:
+            data = self.readahead.take(path) if self.readahead else None
+            if data is not None:
+                # Prefetched: decode from memory, the name hint picks the codec
+                img = pygame.image.load(io.BytesIO(data), os.path.basename(path))
+            else:
+                img = pygame.image.load(path)
+            # Bake EXIF rotation in once, so cached surfaces are upright
+            img = apply_exif_orientation(img, self.orientation_for(path, data))
+            # Convert to display format for faster blitting
+            if img.get_alpha() is not None:
+                img = img.convert_alpha()
+            else:
+                img = img.convert()
+            self.path = path
+            self.surface = img
+            return img
+        except Exception:
+            self.path = None
+            self.surface = None
+            return None
+
+    # ---- background jobs ----
+    def _request(self, key: tuple, urgent: bool) -> None:
+        """Queue a decode (caller holds _cv). Urgent jobs drop everything queued."""
+        if key == self._busy or key in self._done:
+            return
+        if urgent:
+            if self._jobs and self._jobs[0] == key:
+                return      # asked again (next frame): keep the prefetch behind it
+            self._jobs.clear()
+        elif key in self._jobs:
+            return
+        self._jobs.append(key)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="decode", daemon=True)
+            self._thread.start()
+        self._cv.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._cv:
+                while not self._jobs and not self._stop:
+                    self._cv.wait()
+                if self._stop:
+                    return
+                key = self._busy = self._jobs.popleft()
+            path, size = key
+            t0 = time.perf_counter()
+            surf = self.load(path)
+            try:
+                if surf is not None and surf.get_size() != size:
+                    surf = pygame.transform.scale(surf, size)
+            except Exception:
+                surf = None
+            if surf is not None:
+                self.remember_thumb(path, surf)
+            with self._cv:
+                if surf is not None:
+                    self.decode_ms.add((time.perf_counter() - t0) * 1000.0)
+                self._busy = None
+                self._done[key] = surf
+                while len(self._done) > DISPLAY_CACHE_MAX:
+                    del self._done[next(iter(self._done))]
+                self._cv.notify_all()
+
+    def _keep(self, key: tuple, surf: pygame.Surface) -> None:
+        self._display_cache[key] = surf
+        self._display_cache.move_to_end(key)
+        while len(self._display_cache) > DISPLAY_CACHE_MAX:
+            self._display_cache.popitem(last=False)
+
+    def load_for_display(self, path: str, target_size: tuple[int, int],
+                         wait: bool = True) -> pygame.Surface | None:
+        """
+        Display-ready surface for path. With wait=False a missing slide is
+        queued (superseding older requests) and None returned right away.
+        """
+        key = (path, target_size)
+        first = key != self._lookup_key
+        self._lookup_key = key
+
+        cached = self._display_cache.get(key)
+        if cached is not None:
+            self._display_cache.move_to_end(key)
+            self.hits += first
+            return cached
+
+        decoder = self.decoder
+        if decoder is not None and not decoder.failed and target_size == decoder.size:
+            if first:
+                if decoder.ready(path):
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            surf = decoder.get(path, wait=wait)
+            if surf is not None:
+                if path not in self.thumbs:
+                    self.remember_thumb(path, surf)
+                return surf
+            if not wait and not decoder.failed:
+                return None
+
+        with self._cv:
+            if first:
+                if key in self._done:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if key not in self._done:
+                self._request(key, urgent=True)
+                if not wait:
+                    return None
+                deadline = now_monotonic() + DECODE_TIMEOUT
+                while key not in self._done:
+                    left = deadline - now_monotonic()
+                    if left <= 0:
+                        return None
+                    self._cv.wait(left)
+            surf = self._done.pop(key)
+        if surf is not None:
+            self._keep(key, surf)
+        return surf
+
+    def pending(self, path: str, target_size: tuple[int, int]) -> bool:
+        """True while a decode of this slide is queued or running."""
+        decoder = self.decoder
+        if decoder is not None and not decoder.failed and target_size == decoder.size:
+            return decoder.pending(path)
+        key = (path, target_size)
+        with self._cv:
+            return key == self._busy or key in self._jobs
+
+    def prefetch(self, path: str, target_size: tuple[int, int]) -> None:
+        """Decode an upcoming slide in the background (behind any urgent job)."""
+        if (path, target_size) in self._display_cache:
+            return
+        decoder = self.decoder
+        if decoder is not None and not decoder.failed and target_size == decoder.size:
+            decoder.prefetch(path)
+            return
+        with self._cv:
+            self._request((path, target_size), urgent=False)
+
+    # ---- scrub previews ----
+    def remember_thumb(self, path: str, surf: pygame.Surface) -> None:
+        w, h = surf.get_size()
+        thumb = pygame.transform.scale(surf, (max(1, w // THUMB_SCALE), max(1, h // THUMB_SCALE)))
+        with self._cv:
+            self.thumbs[path] = thumb
+            self.thumbs.move_to_end(path)
+            while len(self.thumbs) > THUMB_CACHE_MAX:
+                self.thumbs.popitem(last=False)
+
+    def preview(self, path: str, target_size: tuple[int, int]) -> Optional[pygame.Surface]:
+        """
+        Low-res stand-in until the full decode lands: a cached thumbnail, the
+        atlas thumbnail, else the JPEG's embedded EXIF thumbnail, stretched to
+        the screen. None if there is none.
+        """
+        key = (path, target_size)
+        if self._preview_key == key:
+            return self._preview
+        with self._cv:
+            thumb = self.thumbs.get(path)
+        if thumb is None and self.atlas is not None:
+            thumb = self.atlas.thumbnail(path)
+        if thumb is None:
+            data = read_exif_thumbnail(path)
+            if data is None:
+                return None
+            try:
+                thumb = pygame.image.load(io.BytesIO(data), "thumb.jpg")
+                thumb = apply_exif_orientation(thumb, self.orientation_for(path)).convert()
+            except Exception:
+                return None
+            with self._cv:
+                self.thumbs[path] = thumb
+                while len(self.thumbs) > THUMB_CACHE_MAX:
+                    self.thumbs.popitem(last=False)
+        self._preview_key = key
+        self._preview = pygame.transform.scale(thumb, target_size)
+        return self._preview
+
+    def nbytes(self) -> int:
+        """Pixel bytes held by cached full-size surfaces, results, thumbnails and the preview."""
+        with self._cv:
+            surfs = list(self._display_cache.values()) + [s for s in self._done.values() if s is not None]
+            surfs += list(self.thumbs.values())
+        if self._preview is not None:
+            surfs.append(self._preview)
+        return sum(s.get_width() * s.get_height() * s.get_bytesize() for s in surfs)
+
+    def seed_preview(self, path: str, target_size: tuple[int, int], surf: pygame.Surface) -> None:
+        """Use an already screen-sized surface (e.g. the boot snapshot) as path's preview."""
+        self._preview_key = (path, target_size)
+        self._preview = surf
+
+    def clear(self) -> None:
+        """Forget decoded surfaces and queued jobs (rescan, display change)."""
+        with self._cv:
+            self._jobs.clear()
+            self._done.clear()
+            self.thumbs.clear()
+        self._display_cache.clear()
+        self._preview_key = None
+        self._preview = None
+
+    def close(self) -> None:
+        with self._cv:
+            self._stop = True
+            self._cv.notify_all()
+        if self.decoder:
+            self.decoder.close()
+
+
+# -------------------------
+# Frame timing (per-stage fixed-bucket histograms)
+# -------------------------
+FRAME_STAGES = ("rescan", "upkeep", "events", "decode", "blit", "dim", "clock", "captions",
+                "draw", "overlay", "flip", "frame")
+HIST_EDGES_MS = [0.05 * 1.25 ** i for i in range(48)]   # 0.05 ms .. ~1.8 s, +25% per bucket
+
+
+class Histogram:
+    """Fixed log-spaced buckets: O(log buckets) to record, no per-sample storage."""
+    __slots__ = ("counts", "n", "total", "max")
+
+    def __init__(self):
+        self.counts = array("I", bytes(4 * (len(HIST_EDGES_MS) + 1)))
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(HIST_EDGES_MS, ms)] += 1
+        self.n += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, q: float) -> float:
+        """Upper edge of the bucket holding the q-th sample (ms), capped at the max seen."""
+        if not self.n:
+            return 0.0
+        want = q * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= want and c:
+                return min(HIST_EDGES_MS[i] if i < len(HIST_EDGES_MS) else self.max, self.max)
+        return self.max
+
+
+class FrameTimer:
+    """
+    Lap timer over the main loop: begin() at the top of a frame, lap(stage)
+    after each stage (time since the previous lap), end() before the frame
+    rate wait. Disabled, every call is a single attribute test.
+
+    `stages` / `over_budget` are the stderr report window ("t" opens and
+    closes it). With keep (metrics exported) timing never stops and
+    `totals` / `over_budget_total` count from startup, untouched by the
+    report window.
+    """
+    def __init__(self, budget_ms: float, enabled: bool = False, keep: bool = False):
+        self.budget_ms = budget_ms
+        self.keep = keep
+        self.reporting = enabled
+        self.enabled = enabled or keep
+        self.totals = {name: Histogram() for name in FRAME_STAGES}
+        self.over_budget_total = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Start a fresh report window."""
+        self.last = "start"
+        self.stages = {name: Histogram() for name in FRAME_STAGES}
+        self.over_budget = 0
+        self.since = time.perf_counter()
+        self._t0 = self._t = self.since
+
+    def toggle(self) -> bool:
+        """Open a fresh report window, or close the open one; True if now open."""
+        self.reporting = not self.reporting
+        self.enabled = self.reporting or self.keep
+        if self.reporting:
+            self.reset()
+        return self.reporting
+
+    def begin(self) -> None:
+        self.last = "start"
+        if self.enabled:
+            self._t0 = self._t = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        self.last = stage       # kept even when disabled: the stall detector reports it
+        if self.enabled:
+            t = time.perf_counter()
+            ms = (t - self._t) * 1000.0
+            self.stages[stage].add(ms)
+            if self.keep:
+                self.totals[stage].add(ms)
+            self._t = t
+
+    def running(self) -> str:
+        """Stage that follows the last completed lap (what the loop is in now)."""
+        if self.last == "start":
+            return FRAME_STAGES[0]
+        i = FRAME_STAGES.index(self.last) + 1
+        return FRAME_STAGES[i] if i < len(FRAME_STAGES) - 1 else "idle"
+
+    def end(self) -> None:
+        if self.enabled:
+            ms = (time.perf_counter() - self._t0) * 1000.0
+            self.stages["frame"].add(ms)
+            over = ms > self.budget_ms
+            self.over_budget += over
+            if self.keep:
+                self.totals["frame"].add(ms)
+                self.over_budget_total += over
+
+    def report(self) -> str:
+        frame = self.stages["frame"]
+        lines = [f"frame timing: {frame.n} frames in {time.perf_counter() - self.since:.0f}s, "
+                 f"{self.over_budget} over {self.budget_ms:.1f}ms budget",
+                 f"  {'stage':<9} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7} {'mean':>7}"]
+        for name, h in self.stages.items():
+            if h.n:
+                lines.append(f"  {name:<9} {h.percentile(0.5):>7.2f} {h.percentile(0.95):>7.2f} "
+                             f"{h.percentile(0.99):>7.2f} {h.max:>7.2f} {h.total / h.n:>7.2f}")
+        return "\n".join(lines)
+
+
+# -------------------------
+# Metrics endpoint (Prometheus text format)
+# -------------------------
+METRICS_PUBLISH_SECONDS = 5.0   # main thread hands the server a fresh snapshot this often
+
+
+def read_rss_bytes() -> Optional[int]:
+    """Resident set size of this process (Linux), else None."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def histogram_snapshot(h: Histogram) -> tuple:
+    return (array("I", h.counts), h.total, h.n)
+
+
+def merge_histogram_snapshots(a: tuple, b: tuple) -> tuple:
+    return (array("I", map(operator.add, a[0], b[0])), a[1] + b[1], a[2] + b[2])
+
+
+def render_prometheus(families: list) -> str:
+    """
+    Text exposition of (name, type, help, samples). Samples are
+    [(labels, value)], or [(labels, (counts, sum_ms, count))] for histograms
+    (HIST_EDGES_MS buckets, exported in seconds).
+    """
+    out: List[str] = []
+    for name, kind, help_text, samples in families:
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if kind != "histogram":
+                out.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+                continue
+            counts, total_ms, n = value
+            sep = "," if labels else ""
+            cum = 0
+            for edge, c in zip(HIST_EDGES_MS, counts):
+                cum += c
+                out.append(f'{name}_bucket{{{labels}{sep}le="{edge / 1000.0:.6g}"}} {cum}')
+            out.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {n}')
+            out.append(f"{name}_sum{{{labels}}} {total_ms / 1000.0:.6f}" if labels else
+                       f"{name}_sum {total_ms / 1000.0:.6f}")
+            out.append(f"{name}_count{{{labels}}} {n}" if labels else f"{name}_count {n}")
+    return "\n".join(out) + "\n"
+
+
+class MetricsServer:
+    """
+    GET /metrics on a background thread. It only ever formats the last
+    snapshot handed over by publish(); nothing here touches app state, so
+    a scrape never waits on (or slows) the render loop.
+    """
+    def __init__(self, host: str, port: int):
+        self._families: list = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = render_prometheus(server._families).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+
+    def publish(self, families: list) -> None:
+        self._families = families   # swapped whole; never mutated afterwards
+
+    def close(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+# -------------------------
+# Control API (asyncio on its own thread; commands become pygame events)
+# -------------------------
+CONTROL_EVENT = pygame.event.custom_type()
+CONTROL_ACTIONS = ("next", "prev", "toggle_pause", "sleep", "wake", "reload_reset", "favorite",
+                   "toggle_brightness", "toggle_shuffle", "toggle_captions", "toggle_interval")
+CONTROL_MAX_BODY = 16384
+CONTROL_READ_TIMEOUT = 5.0
+CONTROL_STATUS_SECONDS = 1.0    # main thread republishes the status snapshot this often
+
+
+class ControlServer:
+    """
+    Minimal HTTP/1.0 API served by asyncio on a Unix socket and/or TCP:
+
+        GET  /status                  JSON snapshot published by the main loop
+        POST /action/<verb>           one of CONTROL_ACTIONS (do_action verbs + wake)
+        POST /brightness[?level=0.4]  set brightness; no level steps like the button
+        POST /show?path=<file>        jump to a photo (absolute or relative to photos dir)
+
+    Commands are posted as CONTROL_EVENT and run by the pygame loop, so the
+    server never touches app state and slow clients never stall rendering.
+    Accepted commands answer 202; their outcome shows up in /status.
+    """
+    def __init__(self, socket_path: str = "", host: str = "127.0.0.1", port: int = 0):
+        self.socket_path = socket_path
+        self._status = b"{}"
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, args=(host, port), name="control", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._error is not None:
+            raise self._error
+
+    def publish(self, status: dict) -> None:
+        self._status = json.dumps(status).encode("utf-8")
+
+    def _run(self, host: str, port: int) -> None:
+        asyncio.set_event_loop(self._loop)
+        servers = []
+        try:
+            if self.socket_path:
+                try:
+                    os.unlink(self.socket_path)     # stale socket from a previous run
+                except OSError:
+                    pass
+                servers.append(self._loop.run_until_complete(
+                    asyncio.start_unix_server(self._handle, path=self.socket_path)))
+            if port:
+                servers.append(self._loop.run_until_complete(
+                    asyncio.start_server(self._handle, host, port)))
+        except (OSError, AttributeError) as e:    # AttributeError: no Unix sockets (Windows)
+            self._error = e
+        self._started.set()
+        if self._error is None:
+            self._loop.run_forever()
+        for server in servers:
+            server.close()
+        self._loop.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), CONTROL_READ_TIMEOUT)
+            lines = head.decode("latin-1").split("\r\n")
+            method, target = lines[0].split()[:2]
+            length = 0
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            if length > CONTROL_MAX_BODY:
+                raise ValueError("body too large")
+            body = await asyncio.wait_for(reader.readexactly(length), CONTROL_READ_TIMEOUT) if length else b""
+            code, payload = self._dispatch(method.upper(), target, body)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        except (ValueError, TypeError):
+            code, payload = 400, b'{"error": "bad request"}'
+        writer.write(f"HTTP/1.0 {code} {http.server.BaseHTTPRequestHandler.responses.get(code, ('',))[0]}\r\n"
+                     f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    def _dispatch(self, method: str, target: str, body: bytes) -> tuple[int, bytes]:
+        url = urllib.parse.urlsplit(target)
+        args = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        if body:
+            parsed = json.loads(body)
+            if isinstance(parsed, dict):
+                args.update({k: v for k, v in parsed.items() if isinstance(k, str)})
+        route = url.path.rstrip("/")
+        if route == "/status" and method == "GET":
+            return 200, self._status
+        if method != "POST":
+            return 405, b'{"error": "use POST for commands"}'
+        if route.startswith("/action/"):
+            command, arg = route[len("/action/"):], None
+            if command not in CONTROL_ACTIONS:
+                return 404, json.dumps({"error": "unknown action", "actions": CONTROL_ACTIONS}).encode()
+        elif route == "/brightness":
+            command, arg = "brightness", args.get("level")
+            if arg is not None:
+                arg = float(arg)
+                if not 0.0 < arg <= 1.0:
+                    raise ValueError("level out of range")
+        elif route == "/show":
+            command, arg = "show", args.get("path")
+            if not isinstance(arg, str) or not arg:
+                return 400, b'{"error": "path required"}'
+        else:
+            return 404, b'{"error": "not found"}'
+        try:
+            pygame.event.post(pygame.event.Event(CONTROL_EVENT, command=command, arg=arg))
+        except pygame.error:
+            return 503, b'{"error": "not running"}'
+        return 202, json.dumps({"queued": command}).encode()
+
+    def close(self) -> None:
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=2.0)
+        if self.socket_path:
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+
+# -------------------------
+# systemd notify / watchdog and main-loop stall detection
+# -------------------------
+START_EXTEND_SECONDS = 60.0     # start timeout asked for (and renewed at half) while the library loads
+
+
+def sd_notify(state: str) -> bool:
+    """Send a state line (READY=1, WATCHDOG=1, STATUS=...) to systemd, if it is listening."""
+    addr = os.environ.get("NOTIFY_SOCKET")
+    if not addr or not hasattr(socket, "AF_UNIX"):
+        return False
+    if addr[0] == "@":
+        addr = "\0" + addr[1:]     # abstract namespace
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+            s.connect(addr)
+            s.sendall(state.encode("utf-8"))
+        return True
+    except OSError:
+        return False
+
+
+class LoopWatchdog:
+    """
+    beat() once per frame from the main loop: it pings the systemd watchdog
+    (WATCHDOG_USEC / 2), so a hung loop stops pinging and systemd restarts
+    the service. A monitor thread reports any frame stuck longer than
+    stall_seconds - the last frame stage that completed and the main
+    thread's stack - to stderr (the journal) and systemd STATUS=, turning a
+    frozen frame into a diagnosable restart.
+    """
+    def __init__(self, stall_seconds: float, stage: Callable[[], str]):
+        self.stall_seconds = stall_seconds
+        self.stalls = 0
+        self._stage = stage
+        self._main = threading.get_ident()
+        self._beat = now_monotonic()
+        self._stalled = False
+        # WATCHDOG_PID is not checked: under xinit (kiosk unit) the app is not
+        # systemd's main PID, and the unit allows NotifyAccess=all for that
+        try:
+            usec = int(os.environ.get("WATCHDOG_USEC", "0"))
+        except ValueError:
+            usec = 0
+        self.ping_interval = usec / 2e6 if usec > 0 else 0.0
+        self._pinged = 0.0
+        if self.ping_interval:
+            # Killed by the watchdog (SIGABRT): dump every thread's stack first
+            faulthandler.enable()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if stall_seconds > 0:
+            self._thread = threading.Thread(target=self._run, name="stall-detector", daemon=True)
+            self._thread.start()
+
+    def beat(self) -> None:
+        t = now_monotonic()
+        self._beat = t
+        if self.ping_interval and t - self._pinged >= self.ping_interval:
+            self._pinged = t
+            sd_notify("WATCHDOG=1")
+
+    def _run(self) -> None:
+        check = min(1.0, self.stall_seconds / 4)
+        while not self._stop.wait(check):
+            stuck = now_monotonic() - self._beat
+            if stuck >= self.stall_seconds and not self._stalled:
+                self._stalled = True
+                self.stalls += 1
+                self._report(stuck)
+            elif stuck < self.stall_seconds and self._stalled:
+                self._stalled = False
+                print("stall: main loop running again", file=sys.stderr, flush=True)
+                sd_notify("STATUS=running")
+
+    def _report(self, stuck: float) -> None:
+        stage = self._stage()
+        frame = sys._current_frames().get(self._main)
+        stack = traceback.extract_stack(frame)[-8:] if frame is not None else []
+        where = f"{stack[-1].name} ({os.path.basename(stack[-1].filename)}:{stack[-1].lineno})" if stack else "?"
+        print(f"stall: main loop stuck {stuck:.0f}s in stage '{stage}', at {where}\n"
+              + "".join(traceback.format_list(stack)), file=sys.stderr, flush=True)
+        sd_notify(f"STATUS=stalled in stage '{stage}' at {where}")
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        sd_notify("STOPPING=1")
 
-    n = len(labels_actions)
-    overlay_w = int(screen_w * cfg.overlay_width_ratio)
 
-    # Compute button width to fit inside overlay_w
-    total_gaps = (n - 1) * cfg.button_gap
-    raw_w = (overlay_w - total_gaps) // n
-    btn_w = clamp(raw_w, cfg.min_button_width, cfg.max_button_width)
+# -------------------------
+# Profiling (cProfile windows, SIGUSR1 sampling)
+# -------------------------
+PROFILE_DIR_NAME = "profile"
+PROFILE_KEEP = 24               # newest dumps kept (SD card space)
+SAMPLE_INTERVAL = 0.005         # sampling profiler period (seconds)
+SAMPLE_TOP = 15                 # leaf functions listed on stderr when sampling stops
 
-    # If clamped width causes overflow, shrink further (guaranteed fit)
-    needed_w = n * btn_w + total_gaps
-    if needed_w > overlay_w:
-        btn_w = max(cfg.min_button_width, (overlay_w - total_gaps) // n)
 
-    total_w = n * btn_w + total_gaps
-    start_x = (screen_w - total_w) // 2
-    overlay_h = cfg.button_height + cfg.ui_padding * 2
-    y = screen_h - overlay_h + cfg.ui_padding
+def prune_profiles(profile_dir: str, prefix: str, keep: int = PROFILE_KEEP) -> None:
+    """Delete all but the newest `keep` dumps named prefix-<timestamp>..."""
+    try:
+        names = sorted(n for n in os.listdir(profile_dir) if n.startswith(prefix + "-"))
+        for n in names[:-keep] if keep else names:
+            os.remove(os.path.join(profile_dir, n))
+    except OSError:
+        pass
 
 
-    buttons: List[Button] = []
-    x = start_x
-    for label, action in labels_actions:
-        rect = pygame.Rect(x, y, btn_w, cfg.button_height)
-        buttons.append(Button(label=label, rect=rect, action=action))
-        x += btn_w + cfg.button_gap
+class LoopProfiler:
+    """
+    cProfile over the main loop (the thread that calls start()), restarted
+    every window_seconds; each window is dumped to
+    <profile_dir>/loop-YYYYmmdd-HHMMSS-NNNN.pstats for `python -m pstats`.
+    """
+    def __init__(self, profile_dir: str, window_seconds: float):
+        self.profile_dir = profile_dir
+        self.window_seconds = window_seconds
+        self._prof: Optional[cProfile.Profile] = None
+        self._t0 = 0.0
+        self._dumps = 0
+
+    def start(self) -> None:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self._prof = cProfile.Profile()
+        self._t0 = now_monotonic()
+        self._prof.enable()
+
+    def tick(self) -> None:
+        if self._prof is not None and now_monotonic() - self._t0 >= self.window_seconds:
+            self.dump()
+            self.start()
+
+    def dump(self) -> None:
+        prof, self._prof = self._prof, None
+        if prof is None:
+            return
+        prof.disable()
+        self._dumps += 1
+        path = os.path.join(self.profile_dir, time.strftime("loop-%Y%m%d-%H%M%S") + f"-{self._dumps:04d}.pstats")
+        try:
+            prof.dump_stats(path)
+        except OSError:
+            return
+        prune_profiles(self.profile_dir, "loop")
+        print(f"profile: wrote {path}", file=sys.stderr, flush=True)
 
-    return buttons
 
+class SamplingProfiler:
+    """
+    Statistical profiler for a frame misbehaving in the field: while on, a
+    thread records the main thread's stack every SAMPLE_INTERVAL. SIGUSR1
+    starts and stops it; stopping writes folded stacks (flamegraph.pl /
+    speedscope input) to <profile_dir>/samples-*.folded and prints the
+    hottest functions to stderr. Costs nothing while off.
+    """
+    def __init__(self, profile_dir: str):
+        self.profile_dir = profile_dir
+        self._main = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stacks: dict = {}
+        self._t0 = 0.0
+
+    def install(self) -> bool:
+        """Bind SIGUSR1 (main thread only; not on Windows)."""
+        if not hasattr(signal, "SIGUSR1"):
+            return False
+        try:
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.toggle())
+        except ValueError:
+            return False
+        return True
 
+    def toggle(self) -> None:
+        if self._thread is None:
+            self._stacks = {}
+            self._stop.clear()
+            self._t0 = now_monotonic()
+            self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+            self._thread.start()
+            print("profile: sampling started (SIGUSR1 again to stop)", file=sys.stderr, flush=True)
+        else:
+            self.stop()
+
+    def _run(self) -> None:
+        stacks = self._stacks
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self._main)
+            key = []
+            while frame is not None:
+                code = frame.f_code
+                key.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stack = ";".join(reversed(key))
+            stacks[stack] = stacks.get(stack, 0) + 1
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout=1.0)
+        total = sum(self._stacks.values())
+        if not total:
+            return
+        path = os.path.join(self.profile_dir, time.strftime("samples-%Y%m%d-%H%M%S.folded"))
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, n in sorted(self._stacks.items(), key=lambda kv: -kv[1]):
+                    f.write(f"{stack} {n}\n")
+            prune_profiles(self.profile_dir, "samples")
+        except OSError:
+            path = "(not written)"
+        leaves: dict = {}
+        for stack, n in self._stacks.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + n
+        lines = [f"profile: {total} samples over {now_monotonic() - self._t0:.1f}s -> {path}"]
+        for leaf, n in sorted(leaves.items(), key=lambda kv: -kv[1])[:SAMPLE_TOP]:
+            lines.append(f"  {100.0 * n / total:5.1f}%  {leaf}")
+        print("\n".join(lines), file=sys.stderr, flush=True)
 
 
 # -------------------------
-# Image Cache (single current image)
+# Boot snapshot (last slide, display-ready) and startup timeline
 # -------------------------
-class ImageCache:
-    def __init__(self):
-        self.path: Optional[str] = None
-        self.surface: Optional[pygame.Surface] = None
+SNAPSHOT_NAME = "last_frame.bin"
+SNAPSHOT_MAGIC = b"PFSN"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<4sHHHH")  # magic, version, width, height, path bytes (path, then pixels)
+SNAPSHOT_INTERVAL = 6 * 3600.0  # refresh at most this often while running (SD wear); always on sleep and exit
+SNAPSHOT_SCALE = 2              # pixels are stored at 1/2 screen size (1/4 the bytes), scaled up on boot
 
-    def load(self, path: str) -> Optional[pygame.Surface]:
-        if self.path == path and self.surface is not None:
-            return self.surface
-        try:
-            img = pygame.image.load(path)
-            # Convert to display format for faster blitting
-            if img.get_alpha() is not None:
-                img = img.convert_alpha()
-            else:
-                img = img.convert()
-            self.path = path
-            self.surface = img
-            return img
-        except Exception:
-            self.path = None
-            self.surface = None
-            return None
 
-    def load_for_display(self, path: str, target_size: tuple[int, int]) -> pygame.Surface | None:
-        key = (path, target_size)
+def snapshot_pixel_size(size: tuple[int, int]) -> tuple[int, int]:
+    return max(1, size[0] // SNAPSHOT_SCALE), max(1, size[1] // SNAPSHOT_SCALE)
 
-        if not hasattr(self, "_display_cache"):
-            self._display_cache = {}
 
-        cached = self._display_cache.get(key)
-        if cached is not None:
-            return cached
+def save_snapshot(path: str, image_path: str, size: tuple[int, int], pixels: bytes) -> None:
+    """
+    Write a framebuffer snapshot with an atomic replace. size is the screen
+    size; pixels are DECODE_FORMAT at snapshot_pixel_size(size).
+    """
+    name = image_path.encode("utf-8")[:0xFFFF]
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, size[0], size[1], len(name)))
+            f.write(name)
+            f.write(pixels)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
 
-        base = self.load(path)
-        if base is None:
+def load_snapshot(path: str, size: tuple[int, int]) -> Optional[tuple[str, pygame.Surface]]:
+    """
+    (image path, surface) of the persisted snapshot if it was taken at this
+    screen size, else None. The stored pixels are scaled straight up to
+    the screen size (no image decode).
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, w, h, n = SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or (w, h) != tuple(size):
+            return None
+        off = SNAPSHOT_HEADER.size
+        pixels = memoryview(data)[off + n:]
+        pw, ph = snapshot_pixel_size((w, h))
+        if len(pixels) != pw * ph * 4:
             return None
+        small = pygame.image.frombuffer(pixels, (pw, ph), DECODE_FORMAT)
+        small.set_alpha(None)
+        return data[off:off + n].decode("utf-8", "replace"), pygame.transform.smoothscale(small, (w, h))
+    except (OSError, struct.error, ValueError, pygame.error):
+        return None
 
-        try:
-            surf = base
-            if surf.get_size() != target_size:
-                surf = pygame.transform.scale(surf, target_size)
 
-            self._display_cache[key] = surf
-            return surf
-        except Exception:
-            return None
+class StartupTimeline:
+    """Start and duration of each cold-start phase, logged once the first slide is up."""
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.phases: List[tuple[str, float, float]] = []
+
+    @staticmethod
+    def now() -> float:
+        return time.perf_counter()
+
+    def phase(self, name: str, start: float) -> None:
+        """Record a phase that began at `start` (now()) and ends now."""
+        self.phases.append((name, start, time.perf_counter()))
 
+    def summary(self) -> str:
+        parts = [f"{name} @{(s - self.t0) * 1000:.0f}ms +{(e - s) * 1000:.0f}ms"
+                 for name, s, e in sorted(self.phases, key=lambda p: p[1])]
+        total = max((e for _, _, e in self.phases), default=self.t0) - self.t0
+        return f"startup: {total * 1000:.0f}ms (" + ", ".join(parts) + ")"
 
 
 def blit_centered_scaled(screen: pygame.Surface, img: pygame.Surface) -> None:
@@ -725,6 +4774,32 @@ def blit_centered_scaled(screen: pygame.Surface, img: pygame.Surface) -> None:
 class PhotoFrameApp:
     def __init__(self, cfg: Config):
         self.cfg = cfg
+        self.startup = StartupTimeline()
+        self.timing = FrameTimer(1000.0 / max(1, cfg.target_fps),
+                                 enabled=cfg.frame_timing, keep=cfg.metrics_port > 0)
+        self._timing_report_t = now_monotonic()
+
+        # Metrics (exported by MetricsServer when metrics_port is set)
+        self.metrics: Optional[MetricsServer] = None
+        self._metrics_t = 0.0
+        self.slides_shown = 0
+        self.slides_failed = 0
+        self.rescan_ms = 0.0
+
+        # systemd watchdog + stall detector (started with the main loop)
+        self.watchdog: Optional[LoopWatchdog] = None
+
+        # Profilers: cProfile windows (--profile) and SIGUSR1 sampling
+        profile_dir = os.path.join(os.path.abspath(cfg.data_dir), PROFILE_DIR_NAME)
+        self.profiler: Optional[LoopProfiler] = None
+        if cfg.profile_window_seconds > 0:
+            self.profiler = LoopProfiler(profile_dir, cfg.profile_window_seconds)
+        self.sampling_profiler = SamplingProfiler(profile_dir)
+
+        # Control API
+        self.control: Optional[ControlServer] = None
+        self._control_t = 0.0
+        self._last_command: Optional[dict] = None
 
         # Font config globals (used by load_font())
         AppFonts.font_file = self.cfg.font_file
@@ -736,6 +4811,7 @@ class PhotoFrameApp:
         os.makedirs(self.data_dir, exist_ok=True)
 
         self.state_path = os.path.join(self.data_dir, STATE_FILE_NAME)
+        self.cycle_path = os.path.join(self.data_dir, ORDER_FILE_NAME)
         self.favorites_dir = os.path.join(self.data_dir, FAVORITES_DIR_NAME)
         os.makedirs(self.favorites_dir, exist_ok=True)
 
@@ -744,8 +4820,11 @@ class PhotoFrameApp:
         AppPaths.font_file = self.cfg.font_file
         AppPaths.font_fallback_name = self.cfg.font_fallback_name
 
-        # Captions metadata cache (sidecar + folder name)
-        self.caption_cache: dict[str, tuple[str | None, str]] = {}
+        # Captions metadata cache (sidecar + folder name), by file_key
+        self.caption_cache: dict[int, tuple[str | None, str]] = {}
+        self.captions = CaptionIndex(self.photos_dir, os.path.join(self.data_dir, CAPTION_CATALOG_NAME))
+        self.embedded = EmbeddedCaptionIndex(self.data_dir, self.photos_dir, workers=self.cfg.caption_workers)
+        self._embedded_seen = 0
 
         # Runtime state
         self.running = True
@@ -772,13 +4851,48 @@ class PhotoFrameApp:
         # Slide timing
         self.last_advance_t = now_monotonic()
 
-        # Folder scan
-        self.files: List[str] = []
+        # Scrubbing (rapid prev/next): previews until the user settles
+        self._last_nav_t = 0.0
+        self._scrub_until = 0.0
+        self._last_img: Optional[pygame.Surface] = None
+
+        # Boot snapshot: last full slide, shown straight after set_mode
+        self.snapshot_path = os.path.join(self.data_dir, SNAPSHOT_NAME)
+        self._last_full: Optional[tuple[str, pygame.Surface]] = None
+        self._snapshot_of: Optional[str] = None
+        self._snapshot_t = now_monotonic()
+        self._boot_snapshot: Optional[tuple[str, pygame.Surface]] = None
+
+        # Folder scan (library = everything, playable = minus hidden duplicates)
+        self.library = MediaCatalog()
+        self.playable = self.library
         self.files_sig = (0, 0)
+        self.files_gen = 0
         self.last_rescan_t = 0.0
-
-        # Image cache (display-ready surfaces)
-        self.cache = ImageCache()
+        # Rescan walking on a thread: (thread, [result], reset) until adopted
+        self._rescan: Optional[tuple[threading.Thread, list, bool]] = None
+        self._rescan_requested = False      # Reload / "r": scan on the next frame
+        self._rescan_reset = False          # ... and start a fresh cycle with it
+
+        # Shuffle cycle persistence: what the on-disk cycle file currently holds
+        self._cycle_saved_version: Optional[int] = None
+        self._cycle_saved_gen = 0
+        self._cycle_saved_drawn = 0   # in-memory drawn count at last write
+        self._cycle_saved_count = 0   # entries in the file
+        self._cycle_saved_pos = -1
+        self._cycle_write_failed = False
+
+        # Debounced write-behind persistence (see persist_state/flush_state)
+        self.state_writer = StateWriter()
+        self._state_dirty_since: Optional[float] = None
+        self._state_last_written: Optional[dict] = None  # set by the writer on success
+        self._state_write_failed = False
+
+        # Image cache (display-ready surfaces), fed by the readahead buffer
+        # (the worker decoder reads files itself: only hint the kernel then)
+        self.readahead = Readahead(0 if self.cfg.decode_in_worker
+                                   else int(self.cfg.readahead_max_mb * 1024 * 1024))
+        self.cache = ImageCache(self.readahead if self.cfg.readahead_count > 0 else None)
 
         # Legacy cached image vars (keep if referenced elsewhere)
         self._cached_img_path = None
@@ -818,8 +4932,35 @@ class PhotoFrameApp:
         # Order manager
         self.order: Optional[OrderManager] = None
 
+        # View history log (what was shown when, for how long, skipped?)
+        self.history = ViewHistory(self.data_dir)
+        self._shown_path: Optional[str] = None
+        self._shown_t = 0.0
+        self._shown_epoch = 0.0
+        self._skip_pending = False
+
+        # Smart shuffle inputs: weights from view history, favorites and mtime
+        self.favorites = FavoritesIndex(self.favorites_dir, self.photos_dir,
+                                        os.path.join(self.data_dir, FAVORITES_INDEX_NAME))
+        self.sampler = WeightedSampler(self.order_weight, cooldown_ratio=self.cfg.weighted_cooldown_ratio)
+
+        # Content/perceptual hashes: collapse exact duplicates, space out bursts
+        self.hashes = MediaHashIndex(self.data_dir, self.photos_dir, workers=self.cfg.hash_workers,
+                                     near_distance=self.cfg.near_dup_distance)
+        self._hidden_applied = -1
+
+        # Grid browse view over the thumbnail atlas
+        self.thumb_store = ThumbnailStore(self.data_dir, self.photos_dir, workers=self.cfg.thumb_workers)
+        if self.cfg.thumbnails_enabled:
+            self.cache.atlas = self.thumb_store
+        self.grid_open = False
+        self.grid_page = 0
+        self._grid_surf: Optional[pygame.Surface] = None
+        self._grid_key: Optional[tuple] = None
+
         # Load persisted state (best effort)
         self.persisted = load_state(self.state_path)
+        self.startup.phase("init", self.startup.t0)
 
 
     def init_pygame(self) -> None:
@@ -830,6 +4971,7 @@ class PhotoFrameApp:
             except Exception:
                 pass
 
+        t = self.startup.now()
         pygame.init()
         if os.name == "nt":
             pygame.mouse.set_visible(True)
@@ -838,8 +4980,7 @@ class PhotoFrameApp:
 
 
         pygame.font.init()
-        if hasattr(self.cache, "_display_cache"):
-            self.cache._display_cache.clear()
+        self.cache.clear()
 
         flags = pygame.SCALED
 
@@ -857,6 +4998,18 @@ class PhotoFrameApp:
             flags = pygame.FULLSCREEN
             self.screen = pygame.display.set_mode(self.logical_size, flags)
             self.canvas = self.screen  # draw directly (no extra scaling cost)
+        self.startup.phase("set_mode", t)
+
+        t = self.startup.now()
+        self.show_snapshot()
+        self.startup.phase("snapshot", t)
+
+        t = self.startup.now()
+        if self.cfg.decode_in_worker and self.cache.decoder is None:
+            try:
+                self.cache.decoder = ProcessDecoder(self.screen.get_size())
+            except Exception:
+                self.cache.decoder = None
 
 
         # Force focus on Windows
@@ -869,6 +5022,222 @@ class PhotoFrameApp:
         self.font_small = load_font(20)
         self.button_font = load_font(self.button_font_size)
         pygame.mouse.set_visible(os.name == "nt")
+        self.startup.phase("fonts", t)
+
+    def show_snapshot(self) -> None:
+        """Put the last slide back on screen right after set_mode (cold start)."""
+        if self.persisted.get("sleeping") or not self.screen:
+            return
+        snap = load_snapshot(self.snapshot_path, self.screen.get_size())
+        if snap is None:
+            return
+        saved_brightness = self.persisted.get("user_brightness")
+        if isinstance(saved_brightness, (int, float)):
+            self.user_brightness = float(saved_brightness)
+        self.screen.blit(snap[1], (0, 0))
+        self.draw_dim_overlay()
+        pygame.display.flip()
+        self._boot_snapshot = snap
+        self._snapshot_of = snap[0]
+
+    def maybe_snapshot(self, force: bool = False) -> None:
+        """Refresh the boot snapshot when the slide changed (rarely; always on sleep and exit)."""
+        if self._last_full is None or self.sleeping:
+            return
+        path, img = self._last_full
+        if path == self._snapshot_of:
+            return
+        if not force and now_monotonic() - self._snapshot_t < SNAPSHOT_INTERVAL:
+            return
+        self._snapshot_of = path
+        self._snapshot_t = now_monotonic()
+        size = img.get_size()
+        pixels = pygame.image.tobytes(pygame.transform.smoothscale(img, snapshot_pixel_size(size)), DECODE_FORMAT)
+        self.state_writer.submit(lambda: save_snapshot(self.snapshot_path, path, size, pixels))
+
+    def toggle_timing(self) -> None:
+        """
+        Start a fresh timing window, or stop and print the current one
+        (metrics keep timing and their own totals either way).
+        """
+        if not self.timing.toggle():
+            print(self.timing.report(), file=sys.stderr, flush=True)
+        self._timing_report_t = now_monotonic()
+
+    def maybe_report_timing(self) -> None:
+        if not self.timing.reporting or self.cfg.frame_report_seconds <= 0:
+            return
+        if now_monotonic() - self._timing_report_t >= self.cfg.frame_report_seconds:
+            self._timing_report_t = now_monotonic()
+            print(self.timing.report(), file=sys.stderr, flush=True)
+
+    def start_metrics(self) -> None:
+        if self.cfg.metrics_port <= 0:
+            return
+        try:
+            self.metrics = MetricsServer(self.cfg.metrics_bind, self.cfg.metrics_port)
+        except OSError as e:
+            print(f"metrics: cannot listen on {self.cfg.metrics_bind}:{self.cfg.metrics_port}: {e}",
+                  file=sys.stderr, flush=True)
+            return
+        self.publish_metrics()
+
+    def publish_metrics(self) -> None:
+        """Copy the current counters into a snapshot for the metrics thread."""
+        self._metrics_t = now_monotonic()
+        decode = histogram_snapshot(self.cache.decode_ms)
+        cache_bytes = self.cache.nbytes() + self.readahead.nbytes
+        if self.cache.decoder is not None:
+            decode = merge_histogram_snapshots(decode, histogram_snapshot(self.cache.decoder.decode_ms))
+            cache_bytes += self.cache.decoder.nbytes
+        lookups = self.cache.hits + self.cache.misses
+        families = [
+            ("photoframe_frame_stage_seconds", "histogram", "Main loop time per stage (frame = whole frame).",
+             [(f'stage="{name}"', histogram_snapshot(h)) for name, h in self.timing.totals.items()]),
+            ("photoframe_frames_over_budget_total", "counter", "Frames slower than 1/target_fps.",
+             [("", self.timing.over_budget_total)]),
+            ("photoframe_decode_seconds", "histogram", "Decode + scale time per slide.", [("", decode)]),
+            ("photoframe_cache_lookups_total", "counter", "First lookups of a slide, by result.",
+             [('result="hit"', self.cache.hits), ('result="miss"', self.cache.misses)]),
+            ("photoframe_cache_hit_ratio", "gauge", "Share of slides that were ready when shown.",
+             [("", f"{self.cache.hits / lookups:.4f}" if lookups else "0")]),
+            ("photoframe_cache_bytes", "gauge", "Bytes held by decoded surfaces, readahead and decoder slots.",
+             [("", cache_bytes)]),
+            ("photoframe_library_files", "gauge", "Playable files in the library.", [("", len(self.playable))]),
+            ("photoframe_rescan_seconds", "gauge", "Duration of the last library scan.",
+             [("", f"{self.rescan_ms / 1000.0:.4f}")]),
+            ("photoframe_slides_shown_total", "counter", "Slides shown.", [("", self.slides_shown)]),
+            ("photoframe_slides_failed_total", "counter", "Slides skipped because they failed to load.",
+             [("", self.slides_failed)]),
+            ("photoframe_sleeping", "gauge", "1 while the frame is asleep.", [("", int(self.sleeping))]),
+            ("photoframe_stalls_total", "counter", "Frames stuck longer than stall_seconds.",
+             [("", self.watchdog.stalls if self.watchdog else 0)]),
+        ]
+        rss = read_rss_bytes()
+        if rss is not None:
+            families.append(("photoframe_resident_memory_bytes", "gauge", "Resident set size.", [("", rss)]))
+        self.metrics.publish(families)
+
+    def maybe_publish_metrics(self) -> None:
+        if self.metrics is not None and now_monotonic() - self._metrics_t >= METRICS_PUBLISH_SECONDS:
+            self.publish_metrics()
+
+    def start_control(self) -> None:
+        if not self.cfg.control_socket and self.cfg.control_port <= 0:
+            return
+        try:
+            self.control = ControlServer(self.cfg.control_socket, self.cfg.control_bind,
+                                         max(0, self.cfg.control_port))
+        except (OSError, AttributeError) as e:
+            print(f"control: cannot listen: {e}", file=sys.stderr, flush=True)
+            return
+        self.publish_status()
+
+    def publish_status(self) -> None:
+        """Snapshot of what the frame is doing, for GET /status."""
+        self._control_t = now_monotonic()
+        current = self.order.current() if self.order else None
+        self.control.publish({
+            "current": safe_relpath(current, self.photos_dir) if current else None,
+            "files": len(self.playable),
+            "paused": self.paused,
+            "sleeping": self.sleeping,
+            "shuffle": self.order.mode_label() if self.order else None,
+            "captions": self.caption_mode,
+            "brightness": round(float(self.user_brightness), 3),
+            "effective_brightness": round(self.effective_brightness(), 3),
+            "slide_seconds": self.cfg.slide_seconds,
+            "favorite": bool(current) and self.favorites.contains(current),
+            "grid_open": self.grid_open,
+            "slides_shown": self.slides_shown,
+            "last_command": self._last_command,
+        })
+
+    def maybe_publish_status(self) -> None:
+        if self.control is not None and now_monotonic() - self._control_t >= CONTROL_STATUS_SECONDS:
+            self.publish_status()
+
+    def handle_control(self, command: str, arg) -> None:
+        """Run a command from the control API (on the pygame loop)."""
+        ok = True
+        if command == "show":
+            ok = self.control_show(arg)
+        elif command == "brightness":
+            if arg is None:
+                self.cycle_brightness()
+            else:
+                self.user_brightness = float(arg)
+                self.persist_state()
+        elif command == "wake":
+            if self.sleeping:
+                self.wake_from_sleep()
+        elif command == "sleep":
+            if not self.sleeping:
+                self.go_to_sleep()
+        else:
+            self.do_action(command)
+        self._last_command = {"command": command, "arg": arg, "ok": ok, "at": time.time()}
+        if self.control is not None:
+            self.publish_status()
+
+    def control_show(self, path: str) -> bool:
+        if not self.order:
+            return False
+        if not os.path.isabs(path):
+            path = os.path.join(self.photos_dir, path)
+        path = os.path.normpath(path)
+        if path != self.order.current():
+            if not self.order.jump_to(path):
+                return False
+            self._skip_pending = True
+        if self.grid_open:
+            self.close_grid()
+        if self.sleeping:
+            self.wake_from_sleep()
+        self.last_advance_t = now_monotonic()
+        self.mark_caption_trigger()
+        self.persist_state()
+        return True
+
+    def start_loading(self) -> threading.Thread:
+        """Catalog load, state restore and order setup on a thread (overlaps set_mode/fonts)."""
+        self._load_error: Optional[BaseException] = None
+
+        def job() -> None:
+            t = self.startup.now()
+            try:
+                self.load_files_and_order()
+            except BaseException as e:
+                self._load_error = e
+            self.startup.phase("library", t)
+
+        loader = threading.Thread(target=job, name="startup-load", daemon=True)
+        loader.start()
+        return loader
+
+    def finish_loading(self, loader: threading.Thread) -> None:
+        """
+        Wait for start_loading() (keeping the window responsive), then adopt
+        the snapshot. READY=1 waits for the first slide, so while the scan
+        runs (minutes on a slow NAS) systemd's start timeout is extended.
+        """
+        t = self.startup.now()
+        extended = -START_EXTEND_SECONDS
+        while loader.is_alive():
+            pygame.event.pump()
+            loader.join(0.05)
+            if now_monotonic() - extended >= START_EXTEND_SECONDS / 2:
+                extended = now_monotonic()
+                sd_notify(f"EXTEND_TIMEOUT_USEC={int(START_EXTEND_SECONDS * 1e6)}\n"
+                          f"STATUS=loading library ({self.startup.now() - t:.0f}s)")
+        self.startup.phase("wait_library", t)
+        if self._load_error is not None:
+            raise self._load_error
+        snap, self._boot_snapshot = self._boot_snapshot, None
+        if snap and self.order and self.screen and self.order.current() == snap[0]:
+            # Same slide: the snapshot is its preview until the decode lands
+            self.cache.seed_preview(snap[0], self.screen.get_size(), snap[1])
+            self._last_img = snap[1]
 
     def map_pointer_pos(self, pos: tuple[int, int]) -> tuple[int, int]:
         if os.name != "nt":
@@ -939,21 +5308,55 @@ class PhotoFrameApp:
             self._button_label_font_size = self.button_font_size
             self.button_font = load_font(self.button_font_size)
 
-        assert self.button_font is not None
-
         surf = self._button_label_cache.get(label)
         if surf is not None:
             return surf
 
+        if self.button_font is None:
+            self.button_font = load_font(self.button_font_size)
+
         surf = self.button_font.render(label, True, (255, 255, 255))
         self._button_label_cache[label] = surf
         return surf
 
+    def load_button_assets(self, sw: int, sh: int) -> List[Button]:
+        """
+        Bottom bar buttons, font size and rendered labels. Taken from the UI
+        bundle when font, screen size and UI settings are unchanged; otherwise
+        computed as before and the bundle rewritten.
+        """
+        labels = fixed_button_labels(self.cfg)
+        key = ui_bundle_key((sw, sh), self.cfg, labels)
+        path = os.path.join(self.data_dir, UI_BUNDLE_NAME)
+        bundle = load_ui_bundle(path, key)
+        if bundle is not None:
+            self.button_font_size, buttons, glyphs = bundle
+            self._button_label_cache = glyphs
+            self._button_label_font_size = self.button_font_size
+            self.button_font = None   # loaded on the first label not in the bundle
+            return buttons
+
+        buttons = make_buttons(sw, sh, self.cfg)
+
+        # Compute once using worst-case labels so dynamic labels never overflow
+        self.button_font_size = compute_button_font_size(
+            worst_case_button_labels(),
+            buttons[0].rect.width,
+            buttons[0].rect.height,
+            padding=12,
+            safety_px=2,
+            min_size=12
+        )
+        glyphs = {label: self._get_button_text_surface(label) for label in labels}
+        save_ui_bundle(path, key, self.button_font_size, buttons, glyphs)
+        return buttons
+
     def get_current_image_surface(self, path: str):
         if path == self._cached_img_path and self._cached_img_surf is not None:
             return self._cached_img_surf
 
         surf = pygame.image.load(path)
+        surf = apply_exif_orientation(surf, self.cache.orientation_for(path))
         # convert to display format (much faster blits)
         surf = surf.convert()
 
@@ -985,6 +5388,7 @@ class PhotoFrameApp:
         SWIPE_TIME = 0.6     # seconds
 
         if abs(dx) > SWIPE_DIST and abs(dx) > abs(dy) and dt < SWIPE_TIME:
+            self._skip_pending = True
             if dx > 0:
                 self.action_prev()
             else:
@@ -1103,25 +5507,111 @@ class PhotoFrameApp:
         return
 
     def get_captions_for(self, image_path: str) -> Tuple[Optional[str], str]:
-        if image_path in self.caption_cache:
-            return self.caption_cache[image_path]
+        key = file_key(image_path, self.photos_dir)
+        cached = self.caption_cache.get(key)
+        if cached is not None:
+            return cached
 
-        cap = sidecar_caption_txt(image_path)          # still looks for photo.txt next to photo.jpg
-        fld = folder_caption(image_path, self.photos_dir)
+        # .txt sidecar, else folder manifest, else embedded description
+        cap = self.captions.caption_for(image_path)
+        if cap is None and self.cfg.embedded_captions_enabled:
+            cap = self.embedded.caption_for(image_path)
+        fld = self.library.folder_label(image_path, self.photos_dir)
 
-        self.caption_cache[image_path] = (cap, fld)
+        self.caption_cache[key] = (cap, fld)
         return cap, fld
 
     def mark_caption_trigger(self) -> None:
         """Restart caption fade timing (used in FADE mode)."""
         self.image_shown_t = now_monotonic()
 
+    def set_library(self, catalog: MediaCatalog) -> None:
+        """Adopt a freshly scanned catalog and what is derived from it."""
+        self.library = catalog
+        self.files_sig = catalog.signature()
+        if self.cfg.dedupe_enabled:
+            self.hashes.update(catalog, catalog.mtimes)
+        if self.cfg.thumbnails_enabled:
+            self.thumb_store.update(catalog, catalog.mtimes)
+        if self.cfg.embedded_captions_enabled:
+            self.embedded.update(catalog, catalog.mtimes)
+        self.apply_duplicates()
+
+    def apply_duplicates(self) -> None:
+        """Derive the playable catalog: the library minus hidden exact duplicates."""
+        hidden = self.hashes.hidden if self.cfg.dedupe_enabled else frozenset()
+        self._hidden_applied = self.hashes.hidden_version
+        ids = [fid for fid in map(self.library.id_of, hidden) if fid is not None]
+        if ids:
+            keep = bytearray(b"\x01") * len(self.library)
+            for fid in ids:
+                keep[fid] = 0
+            self.playable = self.library.subset(keep)
+        else:
+            self.playable = self.library
+        self.files_gen = self.playable.generation()
+
+    def poll_embedded_captions(self) -> None:
+        """Drop cached caption renders once the background extractor found new text."""
+        if self._embedded_seen == self.embedded.version:
+            return
+        self._embedded_seen = self.embedded.version
+        self.caption_cache.clear()
+        self._cap_cache_path = None
+
+    def poll_duplicates(self) -> None:
+        """Pick up a new duplicate set from the hash indexer (cheap when unchanged)."""
+        if self._hidden_applied == self.hashes.hidden_version or not self.cfg.dedupe_enabled:
+            return
+        current = self.order.current() if self.order else None
+        self.apply_duplicates()
+        if self.order:
+            self.order.set_files(self.playable, current_path=current)
+
+    def scan_library(self) -> None:
+        t0 = time.perf_counter()
+        caption_files: List[str] = []
+        catalog = scan_media_catalog(self.photos_dir, caption_files)
+        self.update_captions(caption_files)
+        self.set_library(catalog)
+        self.rescan_ms = (time.perf_counter() - t0) * 1000.0
+
+    def update_captions(self, caption_files: List[str]) -> None:
+        """Refresh the caption catalog; only changed captions drop cached renders."""
+        if not self.captions.update(caption_files):
+            return
+        self.caption_cache.clear()
+        self._cap_cache_path = None
+        self.state_writer.submit(functools.partial(save_state, self.captions.catalog_path,
+                                                   self.captions.to_json()))
+
+    def order_weight(self, path: str, mtime: float) -> float:
+        """Base weight for Smart shuffle: favorites, rarely shown and new files win."""
+        shows, skips, _, _ = self.history.stats(file_key(path, self.photos_dir))
+        w = 1.0 / math.sqrt(1 + shows)
+        if shows:
+            w *= 1.0 - 0.5 * min(1.0, skips / shows)   # often swiped away: less often
+        if self.favorites.contains(path):
+            w *= self.cfg.weight_favorite
+        if mtime and (time.time() - mtime) < self.cfg.weight_recent_days * 86400:
+            w *= self.cfg.weight_recent
+        return w
+
     def load_files_and_order(self) -> None:
-        self.files = list_media_files(self.photos_dir)
-        self.files_sig = file_signature(self.files)
+        self.history.open()
+        self.captions.load()
+        if self.cfg.embedded_captions_enabled:
+            self.embedded.load()
+        if self.cfg.dedupe_enabled:
+            self.hashes.load()
+        if self.cfg.thumbnails_enabled:
+            self.thumb_store.load()
+        self.scan_library()
+        self.favorites.load(self.library)
 
         # Determine start conditions from state
         shuffle = bool(self.persisted.get("shuffle", False))
+        weighted = self.persisted.get("order_mode") == "weighted"
         self.paused = bool(self.persisted.get("paused", False))
         self.sleeping = bool(self.persisted.get("sleeping", False))
         self.captions_on = bool(self.persisted.get("captions_on", self.cfg.captions_default_on))
@@ -1137,55 +5627,99 @@ class PhotoFrameApp:
             self.user_brightness = float(self.cfg.brightness_default)
 
         last_path = self.persisted.get("current_path")
-        if last_path and isinstance(last_path, str):
-            # stored as absolute in previous run; ensure it still exists in list
-            if last_path not in self.files:
-                last_path = None
+        if not isinstance(last_path, str):
+            # stored as absolute in previous run; OrderManager ignores unknown paths
+            last_path = None
         self.caption_mode = str(self.persisted.get("caption_mode", self.cfg.caption_mode_default)).lower()
         if self.caption_mode not in ("off", "on", "fade"):
             self.caption_mode = self.cfg.caption_mode_default
 
 
-        self.order = OrderManager(self.files, shuffle=shuffle, start_path=last_path)
+        self.order = OrderManager(self.playable, shuffle=shuffle, start_path=last_path,
+                                  sampler=self.sampler, weighted=weighted)
+        if self.cfg.dedupe_enabled:
+            self.order.near_duplicate = self.hashes.too_similar
+            self.order.near_dup_window = self.cfg.near_dup_window
+        if shuffle and not weighted:
+            self.resume_cycle()
 
     def action_reload_reset(self) -> None:
-        """Reload folder file list, and start a fresh cycle (allow repeats again)."""
-        current = self.order.current() if self.order else None
-
-        self.files = list_media_files(self.photos_dir)
-        self.files_sig = file_signature(self.files)
+        """
+        Reload folder file list, and start a fresh cycle (allow repeats
+        again). The scan runs on the rescan thread; finish_reload() resets
+        the cycle once it has been adopted.
+        """
+        self.request_rescan(reset=True)
+        self.show_overlay()
 
-        if hasattr(self.cache, "_display_cache"):
-            self.cache._display_cache.clear()
+    def request_rescan(self, reset: bool = False) -> None:
+        """Rescan on the next frame (after a scan already running has landed)."""
+        self._rescan_requested = True
+        self._rescan_reset = self._rescan_reset or reset
 
+    def finish_reload(self) -> None:
+        """Second half of action_reload_reset(), after its scan was adopted."""
+        current = self.order.current() if self.order else None
+        self.cache.clear()
+        self.cache.orientations.clear()
         if self.order:
-            self.order.set_files(self.files, current_path=current)
             # Fresh cycle: this is what allows repeats again immediately
             self.order.reset_cycle(start_path=current)
         self.mark_caption_trigger()
         self.caption_cache.clear()
         self.last_advance_t = now_monotonic()
-        self.show_overlay()
         self.persist_state()
 
-
     def rescan_if_needed(self) -> None:
+        """
+        Periodic and requested rescans. The directory walk (minutes on a
+        slow NAS) runs on a thread so the main loop keeps drawing and
+        pinging the watchdog; its result is adopted here on a later frame.
+        """
+        if self._rescan is not None:
+            scan, result, reset = self._rescan
+            if scan.is_alive():
+                return
+            self._rescan = None
+            if result:
+                self.apply_rescan(*result)
+            if reset:
+                self.finish_reload()
+            return
         t = now_monotonic()
-        if (t - self.last_rescan_t) < self.cfg.rescan_interval_sec:
+        if not self._rescan_requested and (t - self.last_rescan_t) < self.cfg.rescan_interval_sec:
             return
         self.last_rescan_t = t
+        reset = self._rescan_reset
+        self._rescan_requested = self._rescan_reset = False
+        result: list = []
+
+        def job() -> None:
+            t0 = time.perf_counter()
+            caption_files: List[str] = []
+            try:
+                catalog = scan_media_catalog(self.photos_dir, caption_files)
+                sig = catalog.signature()
+            except Exception as e:
+                print(f"rescan failed: {e}", file=sys.stderr, flush=True)
+                return
+            result.extend((catalog, sig, caption_files, (time.perf_counter() - t0) * 1000.0))
 
-        new_files = list_media_files(self.photos_dir)
-        new_sig = file_signature(new_files)
-        if new_sig == self.files_sig:
+        scan = threading.Thread(target=job, name="rescan", daemon=True)
+        scan.start()
+        self._rescan = (scan, result, reset)
+
+    def apply_rescan(self, catalog: MediaCatalog, sig: Tuple[int, int], caption_files: List[str], ms: float) -> None:
+        """Adopt a background rescan (main thread)."""
+        self.update_captions(caption_files)
+        self.rescan_ms = ms
+        if sig == self.files_sig:
             return
 
-        self.caption_cache.clear()
         current = self.order.current() if self.order else None
-        self.files = new_files
-        self.files_sig = new_sig
+        self.set_library(catalog)
         if self.order:
-            self.order.set_files(self.files, current_path=current)
+            self.order.set_files(self.playable, current_path=current)
 
         # If folder became empty, wake overlay to show message
         self.show_overlay()
@@ -1213,10 +5747,16 @@ class PhotoFrameApp:
         self.persist_state()
 
     def go_to_sleep(self) -> None:
+        # Close the view that was running; after waking the slide counts again
+        self.finish_slide_view()
+        if self.grid_open:
+            self.close_grid()
+        self.maybe_snapshot(force=True)
+        self.last_drawn_path = None
         self.sleeping = True
         self.overlay_visible = False
         pygame.mouse.set_visible(False)
-        self.persist_state()
+        self.flush_state()
 
     def toggle_pause(self) -> None:
         self.paused = not self.paused
@@ -1224,25 +5764,117 @@ class PhotoFrameApp:
         self.persist_state()
 
     def persist_state(self) -> None:
+        """
+        Mark state dirty. It is written by flush_state() on a timer
+        (cfg.state_flush_seconds), on sleep and on exit.
+        """
+        if self._state_dirty_since is None:
+            self._state_dirty_since = now_monotonic()
+
+    def maybe_flush_state(self) -> None:
+        if self._state_write_failed:
+            # A background write failed (disk full, read-only remount): retry later
+            self._state_write_failed = False
+            self.persist_state()
+        since = self._state_dirty_since
+        if since is not None and (now_monotonic() - since) >= self.cfg.state_flush_seconds:
+            self.flush_state()
+
+    def flush_state(self) -> None:
+        """Snapshot state on this thread; the StateWriter does the file I/O."""
+        self._state_dirty_since = None
         if not self.order:
             return
         state = {
             "shuffle": bool(self.order.shuffle),
+            "order_mode": "weighted" if self.order.weighted else ("shuffle" if self.order.shuffle else "sequential"),
             "paused": bool(self.paused),
             "sleeping": bool(self.sleeping),
             "current_path": self.order.current(),
-            "saved_at_epoch": int(time.time()),
             "captions_on": bool(self.captions_on),
             "caption_mode": self.caption_mode,
             "slide_seconds": float(self.cfg.slide_seconds),
             "user_brightness": float(self.user_brightness),
         }
-        save_state(self.state_path, state)
+        # Dirty check: skip identical writes (timestamp excluded)
+        if state != self._state_last_written:
+            self.state_writer.submit(functools.partial(self._write_state, state))
+        self.persist_cycle()
+
+    def _write_state(self, state: dict) -> None:
+        """Runs on the StateWriter thread."""
+        if save_state(self.state_path, dict(state, saved_at_epoch=int(time.time()))):
+            self._state_last_written = state
+        else:
+            self._state_write_failed = True
+
+    def persist_cycle(self) -> None:
+        """
+        Save the shuffle cycle: a full write only when the bag was rebuilt or
+        merged, otherwise append the newly drawn entries and update the
+        position in place.
+        """
+        order = self.order
+        if not order or not order.shuffle or order.weighted:
+            return
+        if self._cycle_write_failed:
+            # A background write failed: the file is unknown, rewrite it
+            self._cycle_write_failed = False
+            self._cycle_saved_version = None
+        drawn = order.drawn_count()
+        pos = order.cycle_position()
+        if order.bag_version != self._cycle_saved_version or self.files_gen != self._cycle_saved_gen:
+            ranks, count, pos = order.export_cycle()
+            path, gen = self.cycle_path, self.files_gen
+            self.state_writer.submit(functools.partial(
+                self._write_cycle, lambda: save_cycle(path, gen, ranks(), pos)))
+        elif drawn != self._cycle_saved_drawn or pos != self._cycle_saved_pos:
+            new = order.cycle_ranks(self._cycle_saved_drawn, drawn)
+            self.state_writer.submit(functools.partial(
+                self._write_cycle, append_cycle, self.cycle_path, self.files_gen,
+                self._cycle_saved_count, new, pos))
+            count = self._cycle_saved_count + len(new)
+        else:
+            return
+        self._cycle_saved_version = order.bag_version
+        self._cycle_saved_gen = self.files_gen
+        self._cycle_saved_drawn = drawn
+        self._cycle_saved_count = count
+        self._cycle_saved_pos = pos
+
+    def _write_cycle(self, fn, *args) -> None:
+        """Runs on the StateWriter thread."""
+        if not fn(*args):
+            self._cycle_write_failed = True
+
+    def resume_cycle(self) -> None:
+        """Restore the saved shuffle cycle if it belongs to this file list."""
+        order = self.order
+        saved = load_cycle(self.cycle_path)
+        if not order or saved is None:
+            return
+        generation, ranks, pos = saved
+        if generation != self.files_gen or not order.restore_cycle(ranks, pos):
+            return
+        # The file on disk matches memory exactly; next persist only appends
+        self._cycle_saved_version = order.bag_version
+        self._cycle_saved_gen = generation
+        self._cycle_saved_drawn = order.drawn_count()
+        self._cycle_saved_count = len(ranks)
+        self._cycle_saved_pos = pos
+
+    def note_navigation(self) -> None:
+        """A second prev/next within SCRUB_WINDOW starts (or extends) scrubbing."""
+        t = now_monotonic()
+        if t - self._last_nav_t < SCRUB_WINDOW:
+            self._scrub_until = t + SCRUB_WINDOW
+        self._last_nav_t = t
 
     def action_prev(self) -> None:
         if not self.order:
             return
         self.order.prev()
+        self.note_navigation()
         self.last_advance_t = now_monotonic()
         self.mark_caption_trigger()
         self.persist_state()
@@ -1251,9 +5883,10 @@ class PhotoFrameApp:
         if not self.order:
             return
         self.order.next()
+        self.note_navigation()
         self.last_advance_t = now_monotonic()
         self.mark_caption_trigger()
-        if self.screen and self.captions_on:
+        if self.screen and self.captions_on and now_monotonic() >= self._scrub_until:
             cur = self.order.current()
             if cur:
                 self.rebuild_captions_cache(cur)
@@ -1270,12 +5903,44 @@ class PhotoFrameApp:
         self.order.toggle_shuffle(current_path=current)
         self.persist_state()
 
+    def on_slide_shown(self, path: str) -> None:
+        """
+        First visible frame of a new slide (preview or full): log the one
+        being left, start timing this one and its caption fade.
+        """
+        self.last_drawn_path = path
+        self.slides_shown += 1
+        self.mark_caption_trigger()
+        self.finish_slide_view()
+        self._shown_path = path
+        self._shown_t = now_monotonic()
+        self._shown_epoch = time.time()
+        if self.order and self.screen:
+            upcoming = self.order.upcoming(max(1, self.cfg.readahead_count))
+            if self.cfg.readahead_count > 0:
+                self.readahead.want(upcoming)
+            if upcoming:
+                self.cache.prefetch(upcoming[0], self.screen.get_size())
+
+    def finish_slide_view(self) -> None:
+        """Append the current slide's view (dwell, skipped?) to the history log."""
+        path = self._shown_path
+        skipped = self._skip_pending
+        self._shown_path = None
+        self._skip_pending = False
+        if not path:
+            return
+        dwell = now_monotonic() - self._shown_t
+        self.history.record(file_key(path, self.photos_dir), self._shown_epoch, dwell, skipped)
+        if self.history.log_records >= self.cfg.history_compact_records:
+            self.history.compact()
+
     def action_favorite(self) -> None:
         if not self.order:
             return
         current = self.order.current()
-        if current:
-            copy_to_favorites(self.favorites_dir, current)
+        if current and self.favorites.add(current):
+            self.order.refresh_weight(current)
         # show overlay feedback and persist
         self.persist_state()
 
@@ -1306,6 +5971,8 @@ class PhotoFrameApp:
             self.action_favorite()
         elif action == "reload_reset":
             self.action_reload_reset()
+        elif action == "browse":
+            self.open_grid()
         elif action == "toggle_interval":
             self.action_toggle_interval()
         elif action == "toggle_brightness":
@@ -1346,8 +6013,13 @@ class PhotoFrameApp:
             self.wake_from_sleep()
             return
 
+        if self.grid_open:
+            self.handle_grid_pointer_up(pos, dx, dy, dt)
+            return
+
         # Swipe detection (horizontal)
         if dt <= self.cfg.swipe_max_dt and abs(dx) >= self.cfg.swipe_min_dx and abs(dx) > abs(dy):
+            self._skip_pending = True
             if dx < 0:
                 self.action_next()  # swipe left -> next
             else:
@@ -1376,7 +6048,7 @@ class PhotoFrameApp:
         self.overlay_last_interaction = now_monotonic()
 
     def maybe_auto_advance(self) -> None:
-        if self.sleeping or self.paused or not self.order:
+        if self.sleeping or self.paused or self.grid_open or not self.order:
             return
         t = now_monotonic()
         if (t - self.last_advance_t) >= self.cfg.slide_seconds:
@@ -1472,17 +6144,24 @@ class PhotoFrameApp:
         if self._overlay_bar_surf is not None:
             self.screen.blit(self._overlay_bar_surf, (0, sh - overlay_h))
 
+        # Favorite state of the current photo (in-memory set lookup)
+        faved = bool(self.order) and self.favorites.contains(self.order.current())
+
         # Draw buttons
         for b in buttons:
-            pygame.draw.rect(self.screen, (30, 30, 30), b.rect, border_radius=12)
-            pygame.draw.rect(self.screen, (200, 200, 200), b.rect, width=2, border_radius=12)
+            if b.action == "favorite" and faved:
+                pygame.draw.rect(self.screen, (90, 70, 10), b.rect, border_radius=12)
+                pygame.draw.rect(self.screen, (255, 200, 40), b.rect, width=2, border_radius=12)
+            else:
+                pygame.draw.rect(self.screen, (30, 30, 30), b.rect, border_radius=12)
+                pygame.draw.rect(self.screen, (200, 200, 200), b.rect, width=2, border_radius=12)
 
             # Dynamic labels
             label = b.label
             if b.action == "toggle_pause":
                 label = "Play" if self.paused else "Pause"
             elif b.action == "toggle_shuffle" and self.order:
-                label = "Shuffle: On" if self.order.shuffle else "Shuffle: Off"
+                label = f"Shuffle: {self.order.mode_label()}"
             elif b.action == "toggle_captions":
                 label = f"Captions: {self.caption_mode.upper()}"
             elif b.action == "toggle_interval":
@@ -1499,6 +6178,129 @@ class PhotoFrameApp:
 
 
 
+    # ---- grid browse ----
+    def grid_page_count(self) -> int:
+        return max(1, -(-len(self.playable) // GRID_PER_PAGE))
+
+    def open_grid(self) -> None:
+        """Show the grid, on the page holding the current slide."""
+        fid = self.order.current_id() if self.order else None
+        rank = self.playable.rank_of[fid] if fid is not None else 0
+        self.grid_page = rank // GRID_PER_PAGE
+        self.grid_open = True
+        self.overlay_visible = False
+        self._grid_key = None
+
+    def close_grid(self) -> None:
+        self.grid_open = False
+        self._grid_surf = None
+        self._grid_key = None
+        self.last_advance_t = now_monotonic()
+
+    def grid_turn(self, delta: int) -> None:
+        self.grid_page = clamp(self.grid_page + delta, 0, self.grid_page_count() - 1)
+
+    def grid_cell_rect(self, i: int) -> pygame.Rect:
+        assert self.screen
+        sw, sh = self.screen.get_size()
+        cw, ch = sw // GRID_COLS, (sh - GRID_FOOTER_H) // GRID_ROWS
+        return pygame.Rect((i % GRID_COLS) * cw, (i // GRID_COLS) * ch, cw, ch)
+
+    def build_grid_page(self) -> pygame.Surface:
+        """
+        Compose one page: each cell is an area blit from an atlas sheet.
+        Cells without a thumbnail yet get a placeholder and are asked for.
+        """
+        assert self.screen and self.font
+        sw, sh = self.screen.get_size()
+        page = pygame.Surface((sw, sh)).convert()
+        page.fill((12, 12, 12))
+        cat = self.playable
+        current = self.order.current_id() if self.order else None
+        store = self.thumb_store
+        missing: List[str] = []
+        start = self.grid_page * GRID_PER_PAGE
+        for i in range(min(GRID_PER_PAGE, len(cat) - start)):
+            fid = cat.sorted_ids[start + i]
+            path = cat.path(fid)
+            cell = self.grid_cell_rect(i)
+            box = pygame.Rect(0, 0, min(THUMB_W, cell.w - 8), min(THUMB_H, cell.h - 8))
+            box.center = cell.center
+            slot = store.slot_for(path)
+            sheet = store.sheet(slot // ATLAS_PER_SHEET) if slot is not None else None
+            if sheet is not None:
+                area = store.cell_rect(slot)
+                area.x += (THUMB_W - box.w) // 2
+                area.y += (THUMB_H - box.h) // 2
+                area.size = box.size
+                page.blit(sheet, box, area)
+            else:
+                pygame.draw.rect(page, (40, 40, 40), box)
+                if slot is None:
+                    missing.append(path)
+            if fid == current:
+                pygame.draw.rect(page, (255, 200, 40), box.inflate(6, 6), width=3)
+        store.want(missing)
+
+        footer = pygame.Rect(0, sh - GRID_FOOTER_H, sw, GRID_FOOTER_H)
+        for text, x in (("‹ Prev", sw // 8),
+                        (f"Page {self.grid_page + 1} / {self.grid_page_count()}  ·  tap here to close", sw // 2),
+                        ("Next ›", sw * 7 // 8)):
+            label = self.font.render(text, True, (220, 220, 220))
+            page.blit(label, label.get_rect(center=(x, footer.centery)))
+        return page
+
+    def draw_grid(self) -> None:
+        assert self.screen
+        key = (self.grid_page, self.thumb_store.version, self.files_gen,
+               self.order.current_id() if self.order else None, self.screen.get_size())
+        if key != self._grid_key or self._grid_surf is None:
+            self._grid_surf = self.build_grid_page()
+            self._grid_key = key
+        self.screen.blit(self._grid_surf, (0, 0))
+
+    def handle_grid_pointer_up(self, pos: Tuple[int, int], dx: int, dy: int, dt: float) -> None:
+        """Grid input: swipe turns the page, a cell jumps to that photo, the footer pages/closes."""
+        assert self.screen
+        sw, sh = self.screen.get_size()
+        if dt <= self.cfg.swipe_max_dt and max(abs(dx), abs(dy)) >= self.cfg.swipe_min_dx:
+            delta = dx if abs(dx) > abs(dy) else dy
+            self.grid_turn(1 if delta < 0 else -1)
+            return
+        if self.moved:
+            return
+        if pos[1] >= sh - GRID_FOOTER_H:
+            if pos[0] < sw // 4:
+                self.grid_turn(-1)
+            elif pos[0] >= sw * 3 // 4:
+                self.grid_turn(1)
+            else:
+                self.close_grid()
+            return
+        for i in range(GRID_PER_PAGE):
+            if self.grid_cell_rect(i).collidepoint(pos):
+                rank = self.grid_page * GRID_PER_PAGE + i
+                if rank < len(self.playable) and self.order:
+                    path = self.playable.at_rank(rank)
+                    if path != self.order.current():
+                        self._skip_pending = True
+                    self.order.jump_to(path)
+                    self.mark_caption_trigger()
+                    self.persist_state()
+                self.close_grid()
+                return
+
+    def handle_grid_key(self, key: int) -> bool:
+        if key in (pygame.K_ESCAPE, pygame.K_g):
+            self.close_grid()
+        elif key in (pygame.K_RIGHT, pygame.K_PAGEDOWN):
+            self.grid_turn(1)
+        elif key in (pygame.K_LEFT, pygame.K_PAGEUP):
+            self.grid_turn(-1)
+        else:
+            return False
+        return True
+
     def draw_frame(self) -> None:
         assert self.screen and self.order
 
@@ -1507,6 +6309,10 @@ class PhotoFrameApp:
             self.screen.fill((0, 0, 0))
             return
 
+        if self.grid_open:
+            self.draw_grid()
+            return
+
         current = self.order.current()
         if not current:
             # No images
@@ -1516,14 +6322,37 @@ class PhotoFrameApp:
             self.screen.blit(msg, (30, 30))
             return
 
-        # Load a display-ready (converted+scaled) surface ONCE per image
+        # Load a display-ready (converted+scaled) surface ONCE per image.
+        # Not decoded yet: show a low-res preview and swap the full surface
+        # in when the background decode lands. While scrubbing never wait,
+        # and the previews passed over don't count as shown.
         target_size = self.screen.get_size()
-        img = self.cache.load_for_display(current, target_size)
+        scrubbing = now_monotonic() < self._scrub_until
+        progressive = scrubbing or self.cfg.progressive_display
+        img = self.cache.load_for_display(current, target_size, wait=not progressive)
+        if img is None and scrubbing:
+            preview = self.cache.preview(current, target_size) or self._last_img
+            if preview is not None:
+                self.screen.blit(preview, (0, 0))
+            else:
+                self.screen.fill((0, 0, 0))
+            self.draw_dim_overlay()
+            self.draw_clock()
+            return
+        is_preview = False
+        if img is None and progressive and self.cache.pending(current, target_size):
+            img = self.cache.preview(current, target_size)
+            is_preview = img is not None
+            if img is None:
+                # Nothing to show early: wait for the decode as before
+                img = self.cache.load_for_display(current, target_size)
+        self.timing.lap("decode")
         if img is None:
             self.screen.fill((0, 0, 0))
             assert self.font
             msg = self.font.render("Failed to load image. Skipping…", True, (255, 200, 200))
             self.screen.blit(msg, (30, 30))
+            self.slides_failed += 1
 
             # Skip it next tick (do minimal work in draw)
             self.order.next()
@@ -1534,14 +6363,23 @@ class PhotoFrameApp:
 
         # Full-screen blit (fast)
         self.screen.blit(img, (0, 0))
+        self._last_img = img
+        if not is_preview:
+            self._last_full = (current, img)
+        if current != self.last_drawn_path:
+            self.on_slide_shown(current)
+        self.timing.lap("blit")
 
         self.draw_dim_overlay()
+        self.timing.lap("dim")
         self.draw_clock()
+        self.timing.lap("clock")
 
         # If you want indicator tied to captions toggle, do this:
         if self.captions_on:
             self.draw_indicator()
             self.draw_captions(current)
+            self.timing.lap("captions")
         else:
             # If you truly want indicator always, keep your old behavior:
             # self.draw_indicator()
@@ -1586,9 +6424,10 @@ class PhotoFrameApp:
 
 
     def run(self) -> None:
+        loader = self.start_loading()
         self.init_pygame()
-        self.load_files_and_order()
         assert self.screen
+        t = self.startup.now()
 
         clock = pygame.time.Clock()
         TARGET_FPS = 20  # good for Pi 1; try 20–30
@@ -1596,29 +6435,39 @@ class PhotoFrameApp:
         overlay_h = self.cfg.button_height + self.cfg.ui_padding * 2
         y = sh - overlay_h + self.cfg.ui_padding
 
-        buttons = make_buttons(sw, sh, self.cfg)
-
-
-        # Compute once using worst-case labels so dynamic labels never overflow
-        labels = worst_case_button_labels()
-        self.button_font_size = compute_button_font_size(
-            labels,
-            buttons[0].rect.width,
-            buttons[0].rect.height,
-            padding=12,
-            safety_px=2,
-            min_size=12
-        )
+        buttons = self.load_button_assets(sw, sh)
+        self.startup.phase("buttons", t)
+        self.finish_loading(loader)
+        self.start_metrics()
+        self.start_control()
+        self.watchdog = LoopWatchdog(self.cfg.stall_seconds, self.timing.running)
+        self.sampling_profiler.install()
+        if self.profiler is not None:
+            self.profiler.start()
+        first_frame = self.startup.now()
 
 
 
         # Main loop
         while self.running:
+            self.watchdog.beat()
+            if self.profiler is not None:
+                self.profiler.tick()
+            self.timing.begin()
             self.rescan_if_needed()
+            self.timing.lap("rescan")
+            self.poll_duplicates()
+            self.poll_embedded_captions()
+            self.maybe_flush_state()
+            self.maybe_snapshot()
             self.maybe_auto_sleep()
             self.maybe_auto_advance()
             self.hide_overlay_if_timed_out()
+            self.maybe_report_timing()
+            self.maybe_publish_metrics()
+            self.maybe_publish_status()
             pygame.event.pump()
+            self.timing.lap("upkeep")
 
             # Events
             for event in pygame.event.get():
@@ -1629,9 +6478,15 @@ class PhotoFrameApp:
 
                 if event.type == pygame.QUIT:
                     self.running = False
+                elif event.type == CONTROL_EVENT:
+                    self.handle_control(event.command, event.arg)
                 elif event.type == pygame.KEYDOWN:
                     # Useful while developing on PC
-                    if event.key == pygame.K_ESCAPE:
+                    if self.grid_open and self.handle_grid_key(event.key):
+                        pass
+                    elif event.key == pygame.K_g:
+                        self.open_grid()
+                    elif event.key == pygame.K_ESCAPE:
                         self.running = False
                     elif event.key == pygame.K_SPACE:
                         self.toggle_pause()
@@ -1649,11 +6504,7 @@ class PhotoFrameApp:
                             self.go_to_sleep()
                     elif event.key == pygame.K_r:
                         # manual rescan
-                        self.files = list_media_files(self.photos_dir)
-                        self.files_sig = file_signature(self.files)
-                        cur = self.order.current() if self.order else None
-                        if self.order:
-                            self.order.set_files(self.files, current_path=cur)
+                        self.request_rescan()
                         self.show_overlay()
                     elif event.key == pygame.K_f:
                         self.action_favorite()
@@ -1662,6 +6513,8 @@ class PhotoFrameApp:
                         # toggle shuffle
                         self.action_toggle_shuffle()
                         self.show_overlay()
+                    elif event.key == pygame.K_t:
+                        self.toggle_timing()
                 elif event.type == pygame.MOUSEBUTTONDOWN:
                     #print("DOWN event:", event.pos, "sleeping:", self.sleeping, "overlay_visible:", self.overlay_visible)
                     p = self.map_pointer_pos(event.pos)
@@ -1679,22 +6532,67 @@ class PhotoFrameApp:
 
 
 
+            self.timing.lap("events")
+
             # Render
             self.draw_frame()
             self.apply_brightness()
-            if self.overlay_visible and not self.sleeping:
+            self.timing.lap("draw")
+            if self.overlay_visible and not self.sleeping and not self.grid_open:
                 # recreate buttons if resolution changed (rare)
                 if buttons and (buttons[0].rect.bottom > self.screen.get_height() or buttons[0].rect.right > self.screen.get_width()):
                     buttons = make_buttons(sw, sh, self.cfg)
                 self.draw_overlay(buttons)
+                self.timing.lap("overlay")
 
             pygame.display.flip()
+            self.timing.lap("flip")
+            self.timing.end()
+            if first_frame:
+                self.startup.phase("first_frame", first_frame)
+                first_frame = 0.0
+                print(self.startup.summary(), file=sys.stderr, flush=True)
+                sd_notify("READY=1\nSTATUS=running")
             clock.tick(self.cfg.target_fps)
 
         # persist on exit
-        self.persist_state()
+        if self.profiler is not None:
+            self.profiler.dump()
+        self.sampling_profiler.stop()
+        if self.timing.reporting:
+            print(self.timing.report(), file=sys.stderr, flush=True)
+        self.flush_state()
+        self.maybe_snapshot(force=True)
+        if self.metrics is not None:
+            self.metrics.close()
+        if self.control is not None:
+            self.control.close()
+        self.watchdog.close()
+        self.state_writer.close()
+        self.favorites.close()
+        self.hashes.close()
+        self.embedded.close()
+        self.thumb_store.close()
+        self.readahead.close()
+        self._last_img = None   # may wrap a decoder slot
+        self._last_full = None
+        self.cache.close()
+        self.finish_slide_view()
+        self.history.close()
         pygame.quit()
 
+def print_history_report(photos_dir: str, data_dir: str, kind: str, limit: int) -> None:
+    photos_dir = os.path.abspath(photos_dir)
+    history = ViewHistory(os.path.abspath(data_dir))
+    history.load()
+    rows = history.report(kind, scan_media_catalog(photos_dir), photos_dir, limit)
+    print(f"{'shows':>6} {'skips':>6} {'avg dwell':>9}  {'last shown':<16}  path")
+    for path, (shows, skips, dwell, last) in rows:
+        avg = dwell / shows if shows else 0.0
+        when = datetime.datetime.fromtimestamp(last).strftime("%Y-%m-%d %H:%M") if last else "-"
+        print(f"{shows:>6} {skips:>6} {avg:>8.1f}s  {when:<16}  {safe_relpath(path, photos_dir)}")
+
+
 def main() -> None:
     args = parse_args()
 
@@ -1724,12 +6622,17 @@ def main() -> None:
 
     os.makedirs(data_dir, exist_ok=True)
 
+    if args.report:
+        print_history_report(photos_dir, data_dir, args.report, args.report_limit)
+        return
+
     cfg = Config(
         photos_dir=photos_dir,
         data_dir=data_dir,
         fullscreen=fullscreen,
         slide_seconds=args.seconds,
         rescan_interval_sec=args.rescan,
+        profile_window_seconds=args.profile,
     )
     #print("WINDOWED ARG:", args.windowed, "CFG FULLSCREEN:", cfg.fullscreen, "OS:", os.name)
 